@@ -1,19 +1,24 @@
 import os
-from fastapi import FastAPI, HTTPException
+import re
+import json
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.datastructures import Headers, MutableHeaders
 from pydantic import BaseModel
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline, BitsAndBytesConfig
 # from janus.models import MultiModalityCausalLM, VLChatProcessor
 # from janus.utils.io import load_pil_images
 from typing import List, Optional
+# torch/transformers are imported inside load_model, so the server accepts connections right away
+from inference_queue import InferenceExecutor, QueueFullError, RequestDeadline
+from response_cache import ResponseCache
+from model_registry import ModelEntry, ModelRegistry, UnknownModelError
+from micro_batching import plan_micro_batches, generate_micro_batch
+from context_packing import pack_context
+import metrics
 
-# Initialize FastAPI app
-app = FastAPI()
-
-# Explicitly handle VRAM and offloading
-bnb_config = BitsAndBytesConfig(
-    load_in_8bit=True,
-    llm_int8_enable_fp32_cpu_offload=True,  # Offload large layers to CPU when needed
-)
 # Load the model and tokenizer
 # MODEL_NAME = "EleutherAI/gpt-neo-2.7B"  # Replace with your Llama model if needed
 # MODEL_NAME = "meta-llama/Llama-2-7b-hf"
@@ -22,103 +27,705 @@ bnb_config = BitsAndBytesConfig(
 MODEL_NAME = "meta-llama/Llama-3.2-3B-Instruct"
 # MODEL_NAME = "deepseek-ai/Janus-Pro-7B" # soon to test, TODO: janus deepseek model 
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_auth_token=True)
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    device_map="auto",          # Automatically uses GPU (and CPU if needed)
-    quantization_config=bnb_config,  # Use the efficient quantization
-    torch_dtype="auto",         # Use appropriate precision
-    token=os.getenv("hgf_access_token")  # Use your environment variable
+# Models a request may ask for, comma separated; the first one is the default
+AVAILABLE_MODELS = os.getenv("AVAILABLE_MODELS", MODEL_NAME).split(",")
+# Evict idle models (least recently used first) to stay under this many GB; unset means no limit
+MODEL_MEMORY_BUDGET_GB = os.getenv("MODEL_MEMORY_BUDGET_GB")
+
+
+def load_model(name):
+    """
+    Loads one model (once) and builds its pipeline and batching scheduler.
+    """
+    from transformers import AutoTokenizer, AutoModelForCausalLM, BitsAndBytesConfig
+
+    # Explicitly handle VRAM and offloading
+    bnb_config = BitsAndBytesConfig(
+        load_in_8bit=True,
+        llm_int8_enable_fp32_cpu_offload=True,  # Offload large layers to CPU when needed
+    )
+    tokenizer = AutoTokenizer.from_pretrained(name, token=os.getenv("hgf_access_token"))
+    model = AutoModelForCausalLM.from_pretrained(
+        name,
+        device_map="auto",          # Automatically uses GPU (and CPU if needed)
+        quantization_config=bnb_config,  # Use the efficient quantization
+        torch_dtype="auto",         # Use appropriate precision
+        low_cpu_mem_usage=True,     # Stream safetensors shards (memory-mapped) instead of copying them
+        token=os.getenv("hgf_access_token")  # Use your environment variable
+    )
+    return make_entry(name, model, tokenizer)
+
+
+def estimate_model_bytes(name):
+    """
+    Memory `name` will take once load_model has loaded it, from its config alone (no
+    weights are downloaded): linear layers in 8 bits, everything else in the checkpoint dtype.
+    """
+    import torch
+    from transformers import AutoConfig, AutoModelForCausalLM
+
+    config = AutoConfig.from_pretrained(name, token=os.getenv("hgf_access_token"))
+    with torch.device("meta"):  # Shapes only, nothing allocated
+        model = AutoModelForCausalLM.from_config(config)
+    dtype = config.torch_dtype or torch.float32
+    if isinstance(dtype, str):
+        dtype = getattr(torch, dtype)
+    params = sum(p.numel() for p in model.parameters())
+    # bitsandbytes leaves the output layer unquantized
+    quantized = sum(
+        module.weight.numel() for module_name, module in model.named_modules()
+        if isinstance(module, torch.nn.Linear) and module_name != "lm_head"
+    )
+    return quantized + (params - quantized) * torch.empty((), dtype=dtype).element_size()
+
+
+def make_entry(name, model, tokenizer):
+    """
+    Wraps a loaded model in its pipeline and batching scheduler, configured from the environment.
+    """
+    from transformers import pipeline
+    from scheduler import ContinuousBatchScheduler
+
+    generator = pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+    # Continuous batching for /generate: concurrent requests share decode steps
+    scheduler = ContinuousBatchScheduler(
+        model,
+        tokenizer,
+        max_batch_size=int(os.getenv("MAX_BATCH_SIZE", "8")),
+        batch_window=float(os.getenv("BATCH_WINDOW_MS", "10")) / 1000,
+        max_queue=int(os.getenv("MAX_QUEUE_DEPTH", "32")),
+        name=name,
+    )
+    return ModelEntry(name, model, tokenizer, generator, scheduler)
+
+
+# Models are loaded on first request and evicted when the memory budget runs out
+registry = ModelRegistry(
+    load_model,
+    available=AVAILABLE_MODELS,
+    default=AVAILABLE_MODELS[0],
+    memory_budget=float(MODEL_MEMORY_BUDGET_GB) * 1024 ** 3 if MODEL_MEMORY_BUDGET_GB else None,
+    estimator=estimate_model_bytes,
 )
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-model = AutoModelForCausalLM.from_pretrained(
-    MODEL_NAME,
-    device_map="auto",          # Automatically uses GPU if available
-    torch_dtype="auto",         # Adjust precision based on hardware
-    load_in_8bit=True           # Enable 8-bit quantization for memory efficiency
+# Pipeline and micro-batch calls (batch_generate, llama) run here so they never block the event loop
+executor = InferenceExecutor(max_queue=int(os.getenv("MAX_QUEUE_DEPTH", "32")))
+# /batch_generate runs prompts in micro-batches of similar length, each padded to at most
+# this many tokens in total (prompt + generation), instead of one batch of every prompt
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", "8192"))
+MAX_MICRO_BATCH = int(os.getenv("MAX_MICRO_BATCH", "16"))
+# Upper bound on the tokens one answer may generate, whatever the request asks for
+MAX_NEW_TOKENS = int(os.getenv("MAX_NEW_TOKENS", "1024"))
+# Seconds after which a request without its own "timeout" stops generating; unset means no limit
+REQUEST_TIMEOUT = os.getenv("REQUEST_TIMEOUT")
+# Tokens of retrieved context a prompt may hold; the best chunks that fit are kept
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+# Chunks at least this similar (estimated Jaccard of word 3-grams) to a kept one are dropped
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# How often a waiting request checks whether its client is still connected
+DISCONNECT_POLL_SECONDS = 0.25
+# Repeated prompts are answered from here instead of re-running the model
+response_cache = ResponseCache(
+    max_entries=int(os.getenv("RESPONSE_CACHE_SIZE", "256")),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "3600")),
+    disk_dir=os.getenv("RESPONSE_CACHE_DIR"),  # Unset keeps the cache in memory only
+    max_disk_entries=int(os.getenv("RESPONSE_CACHE_DISK_ENTRIES", "10000")),
 )
-generator = pipeline("text-generation", model=model, tokenizer=tokenizer)
+
+# Static start of every prompt built with retrieved context. It ends with the line break so that
+# its last token does not change with the context (Llama-3 encodes ":\n" as one token).
+CONTEXT_PROMPT_HEADER = "Use the following retrieved context to answer the query.\n\n### Context:\n"
+# Start of every prompt built without context
+QUERY_PROMPT_HEADER = "Query: "
+
+# Prompt prefixes whose keys/values every loaded model keeps warm.
+# The context header is shared by every RAG answer; clients can add more via /register_prefix.
+registered_prefixes = [CONTEXT_PROMPT_HEADER]
+
+
+def warm_up(entry):
+    """
+    Runs once per freshly loaded model, before it serves traffic.
+    """
+    import torch
+
+    for prefix in registered_prefixes:
+        entry.scheduler.register_prefix(prefix)
+    # One tiny forward pass so kernels and allocator pools are ready for the first user
+    with torch.no_grad():
+        inputs = entry.tokenizer(f"{QUERY_PROMPT_HEADER}hello\nAnswer:", return_tensors="pt")
+        entry.model(input_ids=inputs["input_ids"].to(entry.model.device))
+
+
+registry.add_warmup_hook(warm_up)
+
+# Set when the background load of the default model fails, so /ready can say why
+preload_error = None
+
+
+async def preload_default_model():
+    """
+    Loads the default model in the background while the server already answers /healthz.
+    """
+    global preload_error
+    try:
+        registry.release(await registry.acquire())
+    except Exception as e:
+        preload_error = str(e)
+        print(f"Error: could not load {registry.default}: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    task = None
+    if os.getenv("PRELOAD_MODEL", "1") == "1":
+        task = asyncio.create_task(preload_default_model())
+    yield
+    if task:
+        task.cancel()
+
+
+# Initialize FastAPI app
+app = FastAPI(lifespan=lifespan)
+
+
+class RequestTracking:
+    """
+    Tags each request with an id (the caller's X-Request-ID, e.g. from Agent Kitty, or a new one),
+    echoes it back, and records request counts, latency and error statuses in /metrics.
+
+    Plain ASGI rather than @app.middleware("http"), whose wrapper hides client
+    disconnects from the endpoints (see until_disconnected).
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        rid = Headers(scope=scope).get("X-Request-ID") or metrics.new_request_id()
+        metrics.request_id.set(rid)
+        started = time.perf_counter()
+        endpoint = scope["path"]
+
+        async def send_tracked(message):
+            if message["type"] == "http.response.start":
+                MutableHeaders(scope=message)["X-Request-ID"] = rid
+                status = message["status"]
+                if endpoint != "/metrics":
+                    metrics.REQUESTS.inc(endpoint=endpoint, status=status)
+                    metrics.REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint)
+                    if status >= 400:
+                        metrics.ERRORS.inc(endpoint=endpoint, reason=str(status))
+            await send(message)
+
+        await self.app(scope, receive, send_tracked)
+
+
+app.add_middleware(RequestTracking)
+
+
+def log_error(e):
+    print(f"[{metrics.request_id.get()}] Error: {e}")
 
 # Define input schema
 class InferenceRequest(BaseModel):
     prompts: Optional[List[str]] = None  # For batch generation
-    context: Optional[str] = None  # For single prompt with context
+    context: Optional[str] = None  # For single prompt with context; split into chunks at blank lines
+    contexts: Optional[List[str]] = None  # Retrieved chunks, best first, instead of `context`
+    context_budget: Optional[int] = None  # Tokens of context to keep; CONTEXT_TOKEN_BUDGET when omitted
     query: Optional[str] = None  # Query for single prompt generation
-    max_length: int = 200  # Maximum length of generated text
+    max_length: int = 200  # /generate: tokens to generate; /batch_generate: prompt + generated tokens
+    max_new_tokens: Optional[int] = None  # /batch_generate: tokens to generate per prompt, instead of max_length
+    json_schema: Optional[dict] = None  # Constrain the answer to JSON matching this schema
+    model: Optional[str] = None  # One of AVAILABLE_MODELS; the default model when omitted
+    stream: bool = False  # /batch_generate: send each answer as NDJSON as soon as it is ready
+    timeout: Optional[float] = None  # Seconds to spend generating; what is done by then is returned
+    stop: Optional[List[str]] = None  # /generate: end the answer at the first of these strings
+
+
+class PrefixRequest(BaseModel):
+    query_prefix: str  # Static beginning of the `query` field that many requests share
+
+
+def set_queue_headers(response: Response, stats):
+    """
+    Reports how busy the server was for this request.
+    """
+    response.headers["X-Queue-Depth"] = str(stats["queue_depth"])
+    response.headers["X-Queue-Wait-Ms"] = f"{stats['queue_wait'] * 1000:.1f}"
+
+
+def queue_full(e: QueueFullError):
+    """
+    Fast rejection when the inference queue is saturated.
+    """
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+
+def make_deadline(request: InferenceRequest):
+    timeout = request.timeout or (float(REQUEST_TIMEOUT) if REQUEST_TIMEOUT else None)
+    return RequestDeadline(timeout)
+
+
+def new_token_budget(request: InferenceRequest):
+    """
+    Tokens /generate may produce: the caller's max_new_tokens or max_length, capped at MAX_NEW_TOKENS.
+    """
+    return max(1, min(request.max_new_tokens or request.max_length, MAX_NEW_TOKENS))
+
+
+class GuardedStreamingResponse(StreamingResponse):
+    """
+    StreamingResponse that awaits `cleanup()` however the response ends. A generator's own
+    finally does not run if the client disconnects before the body starts streaming.
+    """
+    def __init__(self, content, cleanup, **kwargs):
+        super().__init__(content, **kwargs)
+        self.cleanup = cleanup
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.cleanup()
+
+
+async def until_disconnected(http_request: Request, work, deadline=None):
+    """
+    Awaits `work`, but gives up on it as soon as the client disconnects: the work is
+    cancelled (and `deadline` with it, for model calls running on a worker thread)
+    and a 499 is returned, so no more tokens are generated for a closed connection.
+    """
+    task = asyncio.ensure_future(work)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                print(f"[{metrics.request_id.get()}] Client disconnected, generation cancelled")
+                raise HTTPException(status_code=499, detail="Client closed the request.")
+    finally:
+        if not task.done():
+            task.cancel()
+            if deadline is not None:
+                deadline.cancel()
+
+
+def unknown_model(e: UnknownModelError):
+    return HTTPException(status_code=400, detail=f"Unknown model {e.args[0]!r}. Available: {', '.join(registry.available)}")
+
+
+def build_prompt(request: InferenceRequest, context=None):
+    """
+    Builds the single-generation prompt, with the retrieved context when one is given.
+    """
+    # Handle cases where context is optional
+    if context:
+        # prompt = f"Context: {context}\n\nQuery: {request.query}\nAnswer:"
+        return (
+            f"{CONTEXT_PROMPT_HEADER}{context}\n\n"
+            f"### Query:\n{request.query}\n\n"
+            f"### Answer:"
+        )
+    return f"{QUERY_PROMPT_HEADER}{request.query}\nAnswer:"
+
+
+async def prepare_prompt(request: InferenceRequest, entry):
+    """
+    Builds the prompt with as much of the context as fits the token budget, measured
+    with the model's tokenizer, after dropping near-duplicate chunks.
+    Returns (prompt, packing), where packing says which chunks were used (None without context).
+    """
+    chunks = request.contexts
+    if chunks is None and request.context:
+        chunks = re.split(r"\n\s*\n", request.context)
+    if not chunks:
+        return build_prompt(request), None
+
+    budget = request.context_budget or CONTEXT_TOKEN_BUDGET
+    packed = await asyncio.to_thread(pack_context, entry.tokenizer, chunks, budget, CONTEXT_DEDUP_THRESHOLD)
+    metrics.CONTEXT_TOKENS.observe(packed["tokens"], model=entry.name)
+    for outcome in ("used", "duplicates", "over_budget"):
+        if packed[outcome]:
+            metrics.CONTEXT_CHUNKS.inc(len(packed[outcome]), model=entry.name, outcome=outcome)
+    packing = {key: value for key, value in packed.items() if key != "text"}
+    return build_prompt(request, packed["text"]), packing
 
 
 async def llama(prompt):         
-    response = generator(
-        prompt, 
-        max_length=400, 
-        num_return_sequences=1,
-        truncation=True
-    )
+    async with registry.use() as entry:
+        response, _ = await executor.run(
+            entry.generator,
+            prompt, 
+            max_length=400, 
+            num_return_sequences=1,
+            truncation=True
+        )
     return response[0]["generated_text"]
 
 
+async def run_micro_batches(entry, prompts, max_length=None, max_new_tokens=None, deadline=None):
+    """
+    Tokenizes the prompts once, buckets them by length into micro-batches sized by
+    BATCH_TOKEN_BUDGET, and yields (index, text, stats) as each micro-batch finishes.
+    No prompt generates more than MAX_NEW_TOKENS, whatever max_length/max_new_tokens ask for.
+    Each micro-batch is a separate executor job, so other requests interleave with big batches.
+    Once `deadline` expires, the running micro-batch yields what it generated so far, with
+    stats["finish_reason"] set to the deadline's reason, and the remaining prompts are left unanswered.
+    """
+    encoded = await asyncio.to_thread(entry.tokenizer, prompts)
+    prompt_ids = encoded["input_ids"]
+    lengths = [len(ids) for ids in prompt_ids]
+    # max_length counts the prompt, so each prompt gets whatever is left of it
+    new_tokens = [min(max_new_tokens or max_length - length, MAX_NEW_TOKENS) for length in lengths]
+
+    for i, count in enumerate(new_tokens):
+        if count <= 0:
+            yield i, "", None  # Prompt already fills max_length
+
+    runnable = [i for i, count in enumerate(new_tokens) if count > 0]
+    batches = plan_micro_batches(
+        [lengths[i] for i in runnable],
+        [new_tokens[i] for i in runnable],
+        token_budget=BATCH_TOKEN_BUDGET,
+        max_batch_size=MAX_MICRO_BATCH,
+    )
+    for batch in batches:
+        batch = [runnable[j] for j in batch]
+        started = time.perf_counter()
+        result, stats = await executor.run(
+            generate_micro_batch,
+            entry.model,
+            entry.tokenizer,
+            [prompt_ids[i] for i in batch],
+            [new_tokens[i] for i in batch],
+            deadline=deadline,
+        )
+        if result is None:
+            return  # Deadline passed or client gone before this micro-batch started
+        texts, stats["finish_reason"] = result
+        metrics.QUEUE_WAIT.observe(stats["queue_wait"], model=entry.name, endpoint="/batch_generate")
+        metrics.MICRO_BATCH_SECONDS.observe(time.perf_counter() - started - stats["queue_wait"], model=entry.name)
+        metrics.BATCH_SIZE.observe(len(batch), model=entry.name, stage="micro_batch")
+        for i, text in zip(batch, texts):
+            yield i, text, stats
+        if stats["finish_reason"]:
+            return  # Later micro-batches are not started
+
+
 @app.post("/batch_generate")
-async def batch_generate(request: InferenceRequest):
+async def batch_generate(request: InferenceRequest, response: Response, http_request: Request):
+    """
+    Generates for many prompts at once; responses keep the order of `prompts`.
+    With "stream": true, answers are sent as NDJSON as soon as each one is ready:
+    {"index": i, "response": "..."} per prompt, in completion order, then {"done": true}.
+    Answers cut short by the request's timeout hold what was generated in time, and
+    prompts not started by then are null (X-Finish-Reason: deadline either way).
+    """
     try:
         # Validate that prompts are provided
         if not request.prompts:
             raise HTTPException(status_code=400, detail="Prompts are required for batch generation.")
         
-        # Generate responses for all prompts in the batch
-        responses = generator(
-            request.prompts,
-            max_length=request.max_length,
-            num_return_sequences=1,
-            return_full_text=False
-        )
-        # Extract generated text
-        results = [response[0]["generated_text"] for response in responses]
+        # Only prompts without a cached answer go to the model
+        model_name = request.model or registry.default
+        # max_length counts the prompt too, so long prompts (e.g. document chunks) should set max_new_tokens
+        length = {"max_new_tokens": min(request.max_new_tokens, MAX_NEW_TOKENS)} if request.max_new_tokens else {"max_length": request.max_length}
+        keys = [response_cache.make_key(p, model=model_name, **length) for p in request.prompts]
+        results = [response_cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        hits = str(len(results) - len(missing))
+
+        deadline = make_deadline(request)
+
+        if request.stream:
+            return stream_batch(request, model_name, length, keys, results, missing, hits, deadline)
+
+        async def run_model():
+            # Generate responses for the remaining prompts in length-bucketed micro-batches
+            async with registry.use(model_name) as entry:
+                generated = run_micro_batches(entry, [request.prompts[i] for i in missing], deadline=deadline, **length)
+                async for j, text, stats in generated:
+                    if stats and "X-Queue-Depth" not in response.headers:
+                        set_queue_headers(response, stats)  # As seen by the first micro-batch
+                    results[missing[j]] = text
+                    if stats and stats["finish_reason"]:
+                        cut_short.append(missing[j])
+                    else:
+                        response_cache.put(keys[missing[j]], text)
+
+        cut_short = []  # Partial answers, which are not cached
+        if missing:
+            await until_disconnected(http_request, run_model(), deadline)
+            if cut_short or any(result is None for result in results):
+                response.headers["X-Finish-Reason"] = deadline.reason
+
+        response.headers["X-Cache-Hits"] = hits
         return {"responses": results}
+    except QueueFullError as e:
+        raise queue_full(e)
+    except UnknownModelError as e:
+        raise unknown_model(e)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
-    
+
+
+def stream_batch(request, model_name, length, keys, results, missing, hits, deadline):
+    """
+    NDJSON variant of /batch_generate: cached answers first, then each micro-batch as it finishes.
+    Answers cut short by the deadline carry "finish_reason": "deadline", and so does the
+    final line if some prompts were not answered in full.
+    """
+    # Reject now (400/503) rather than after the stream has started
+    if model_name not in registry.available:
+        raise UnknownModelError(model_name)
+    executor.check_capacity()
+
+    async def events():
+        for i, result in enumerate(results):
+            if result is not None:
+                yield json.dumps({"index": i, "response": result}) + "\n"
+        answered = len(results) - len(missing)
+        try:
+            if missing:
+                async with registry.use(model_name) as entry:
+                    generated = run_micro_batches(entry, [request.prompts[i] for i in missing], deadline=deadline, **length)
+                    async for j, text, stats in generated:
+                        line = {"index": missing[j], "response": text}
+                        if stats and stats["finish_reason"]:
+                            line["finish_reason"] = stats["finish_reason"]
+                        else:
+                            response_cache.put(keys[missing[j]], text)
+                            answered += 1  # Answered in full
+                        yield json.dumps(line) + "\n"
+            done = {"done": True}
+            if answered < len(results):
+                done["finish_reason"] = deadline.reason
+            yield json.dumps(done) + "\n"
+        except Exception as e:
+            log_error(e)
+            metrics.ERRORS.inc(endpoint="/batch_generate", reason="stream")
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            deadline.cancel()  # Also reached when the client disconnects mid-stream
+
+    return StreamingResponse(events(), media_type="application/x-ndjson", headers={"X-Cache-Hits": hits})
+
+def generate_key(request: InferenceRequest, prompt, model_name):
+    return response_cache.make_key(
+        prompt,
+        max_new_tokens=new_token_budget(request),
+        json_schema=request.json_schema,
+        stop=request.stop,
+        model=model_name,
+    )
+
+
 @app.post("/generate")
-async def generate(request: InferenceRequest):
+async def generate(request: InferenceRequest, response: Response, http_request: Request):
+    """
+    Answers one query. Generation stops at `max_length` new tokens, at a `stop` string,
+    or at the `timeout` (answering with what was generated by then; X-Finish-Reason
+    says which), and is abandoned if the client disconnects while waiting.
+    With context, the response's "context" lists the chunks that went into the prompt.
+    """
     try:
         # Validate that query is provided
         if not request.query:
             raise HTTPException(status_code=400, detail="Query is required for single generation.")
         
-        # Handle cases where context is optional
-        if request.context:
-            # prompt = f"Context: {request.context}\n\nQuery: {request.query}\nAnswer:"
-            prompt = (
-                f"Use the following retrieved context to answer the query.\n\n"
-                f"### Context:\n{request.context}\n\n"
-                f"### Query:\n{request.query}\n\n"
-                f"### Answer:"
+        model_name = request.model or registry.default
+        # One use for the whole request, so the model can't be swapped out between building
+        # the prompt and generating. Callers sharing a generation all hold this same model.
+        async with registry.use(model_name) as entry:
+            prompt, packing = await prepare_prompt(request, entry)
+            deadline = make_deadline(request)
+            finish = {}
+
+            async def run_model():
+                # Batched with any other in-flight /generate requests
+                generated_text, stats = await entry.scheduler.submit(
+                    prompt,
+                    max_new_tokens=new_token_budget(request),
+                    json_schema=request.json_schema,
+                    stop=request.stop,
+                    deadline=deadline,
+                )
+                set_queue_headers(response, stats)
+                response.headers["X-Finish-Reason"] = finish["reason"] = stats["finish_reason"]
+                return generated_text
+
+            # Identical concurrent prompts share one generation, unless a deadline could cut
+            # it short for callers that gave it longer; answers cut short aren't cached
+            key = generate_key(request, prompt, model_name)
+            generated_text, hit = await until_disconnected(
+                http_request,
+                response_cache.get_or_compute(
+                    key,
+                    run_model,
+                    cacheable=lambda _: finish.get("reason") != "deadline",
+                    coalesce=deadline.expires_at is None,
+                ),
             )
-        else:
-            prompt = f"Query: {request.query}\nAnswer:"
-        
-        response = generator(
-            prompt, 
-            # max_length=request.max_length, 
-            max_new_tokens=300,  # Allow up to 200 tokens for the output
-            # max_new_tokens=request.max_length
-            num_return_sequences=1
-        )
-        generated_text = response[0]["generated_text"]
+        response.headers["X-Cache"] = "HIT" if hit else "MISS"
         
         # Extract text after "Answer:"
         if "Answer:" in generated_text:
             generated_answer = generated_text.split("Answer:", 1)[-1].strip()
         else:
             generated_answer = generated_text.strip()
-            
+
+        if packing is not None:
+            return {"response": generated_answer, "context": packing}
         return {"response": generated_answer}
         # return {"response": response[0]["generated_text"]}
+    except QueueFullError as e:
+        raise queue_full(e)
+    except UnknownModelError as e:
+        raise unknown_model(e)
+    except HTTPException:
+        raise
     except Exception as e:
         # Log the error and return a clear message
-        print(f"Error: {e}")
+        log_error(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/generate_stream")
+async def generate_stream(request: InferenceRequest):
+    """
+    Same prompt as /generate, but streams the answer as newline-delimited JSON:
+    {"token": "..."} per decoded piece, then {"done": true, "response": "<full answer>",
+    "finish_reason": "eos" | "length" | "stop" | "deadline"}, plus "context" as in
+    /generate. Decoding stops when the client disconnects.
+    """
+    if not request.query:
+        raise HTTPException(status_code=400, detail="Query is required for single generation.")
+
+    model_name = request.model or registry.default
+    try:
+        # Held until the stream ends so the model isn't evicted mid-generation
+        entry = await registry.acquire(model_name)
+    except UnknownModelError as e:
+        raise unknown_model(e)
+    try:
+        prompt, packing = await prepare_prompt(request, entry)
+        key = generate_key(request, prompt, model_name)
+        cached = response_cache.get(key)
+        if cached is None:
+            pieces, stats = entry.scheduler.stream(
+                prompt,
+                max_new_tokens=new_token_budget(request),
+                json_schema=request.json_schema,
+                stop=request.stop,
+                deadline=make_deadline(request),
+            )
+    except QueueFullError as e:
+        registry.release(entry)
+        raise queue_full(e)
+    except BaseException:
+        registry.release(entry)
+        raise
+    context = {"context": packing} if packing is not None else {}
+
+    if cached is not None:
+        registry.release(entry)
+        answer = cached.split("Answer:", 1)[-1].strip()
+        lines = [json.dumps({"token": answer}) + "\n", json.dumps({"done": True, "response": answer, **context}) + "\n"]
+        return StreamingResponse(iter(lines), media_type="application/x-ndjson", headers={"X-Cache": "HIT"})
+
+    async def events():
+        answer = ""
+        try:
+            async for piece in pieces:
+                answer += piece
+                yield json.dumps({"token": piece}) + "\n"
+            if stats["finish_reason"] != "deadline":
+                response_cache.put(key, prompt + answer)  # Same shape as /generate caches
+            yield json.dumps({"done": True, "response": answer.strip(), "finish_reason": stats["finish_reason"], **context}) + "\n"
+        except Exception as e:
+            log_error(e)
+            metrics.ERRORS.inc(endpoint="/generate_stream", reason="stream")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    async def cleanup():
+        await pieces.aclose()  # Frees the decode slot if the client disconnected
+        registry.release(entry)
+
+    response = GuardedStreamingResponse(events(), cleanup, media_type="application/x-ndjson")
+    response.headers["X-Queue-Depth"] = str(stats["queue_depth"])
+    response.headers["X-Cache"] = "MISS"
+    return response
+
+
+@app.get("/healthz")
+async def healthz():
+    """
+    Liveness probe: the process is up and serving HTTP, whether or not a model is loaded.
+    """
+    return {"status": "ok"}
+
+
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe used by Agent Kitty's replica health checks.
+    Ready once the default model is loaded; 503 while it is still loading.
+    """
+    if registry.is_loaded():
+        return {"ready": True, "model": registry.default}
+    detail = {"ready": False, "model": registry.default, "error": preload_error}
+    raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+
+@app.post("/register_prefix")
+async def register_prefix(request: PrefixRequest):
+    """
+    Registers a static query prefix (e.g. a few-shot instruction block) whose keys/values
+    are cached, so prompts starting with it only encode what follows.
+    """
+    prefix = f"{QUERY_PROMPT_HEADER}{request.query_prefix}"
+    if prefix not in registered_prefixes:
+        registered_prefixes.append(prefix)  # Models loaded later pick it up in warm_up
+    tokens = 0
+    for entry in registry.loaded():
+        tokens = entry.scheduler.register_prefix(prefix)
+    return {"registered": True, "tokens": tokens}
+
+
+@app.get("/cache_stats")
+async def cache_stats():
+    """
+    Hit/miss counters for sizing the response and prefix caches.
+    """
+    return {
+        **response_cache.stats(),
+        "prefix_cache": {entry.name: entry.scheduler.prefix_stats() for entry in registry.loaded()},
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Prometheus scrape endpoint: request counts and latency, errors, queue wait, prefill
+    and decode timings, time to first token, batch sizes and generated tokens per model.
+    """
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/models")
+async def models():
+    """
+    Which models are available, which are loaded, and how much memory each one holds.
+    """
+    return registry.describe()
+
+
 # curl -X POST "http://127.0.0.1:8001/generate" \
 # -H "Content-Type: application/json" \
 # -d '{
@@ -0,0 +1,83 @@
+"""
+Chunking throughput on large synthetic documents (prose, headings, code and tables).
+
+Reports MB/s and chunk size statistics as JSON. Without --tokenizer, tokens are
+counted as words and punctuation; pass a local path or hub name of a Hugging Face
+tokenizer to measure with real tokenization.
+
+    python benchmarks/chunker_throughput.py --megabytes 20 --tokenizer sentence-transformers/all-MiniLM-L6-v2
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import Chunker
+
+WORDS = (
+    "retrieval augmented generation model index vector query token chunk context answer "
+    "document page section table code function return value error latency throughput"
+).split()
+
+
+def synthetic_pages(megabytes, seed):
+    # Page-sized pieces, like document_extraction.iter_pages produces
+    rng = random.Random(seed)
+    target = int(megabytes * 1024 * 1024)
+    produced = 0
+    page_number = 0
+    while produced < target:
+        parts = [f"# Section {page_number}"]
+        for _ in range(rng.randint(3, 8)):
+            sentences = (" ".join(rng.choices(WORDS, k=rng.randint(6, 25))).capitalize() + "." for _ in range(rng.randint(2, 6)))
+            parts.append(" ".join(sentences))
+        if page_number % 3 == 0:
+            parts.append("```python\n" + "\n".join(f"def f{i}(x):\n    return x * {i}" for i in range(rng.randint(5, 30))) + "\n```")
+        if page_number % 4 == 0:
+            parts.append("\n".join(f"| {rng.choice(WORDS)} | {rng.randint(0, 999)} |" for _ in range(rng.randint(5, 40))))
+        page = "\n\n".join(parts)
+        produced += len(page.encode("utf-8"))
+        page_number += 1
+        yield page
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--megabytes", type=float, default=10)
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--overlap", type=int, default=32)
+    parser.add_argument("--tokenizer", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    tokenizer = None
+    if args.tokenizer:
+        from transformers import AutoTokenizer
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer)
+
+    pages = list(synthetic_pages(args.megabytes, args.seed))  # Generated up front so it isn't timed
+    size = sum(len(page.encode("utf-8")) for page in pages)
+    chunker = Chunker(tokenizer, max_tokens=args.max_tokens, overlap=args.overlap)
+
+    start = time.perf_counter()
+    chunks = list(chunker.iter_chunks(pages))
+    seconds = time.perf_counter() - start
+
+    lengths = [len(chunk) for chunk in chunks]
+    print(json.dumps({
+        "tokenizer": args.tokenizer or "words",
+        "input_mb": size / 1024 / 1024,
+        "seconds": seconds,
+        "mb_per_s": size / 1024 / 1024 / seconds,
+        "chunks": len(chunks),
+        "mean_chunk_chars": statistics.mean(lengths),
+        "max_chunk_chars": max(lengths),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
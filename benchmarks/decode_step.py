@@ -0,0 +1,87 @@
+"""
+Decode-step cost of the continuous batching scheduler on the CPU stub model.
+
+Submits --batch prompts of about --prompt-tokens tokens each, every one asking for
+--new-tokens tokens, and times each decode step. Long prompts make the keys/values
+the scheduler moves between steps large next to the work of the step itself, so
+copying them shows up directly in ms/step. With --stagger, requests arrive that many
+seconds apart and join the running batch mid-decode.
+
+Prints JSON.
+
+    python benchmarks/decode_step.py --batch 8 --prompt-tokens 1024 --new-tokens 64 --hidden 256 --layers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from benchmarks.stub_model import CORPUS, build_stub_model  # noqa: E402
+from scheduler import ContinuousBatchScheduler  # noqa: E402
+
+
+def prompt(tokenizer, tokens, offset):
+    words = CORPUS.split()
+    text, start = "", offset
+    while len(tokenizer(text)["input_ids"]) < tokens:
+        text += " ".join(words[i % len(words)] for i in range(start, start + 64)) + " "
+        start += 64
+    ids = tokenizer(text)["input_ids"][:tokens]
+    return tokenizer.decode(ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=8)
+    parser.add_argument("--prompt-tokens", type=int, default=1024)
+    parser.add_argument("--new-tokens", type=int, default=64)
+    parser.add_argument("--hidden", type=int, default=256)
+    parser.add_argument("--layers", type=int, default=4)
+    parser.add_argument("--stagger", type=float, default=0.0)
+    args = parser.parse_args()
+
+    model, tokenizer = build_stub_model(hidden=args.hidden, layers=args.layers)
+    scheduler = ContinuousBatchScheduler(model, tokenizer, max_batch_size=args.batch, max_queue=args.batch)
+
+    steps = []
+    decode_step = scheduler._decode_step
+
+    def timed(seqs):
+        started = time.perf_counter()
+        decode_step(seqs)
+        steps.append((len(seqs), time.perf_counter() - started))
+
+    scheduler._decode_step = timed
+    prompts = [prompt(tokenizer, args.prompt_tokens, i * 7) for i in range(args.batch)]
+
+    async def run():
+        async def one(i, text):
+            await asyncio.sleep(i * args.stagger)
+            return await scheduler.submit(text, max_new_tokens=args.new_tokens)
+        return await asyncio.gather(*(one(i, text) for i, text in enumerate(prompts)))
+
+    started = time.perf_counter()
+    asyncio.run(run())
+    elapsed = time.perf_counter() - started
+    scheduler.close()
+
+    step_ms = [seconds * 1000 for _, seconds in steps]
+    tokens = sum(size for size, _ in steps)
+    print(json.dumps({
+        "batch": args.batch,
+        "prompt_tokens": args.prompt_tokens,
+        "new_tokens": args.new_tokens,
+        "decode_steps": len(steps),
+        "median_ms_per_step": round(statistics.median(step_ms), 2),
+        "p90_ms_per_step": round(sorted(step_ms)[int(0.9 * (len(step_ms) - 1))], 2),
+        "decode_tokens_per_s": round(tokens / (sum(step_ms) / 1000), 1),
+        "total_s": round(elapsed, 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
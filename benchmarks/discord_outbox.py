@@ -0,0 +1,137 @@
+"""
+API calls and wall time for posting !rag_query results and long answers to Discord,
+sending each part directly (one channel.send per match part and source line, one per
+1900-character answer part) versus through discord_outbox.Outbox.
+
+Threads are fake Discord channels that take --latency-ms per call and, like Discord,
+allow 5 messages per 5 seconds per channel; a call over the limit waits for the
+bucket to refill the way discord.py does after a 429. --threads commands post
+concurrently, each into its own thread. Prints JSON.
+
+    python benchmarks/discord_outbox.py --threads 4 --matches 5 --chunk-chars 1200 --answer-chars 5000
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import deque
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from discord_outbox import Outbox
+
+WORDS = "the model index vector query token chunk context answer document page section retrieval".split()
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+class FakeChannel:
+    """
+    Stands in for a discord.Thread: records calls and enforces a per-channel rate limit.
+    """
+    def __init__(self, channel_id, latency, rate=5, per=5.0):
+        self.id = channel_id
+        self.latency = latency
+        self.rate = rate
+        self.per = per
+        self.sent = deque()  # Times of recent calls
+        self.calls = 0
+        self.rate_limited = 0
+
+    async def send(self, content=None, embeds=None, file=None):
+        now = time.monotonic()
+        while self.sent and now - self.sent[0] >= self.per:
+            self.sent.popleft()
+        if len(self.sent) >= self.rate:
+            self.rate_limited += 1  # A 429; discord.py sleeps for Retry-After and tries again
+            await asyncio.sleep(self.per - (now - self.sent[0]))
+            return await self.send(content=content, embeds=embeds, file=file)
+        self.sent.append(now)
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return FakeMessage(content)
+
+
+def text(rng, chars):
+    words = []
+    while sum(len(word) + 1 for word in words) < chars:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:chars]
+
+
+async def post_direct(thread, matches, answer):
+    # What !rag_query and a long !query answer used to do
+    for i, (chunk, source, score) in enumerate(matches):
+        if len(chunk) <= 1900:
+            await thread.send(f"**📌 Match {i+1}:**\n🔹 *{chunk}*\n📝 **Source:** {source} (Score: {score:.4f})")
+            continue
+        parts = [chunk[j:j + 1900] for j in range(0, len(chunk), 1900)]
+        for part_num, part in enumerate(parts, start=1):
+            await thread.send(f"**📌 Match {i+1}, Part {part_num}:**\n🔹 *{part}*")
+        await thread.send(f"📝 **Source:** {source} (Score: {score:.4f})")
+    await thread.send("✅ **All relevant document chunks have been posted.**")
+    for j in range(0, len(answer), 1900):
+        await thread.send(answer[j:j + 1900])
+
+
+async def post_outbox(outbox, thread, matches, answer):
+    blocks = [
+        f"**📌 Match {i+1}:**\n🔹 *{chunk}*\n📝 **Source:** {source} (Score: {score:.4f})"
+        for i, (chunk, source, score) in enumerate(matches)
+    ]
+    await outbox.send(thread, *blocks, "✅ **All relevant document chunks have been posted.**")
+    await outbox.send(thread, answer)
+
+
+async def run(args, mode):
+    rng = random.Random(args.seed)
+    threads = [FakeChannel(i, args.latency_ms / 1000) for i in range(args.threads)]
+    work = [
+        ([(text(rng, args.chunk_chars), f"doc{m}.pdf", rng.random()) for m in range(args.matches)], text(rng, args.answer_chars))
+        for _ in threads
+    ]
+    outbox = Outbox()
+    finished = []
+
+    async def command(thread, matches, answer):
+        started = time.perf_counter()
+        if mode == "direct":
+            await post_direct(thread, matches, answer)
+        else:
+            await post_outbox(outbox, thread, matches, answer)
+        finished.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(command(thread, *items) for thread, items in zip(threads, work)))
+    return {
+        "api_calls": sum(thread.calls for thread in threads),
+        "rate_limited": sum(thread.rate_limited for thread in threads),
+        "seconds": time.perf_counter() - started,
+        "slowest_command_s": max(finished),
+        "mean_command_s": sum(finished) / len(finished),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--matches", type=int, default=5)
+    parser.add_argument("--chunk-chars", type=int, default=1200)
+    parser.add_argument("--answer-chars", type=int, default=5000)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    report = {"config": vars(args)}
+    for mode in ("direct", "outbox"):
+        report[mode] = asyncio.run(run(args, mode))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
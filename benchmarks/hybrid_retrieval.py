@@ -0,0 +1,132 @@
+"""
+Hit rate and latency of hybrid (BM25 + vector, rank-fused) retrieval against
+vector-only and keyword-only retrieval on a local corpus.
+
+Indexes the files under --corpus (default: this repository) the way !rag does, then
+asks two kinds of questions about randomly sampled chunks, the way users paste into
+!rag_query: a rare identifier from the chunk ("identifier") and a whole line of it
+("line"). A query hits if its source chunk comes back in the top k. With
+--rerank-model, hybrid retrieval followed by cross-encoder reranking is measured too.
+Prints JSON.
+
+    python benchmarks/hybrid_retrieval.py --corpus ~/projects/notebooks --queries 300 --k 5
+"""
+import argparse
+import json
+import os
+import random
+import re
+import statistics
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chunker import Chunker
+from document_extraction import iter_pages
+from embeddings import Embedder
+from keyword_index import tokenize
+from rag_engine import RagEngine
+from reranker import Reranker
+from vector_store import VectorStore
+
+EXTENSIONS = {"py", "ipynb", "md", "txt", "pdf"}
+IDENTIFIER = re.compile(r"\b(?:[A-Za-z]+_\w+|[a-z]+[A-Z]\w*|[A-Z][a-z]+[A-Z]\w*)\b")
+
+
+def corpus_files(root):
+    for directory, dirs, files in os.walk(root):
+        dirs[:] = [name for name in dirs if not name.startswith(".") and name not in ("__pycache__", "node_modules")]
+        for name in sorted(files):
+            if name.rsplit(".", 1)[-1].lower() in EXTENSIONS:
+                yield os.path.join(directory, name)
+
+
+def make_queries(chunks, count, rng):
+    # (kind, query, chunk index) for chunks that have something distinctive to ask about
+    document_frequency = Counter(term for chunk in chunks for term in set(tokenize(chunk)))
+    queries = []
+    for index in rng.sample(range(len(chunks)), min(count, len(chunks))):
+        chunk = chunks[index]
+        identifiers = sorted(set(IDENTIFIER.findall(chunk)), key=lambda word: (document_frequency[word.lower()], word))
+        if identifiers:
+            queries.append(("identifier", identifiers[0], index))
+        lines = [line.strip() for line in chunk.splitlines() if len(line.split()) >= 4]
+        if lines:
+            queries.append(("line", rng.choice(lines), index))
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument("--model", default="all-MiniLM-L6-v2", help="Sentence-transformers embedding model")
+    parser.add_argument("--rerank-model", default=None, help="Cross-encoder, e.g. cross-encoder/ms-marco-MiniLM-L-6-v2")
+    parser.add_argument("--queries", type=int, default=200, help="Chunks sampled; each gives up to two queries")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--chunk-tokens", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    embedder = Embedder(args.model)
+    # No latency budget here: every query is reranked so the quality difference is measured
+    reranker = Reranker(args.rerank_model, budget_ms=float("inf")) if args.rerank_model else None
+    engine = RagEngine(VectorStore(index_type="flat"), embedder, reranker=reranker)
+    chunker = Chunker(embedder.tokenizer, max_tokens=min(args.chunk_tokens, embedder.max_tokens), overlap=32)
+
+    chunks = []
+    start = time.perf_counter()
+    for path in corpus_files(args.corpus):
+        try:
+            pages = list(iter_pages(path, path.rsplit(".", 1)[-1].lower()))
+        except Exception as e:
+            print(f"Skipping {path}: {e}", file=sys.stderr)
+            continue
+        document = [chunk for chunk in chunker.iter_chunks(pages) if chunk.strip()]
+        # Chunks are numbered across the whole corpus so a hit can be traced to its query
+        engine.add_chunks("bench", os.path.relpath(path, args.corpus), document, first_chunk=len(chunks))
+        chunks.extend(document)
+    index_seconds = time.perf_counter() - start
+    if not chunks:
+        sys.exit(f"No indexable files under {args.corpus}")
+
+    queries = make_queries(chunks, args.queries, random.Random(args.seed))
+    engine.query("bench", queries[0][1], args.k, mode="hybrid")  # Warm up the models and build the keyword index
+
+    results = {}
+    for name in ("vector", "keyword", "hybrid", "hybrid+rerank"):
+        if name == "hybrid+rerank" and reranker is None:
+            continue
+        mode, _, rerank = name.partition("+")
+        per_kind = {}
+        for kind, query, index in queries:
+            started = time.perf_counter()
+            hits = engine.query("bench", query, args.k, mode=mode, rerank=bool(rerank))
+            elapsed = time.perf_counter() - started
+            ranks = [rank for rank, hit in enumerate(hits, start=1) if hit["metadata"]["chunk"] == index]
+            stats = per_kind.setdefault(kind, {"hits": 0, "reciprocal_ranks": [], "latencies": []})
+            stats["hits"] += bool(ranks)
+            stats["reciprocal_ranks"].append(1 / ranks[0] if ranks else 0.0)
+            stats["latencies"].append(elapsed)
+        results[name] = {
+            kind: {
+                "queries": len(stats["latencies"]),
+                "hit_rate_at_k": stats["hits"] / len(stats["latencies"]),
+                "mrr": statistics.mean(stats["reciprocal_ranks"]),
+                "p50_ms": statistics.median(stats["latencies"]) * 1000,
+                "mean_ms": statistics.mean(stats["latencies"]) * 1000,
+            }
+            for kind, stats in per_kind.items()
+        }
+
+    print(json.dumps({
+        "corpus": args.corpus,
+        "chunks": len(chunks),
+        "index_s": index_seconds,
+        "k": args.k,
+        "results": results,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
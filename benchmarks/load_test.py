@@ -0,0 +1,302 @@
+"""
+Load test for the MicroRag API: replays a traffic mix against /generate and
+/batch_generate at several concurrency levels and reports latency percentiles,
+throughput and the server's peak memory as JSON.
+
+By default it starts benchmarks/stub_server.py (app.py with a tiny CPU model), so
+it runs anywhere; --model serves a real model through app.py instead, and --url
+targets a server that is already running (peak RSS is then not measured).
+
+Traffic is reproducible from --seed. Each request is one of:
+  generate          /generate with a query only
+  generate_context  /generate with a retrieved-context block
+  batch             /batch_generate with --batch-prompts prompts
+picked by the weights in --mix. Prompt lengths (in words) are drawn from
+--prompt-words, e.g. "16:0.6,128:0.3,512:0.1". Every prompt is unique, so the
+response cache never answers for the model.
+
+    python benchmarks/load_test.py run --concurrency 1,4,16 --requests 64 --output base.json
+    python benchmarks/load_test.py compare base.json new.json --tolerance 0.1
+
+compare exits non-zero when a latency percentile, throughput or peak RSS got worse
+by more than the tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = (
+    "what how why does the model index vector query token chunk context answer document "
+    "page section table code function return value error latency throughput retrieval"
+).split()
+KINDS = ("generate", "generate_context", "batch")
+
+
+def parse_weights(spec, cast=str):
+    # "a:0.6,b:0.4" -> ([a, b], [0.6, 0.4])
+    values, weights = [], []
+    for item in spec.split(","):
+        value, _, weight = item.partition(":")
+        values.append(cast(value.strip()))
+        weights.append(float(weight or 1))
+    return values, weights
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def pick(q):
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+    return {"p50_ms": pick(0.50), "p95_ms": pick(0.95), "p99_ms": pick(0.99), "mean_ms": statistics.mean(ordered) * 1000}
+
+
+class Traffic:
+    """
+    Deterministic stream of request payloads for the configured mix.
+    """
+    def __init__(self, args, label=""):
+        self.rng = random.Random(f"{label}{args.seed}")
+        self.label = label  # Keeps e.g. warm-up prompts apart from the measured ones
+        self.kinds, self.kind_weights = parse_weights(args.mix)
+        unknown = set(self.kinds) - set(KINDS)
+        if unknown:
+            sys.exit(f"Unknown request kinds in --mix: {', '.join(sorted(unknown))}")
+        self.lengths, self.length_weights = parse_weights(args.prompt_words, int)
+        self.batch_prompts = args.batch_prompts
+        self.max_new_tokens = args.max_new_tokens
+        self.context_words = args.context_words
+        self.count = 0
+
+    def text(self):
+        self.count += 1
+        words = self.rng.choices(self.lengths, self.length_weights)[0]
+        return f"#{self.label}{self.count} " + " ".join(self.rng.choices(WORDS, k=words))
+
+    def next(self):
+        kind = self.rng.choices(self.kinds, self.kind_weights)[0]
+        if kind == "batch":
+            prompts = [self.text() for _ in range(self.batch_prompts)]
+            return kind, "/batch_generate", {"prompts": prompts, "max_new_tokens": self.max_new_tokens}
+        payload = {"query": self.text(), "max_length": self.max_new_tokens}
+        if kind == "generate_context":
+            payload["context"] = " ".join(self.rng.choices(WORDS, k=self.context_words))
+        return kind, "/generate", payload
+
+
+async def run_level(session, url, traffic, concurrency, requests):
+    planned = [traffic.next() for _ in range(requests)]
+    latencies = {kind: [] for kind in KINDS}
+    errors = {}
+    completed_prompts = 0
+    queue = asyncio.Queue()
+    for item in planned:
+        queue.put_nowait(item)
+
+    async def worker():
+        nonlocal completed_prompts
+        while not queue.empty():
+            kind, path, payload = queue.get_nowait()
+            started = time.perf_counter()
+            try:
+                async with session.post(f"{url}{path}", json=payload) as response:
+                    await response.read()
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status = type(e).__name__
+            if status == 200:
+                latencies[kind].append(time.perf_counter() - started)
+                completed_prompts += len(payload.get("prompts", [None]))
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    ok = [latency for samples in latencies.values() for latency in samples]
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput_rps": len(ok) / elapsed,
+        "prompts_per_s": completed_prompts / elapsed,
+        "latency": {
+            "all": percentiles(ok),
+            **{kind: percentiles(samples) for kind, samples in latencies.items() if samples},
+        },
+    }
+
+
+def peak_rss_mb(pid):
+    # VmHWM is the process's peak resident set so far (Linux only)
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_server(args):
+    port = free_port()
+    env = {**os.environ, "PRELOAD_MODEL": "1", "STUB_HIDDEN": str(args.stub_hidden), "STUB_LAYERS": str(args.stub_layers)}
+    target = "benchmarks.stub_server:app"
+    if args.model:
+        env["AVAILABLE_MODELS"] = args.model
+        target = "app:app"
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", target, "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=sys.stderr,  # Keeps server logs out of the JSON report
+    )
+    return server, f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(url, server, timeout):
+    deadline = time.perf_counter() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.perf_counter() < deadline:
+            if server is not None and server.poll() is not None:
+                sys.exit("Server exited before it was ready")
+            try:
+                async with session.get(f"{url}/ready") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    sys.exit(f"Server not ready after {timeout}s")
+
+
+async def run(args):
+    server = None
+    url = args.url
+    if not url:
+        server, url = start_server(args)
+    try:
+        await wait_ready(url, server, args.ready_timeout)
+        traffic = Traffic(args)
+        levels = []
+        timeout = aiohttp.ClientTimeout(total=args.request_timeout)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            await run_level(session, url, Traffic(args, "warmup-"), 1, args.warmup)  # Kernels, allocator, first-token paths
+            for concurrency in args.concurrency:
+                level = await run_level(session, url, traffic, concurrency, args.requests)
+                level["peak_rss_mb"] = peak_rss_mb(server.pid) if server else None
+                levels.append(level)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    peak = None
+    if server is not None:
+        # ru_maxrss of reaped children is in KB on Linux (bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    config = {key: value for key, value in vars(args).items() if key not in ("command", "output")}
+    return {"config": config, "peak_rss_mb": peak, "levels": levels}
+
+
+def compare(baseline, candidate, tolerance):
+    """
+    Relative change of every shared metric; lower is better except throughput.
+    """
+    findings = []
+
+    def check(name, old, new, higher_is_better=False):
+        if old is None or new is None or old == 0:
+            return
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        findings.append({"metric": name, "baseline": old, "candidate": new, "change": change, "regression": worse > tolerance})
+
+    check("peak_rss_mb", baseline.get("peak_rss_mb"), candidate.get("peak_rss_mb"))
+    new_levels = {level["concurrency"]: level for level in candidate["levels"]}
+    for old_level in baseline["levels"]:
+        new_level = new_levels.get(old_level["concurrency"])
+        if new_level is None:
+            continue
+        prefix = f"c{old_level['concurrency']}"
+        check(f"{prefix}.throughput_rps", old_level["throughput_rps"], new_level["throughput_rps"], higher_is_better=True)
+        for kind, old_stats in old_level["latency"].items():
+            new_stats = new_level["latency"].get(kind)
+            if old_stats and new_stats:
+                for key in ("p50_ms", "p95_ms", "p99_ms"):
+                    check(f"{prefix}.{kind}.{key}", old_stats[key], new_stats[key])
+        if new_level["errors"] and not old_level["errors"]:
+            findings.append({"metric": f"{prefix}.errors", "baseline": {}, "candidate": new_level["errors"], "regression": True})
+    return findings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the load test")
+    run_parser.add_argument("--url", default=None, help="Test a running server instead of starting one")
+    run_parser.add_argument("--model", default=None, help="Serve this model with app.py instead of the stub")
+    run_parser.add_argument("--stub-hidden", type=int, default=64)
+    run_parser.add_argument("--stub-layers", type=int, default=2)
+    run_parser.add_argument("--concurrency", type=lambda s: [int(c) for c in s.split(",")], default=[1, 4, 16])
+    run_parser.add_argument("--requests", type=int, default=64, help="Requests per concurrency level")
+    run_parser.add_argument("--warmup", type=int, default=4)
+    run_parser.add_argument("--mix", default="generate:0.5,generate_context:0.3,batch:0.2")
+    run_parser.add_argument("--prompt-words", default="16:0.6,128:0.3,512:0.1")
+    run_parser.add_argument("--context-words", type=int, default=300)
+    run_parser.add_argument("--batch-prompts", type=int, default=8)
+    run_parser.add_argument("--max-new-tokens", type=int, default=32)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--ready-timeout", type=float, default=600)
+    run_parser.add_argument("--request-timeout", type=float, default=600)
+    run_parser.add_argument("--output", default=None, help="Also write the JSON report here")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions between two reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.add_argument("--tolerance", type=float, default=0.10, help="Allowed relative slowdown, e.g. 0.1 for 10%%")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        report = asyncio.run(run(args))
+        text = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                f.write(text)
+        print(text)
+        return
+
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding="utf-8") as f:
+        candidate = json.load(f)
+    findings = compare(baseline, candidate, args.tolerance)
+    regressions = [finding for finding in findings if finding["regression"]]
+    print(json.dumps({"tolerance": args.tolerance, "regressions": regressions, "compared": findings}, indent=2))
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Cold-start benchmark for the API and the bot.
+
+Measures, in fresh interpreters:
+  - import time of app.py (without the background model load)
+  - import time of kitty_bot.py (without connecting to Discord)
+  - time until a uvicorn-served app answers /healthz
+
+Prints JSON. With --max-seconds, exits non-zero if any median exceeds it,
+so a regression (e.g. a heavy import creeping back to module level) shows up in review.
+
+    python benchmarks/startup_time.py --runs 5 --max-seconds 2
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def time_import(module, runs):
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    env = {**os.environ, "PRELOAD_MODEL": "0"}
+    samples = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=env, capture_output=True, text=True)
+        if out.returncode != 0:
+            return {"error": out.stderr.strip().splitlines()[-1] if out.stderr else "failed"}
+        samples.append(float(out.stdout.strip().splitlines()[-1]))
+    return {"median_s": statistics.median(samples), "samples_s": samples}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_healthz(runs, timeout=60):
+    samples = []
+    for _ in range(runs):
+        port = free_port()
+        env = {**os.environ, "PRELOAD_MODEL": "0"}
+        start = time.perf_counter()
+        server = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--port", str(port)],
+            cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        )
+        try:
+            while time.perf_counter() - start < timeout:
+                if server.poll() is not None:
+                    return {"error": server.stderr.read().decode().strip().splitlines()[-1]}
+                try:
+                    urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1)
+                    samples.append(time.perf_counter() - start)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+            else:
+                return {"error": f"/healthz did not answer within {timeout}s"}
+        finally:
+            server.terminate()
+            server.wait()
+    return {"median_s": statistics.median(samples), "samples_s": samples}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if any median is slower than this")
+    args = parser.parse_args()
+
+    results = {
+        "import_app": time_import("app", args.runs),
+        "import_kitty_bot": time_import("kitty_bot", args.runs),
+        "api_healthz": time_healthz(args.runs),
+    }
+    print(json.dumps(results, indent=2))
+
+    if args.max_seconds is not None:
+        slow = [name for name, r in results.items() if r.get("median_s", 0) > args.max_seconds]
+        if slow:
+            print(f"Startup regression: {', '.join(slow)} slower than {args.max_seconds}s", file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
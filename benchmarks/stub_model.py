@@ -0,0 +1,69 @@
+"""
+A tiny, randomly initialised Llama-style model and byte-level BPE tokenizer, built in
+memory from a fixed seed, so the serving path can run on a CPU without downloads.
+Served by benchmarks/stub_server.py and used by the tests.
+
+Its end-of-sequence id lies outside the vocabulary, which makes every request decode
+exactly the number of tokens it asks for.
+"""
+
+CORPUS = (
+    "Query: what is retrieval augmented generation?\nAnswer: the model reads the context first. "
+    "### Context: documents, chunks, vectors, tokens, batches and queues. "
+    "def calculate_sum(a, b): return a + b  # daily weekly monthly 0123456789"
+)
+
+# The pre-tokenizer split of Llama 3's tokenizer.json: punctuation takes the line breaks after it
+LLAMA3_SPLIT = (
+    r"(?i:'s|'t|'re|'ve|'m|'ll|'d)|[^\r\n\p{L}\p{N}]?\p{L}+|\p{N}{1,3}"
+    r"| ?[^\s\p{L}\p{N}]+[\r\n]*|\s*[\r\n]+|\s+(?!\S)|\s+"
+)
+
+
+def build_stub_model(hidden=64, layers=2, vocab_size=512, seed=0, corpus=CORPUS, llama3_pretokenizer=False, bos=False):
+    """
+    Returns (model, tokenizer). With llama3_pretokenizer, text is split the way Llama 3
+    splits it before BPE; with bos, encoded prompts start with the BOS token.
+    """
+    import torch
+    from tokenizers import Regex, Tokenizer, decoders, models, pre_tokenizers, processors, trainers
+    from transformers import LlamaConfig, LlamaForCausalLM, PreTrainedTokenizerFast
+
+    bpe = Tokenizer(models.BPE(unk_token="<unk>"))
+    if llama3_pretokenizer:
+        bpe.pre_tokenizer = pre_tokenizers.Sequence([
+            pre_tokenizers.Split(Regex(LLAMA3_SPLIT), behavior="isolated"),
+            pre_tokenizers.ByteLevel(add_prefix_space=False, use_regex=False),
+        ])
+    else:
+        bpe.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    bpe.decoder = decoders.ByteLevel()
+    trainer = trainers.BpeTrainer(
+        vocab_size=vocab_size,
+        special_tokens=["<unk>", "<s>", "</s>", "<pad>"],
+        initial_alphabet=pre_tokenizers.ByteLevel.alphabet(),  # Any text encodes, byte by byte if need be
+        show_progress=False,
+    )
+    bpe.train_from_iterator([corpus] * 20, trainer)
+    if bos:
+        bpe.post_processor = processors.TemplateProcessing(single="<s> $A", special_tokens=[("<s>", bpe.token_to_id("<s>"))])
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=bpe, bos_token="<s>", eos_token="</s>", unk_token="<unk>", pad_token="<pad>"
+    )
+
+    torch.manual_seed(seed)
+    config = LlamaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden,
+        intermediate_size=hidden * 2,
+        num_hidden_layers=layers,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=4096,
+        bos_token_id=tokenizer.bos_token_id,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    model = LlamaForCausalLM(config).eval()
+    model.generation_config.do_sample = False
+    model.generation_config.eos_token_id = len(tokenizer)  # Never generated: fixed-length answers
+    return model, tokenizer
@@ -0,0 +1,35 @@
+"""
+app.py served with a tiny, randomly initialised Llama-style model instead of real weights,
+so the whole serving path (continuous batching, micro-batching, caches, queues) can be
+load-tested on a CPU without a GPU or gated downloads.
+
+The model and tokenizer come from benchmarks/stub_model.py: built in memory from a
+fixed seed, so every run serves the same model, and every request decodes exactly
+the number of tokens it asks for.
+
+    STUB_HIDDEN=64 STUB_LAYERS=2 uvicorn benchmarks.stub_server:app --port 8001
+
+Used by benchmarks/load_test.py.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AVAILABLE_MODELS", "stub")
+
+import app as microrag  # noqa: E402
+from benchmarks.stub_model import build_stub_model  # noqa: E402
+
+
+def load_stub(name):
+    model, tokenizer = build_stub_model(
+        hidden=int(os.getenv("STUB_HIDDEN", "64")),
+        layers=int(os.getenv("STUB_LAYERS", "2")),
+        seed=int(os.getenv("STUB_SEED", "0")),
+    )
+    return microrag.make_entry(name, model, tokenizer)
+
+
+microrag.registry.loader = load_stub
+microrag.registry.estimator = None  # No Hub config to estimate from; the budget uses measured sizes
+app = microrag.app
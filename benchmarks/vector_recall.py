@@ -0,0 +1,68 @@
+"""
+Recall and latency of the approximate vector indexes against exact (flat) search.
+
+Builds each index type over the same synthetic clustered embeddings through
+VectorStore, then reports recall@k (overlap with the flat top-k) and query latency.
+Prints JSON.
+
+    python benchmarks/vector_recall.py --vectors 100000 --dim 384 --k 10
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from vector_store import VectorStore
+
+
+def clustered_vectors(count, dim, clusters, rng):
+    # Real embeddings are clumpy; uniform random vectors make ANN look unrealistically bad
+    centers = rng.standard_normal((clusters, dim)).astype("float32")
+    labels = rng.integers(0, clusters, count)
+    return centers[labels] + 0.3 * rng.standard_normal((count, dim)).astype("float32")
+
+
+def run(kind, vectors, queries, k, nprobe, ef_search):
+    store = VectorStore(index_type=kind, ann_threshold=0, nprobe=nprobe, ef_search=ef_search)  # Build the requested kind straight away
+    texts = [""] * len(vectors)
+    start = time.perf_counter()
+    store.add("bench", vectors, texts)
+    build_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    results = [store.search("bench", query, k=k)[0] for query in queries]
+    query_seconds = (time.perf_counter() - start) / len(queries)
+    return [[hit["id"] for hit in hits] for hits in results], build_seconds, query_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF lists probed per query")
+    parser.add_argument("--ef-search", type=int, default=128, help="HNSW candidate list size per query")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    vectors = clustered_vectors(args.vectors, args.dim, max(1, args.vectors // 500), rng)
+    queries = clustered_vectors(args.queries, args.dim, max(1, args.vectors // 500), rng)
+
+    exact, build_seconds, query_seconds = run("flat", vectors, queries, args.k, args.nprobe, args.ef_search)
+    results = {"flat": {"recall_at_k": 1.0, "build_s": build_seconds, "query_ms": query_seconds * 1000}}
+    for kind in ("ivf", "hnsw"):
+        found, build_seconds, query_seconds = run(kind, vectors, queries, args.k, args.nprobe, args.ef_search)
+        recall = np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, exact)])
+        results[kind] = {"recall_at_k": float(recall), "build_s": build_seconds, "query_ms": query_seconds * 1000}
+
+    print(json.dumps({"vectors": args.vectors, "dim": args.dim, "k": args.k, "results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import re
+
+_HEADING = re.compile(r"^(#{1,6}\s|Sheet: )")
+_FENCE = "```"
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_WORD = re.compile(r"\w+|[^\w\s]")
+_BLOCK_SEPARATOR = "\n\n"
+
+
+def _blocks(text):
+    """
+    Splits text into structural blocks: headings, fenced code, and paragraphs (which
+    covers table row groups and code separated by blank lines). Yields (text, is_heading).
+    """
+    lines = []
+    in_fence = False
+    for line in text.splitlines():
+        stripped = line.strip()
+        if in_fence:
+            lines.append(line)
+            if stripped.startswith(_FENCE):
+                in_fence = False
+                yield "\n".join(lines), False
+                lines = []
+        elif stripped.startswith(_FENCE):
+            if lines:
+                yield "\n".join(lines), False
+            lines = [line]
+            in_fence = True
+        elif _HEADING.match(stripped):
+            if lines:
+                yield "\n".join(lines), False
+            yield stripped, True
+            lines = []
+        elif not stripped:
+            if lines:
+                yield "\n".join(lines), False
+            lines = []
+        else:
+            lines.append(line)
+    if lines:
+        yield "\n".join(lines), False
+
+
+class Chunker:
+    """
+    Splits documents into chunks of at most `max_tokens` tokens of `tokenizer`
+    (a Hugging Face fast tokenizer; without one, words and punctuation are counted).
+
+    Chunks break at structural boundaries where possible: a heading starts a new
+    chunk, and blocks too large for one chunk are split at sentences (or lines, for
+    code and tables) before falling back to exact token windows. Consecutive chunks
+    share up to `overlap` tokens of whole sentences or lines.
+    """
+    def __init__(self, tokenizer=None, max_tokens=256, overlap=32, min_tokens=None):
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.overlap = min(overlap, max_tokens // 2)
+        self.min_tokens = max_tokens // 4 if min_tokens is None else min_tokens
+
+    def split(self, text):
+        return list(self.iter_chunks([text]))
+
+    def iter_chunks(self, pages):
+        """
+        Chunks an iterable of text pieces (pages, cells, blocks) in a single pass.
+        """
+        stream = self.stream()
+        for page in pages:
+            yield from stream.feed(page)
+        yield from stream.close()
+
+    def stream(self):
+        """
+        An incremental chunker for one document: feed() pieces, then close().
+        """
+        return ChunkStream(self)
+
+    def spans(self, texts):
+        """
+        Character (start, end) spans of each text's tokens.
+        """
+        if self.tokenizer is None:
+            return [[match.span() for match in _WORD.finditer(text)] for text in texts]
+        encoded = self.tokenizer(texts, add_special_tokens=False, return_offsets_mapping=True, verbose=False)
+        return encoded["offset_mapping"]
+
+    def fit(self, block, spans):
+        """
+        Yields (piece, token_count, separator) pieces of a block, each within max_tokens;
+        `separator` stands for the whitespace between a piece and the one before it.
+        """
+        if len(spans) <= self.max_tokens:
+            yield block, len(spans), _BLOCK_SEPARATOR
+            return
+
+        lines = block.split("\n")
+        if len(lines) >= 3 and len(block) / len(lines) < 120:
+            # Line-structured (code, tables, lists): keep lines whole
+            bounds = [match.end() for match in re.finditer("\n", block)]
+            separator = "\n"
+        else:
+            bounds = [match.start() for match in _SENTENCE_END.finditer(block)]
+            separator = " "
+        bounds.append(len(block))
+
+        start, first = 0, 0
+        for end in bounds:
+            last = first
+            while last < len(spans) and spans[last][0] < end:
+                last += 1
+            piece_spans = spans[first:last]
+            if len(piece_spans) <= self.max_tokens:
+                piece = block[start:end].strip()
+                if piece:
+                    yield piece, len(piece_spans), separator
+            else:
+                # A single sentence or line longer than a chunk: cut it into exact token windows
+                for i in range(0, len(piece_spans), self.max_tokens):
+                    window = piece_spans[i:i + self.max_tokens]
+                    piece_end = end if i + self.max_tokens >= len(piece_spans) else piece_spans[i + self.max_tokens][0]
+                    yield block[max(start, window[0][0]):piece_end].strip(), len(window), separator
+            start, first = end, last
+
+
+class ChunkStream:
+    """
+    Packs one document's blocks into chunks as its text arrives.
+    """
+    def __init__(self, chunker):
+        self.chunker = chunker
+        self.units = []   # (text, tokens, separator before it) in the chunk being built
+        self.total = 0
+        self.fresh = 0    # Units added since the last chunk, not counting the carried overlap
+
+    def feed(self, text):
+        """
+        Adds the next piece of the document; returns the chunks it completed.
+        """
+        chunker = self.chunker
+        blocks = list(_blocks(text))
+        out = []
+        for (block, is_heading), spans in zip(blocks, chunker.spans([block for block, _ in blocks])):
+            if is_heading:
+                # A new section: close a reasonably full chunk, and don't carry overlap into it
+                if self.fresh and self.total >= chunker.min_tokens:
+                    out.append(self._emit(overlap=False))
+                elif not self.fresh:
+                    self._reset([])
+            for n, (piece, size, separator) in enumerate(chunker.fit(block, spans)):
+                if self.total + size > chunker.max_tokens:
+                    if self.fresh:
+                        out.append(self._emit(overlap=True))
+                    if self.total + size > chunker.max_tokens:
+                        self._reset([])  # The carried overlap doesn't fit next to this piece
+                self.units.append((piece, size, _BLOCK_SEPARATOR if n == 0 else separator))
+                self.total += size
+                self.fresh += 1
+        return out
+
+    def close(self):
+        """
+        Returns the last chunk, if anything is left.
+        """
+        return [self._emit(overlap=False)] if self.fresh else []
+
+    def _emit(self, overlap):
+        # Blocks stay a blank line apart, and sentences or lines of one block as they were
+        chunk = self.units[0][0] + "".join(separator + text for text, _, separator in self.units[1:])
+        tail = []
+        if overlap:
+            size = 0
+            for unit in reversed(self.units):
+                size += unit[1]
+                if size > self.chunker.overlap:
+                    break
+                tail.append(unit)
+            tail.reverse()
+        self._reset(tail)
+        return chunk
+
+    def _reset(self, units):
+        self.units = units
+        self.total = sum(unit[1] for unit in units)
+        self.fresh = 0
@@ -0,0 +1,76 @@
+import re
+import zlib
+
+import numpy as np
+
+# Kept free of torch/transformers: any tokenizer with __call__ and decode works.
+
+_WORD = re.compile(r"\w+")
+_PRIME = (1 << 61) - 1
+_NUM_PERM = 64
+# Fixed seed, so the same chunks always pack the same way (packed prompts are cache keys)
+_rng = np.random.default_rng(0)
+_A = _rng.integers(1, _PRIME, _NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, _NUM_PERM, dtype=np.uint64)
+
+
+def minhash(text, shingle=3):
+    """
+    MinHash signature of the text's word `shingle`-grams: one minimum per hash function.
+    The fraction of equal positions in two signatures estimates their Jaccard similarity.
+    """
+    words = [word.lower() for word in _WORD.findall(text)]
+    grams = {" ".join(words[i:i + shingle]) for i in range(max(1, len(words) - shingle + 1))}
+    hashes = np.array([zlib.crc32(gram.encode("utf-8")) for gram in grams], dtype=np.uint64)
+    # Universal hashing; uint64 overflow wraps, which only reshuffles the family
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def similarity(a, b):
+    return float(np.mean(a == b))
+
+
+def pack_context(tokenizer, chunks, budget, threshold=0.8, separator="\n\n"):
+    """
+    Fits the best of `chunks` (ranked best first) into `budget` tokens of `tokenizer`.
+
+    Chunks whose MinHash similarity to an already chosen chunk reaches `threshold`
+    (e.g. the same passage retrieved from overlapping windows or two copies of a page)
+    are dropped, then chunks are taken in rank order while they fit; a chunk too long
+    for what is left is skipped so that shorter, lower-ranked ones can still go in.
+    If not even the best chunk fits, its beginning is kept.
+
+    Returns a dict: "text" (chosen chunks joined by `separator`, in rank order),
+    "used", "duplicates" and "over_budget" (chunk indices), "truncated" (index or None)
+    and "tokens" (the packed size).
+    """
+    lengths = [len(ids) for ids in tokenizer(list(chunks), add_special_tokens=False)["input_ids"]] if chunks else []
+    separator_tokens = len(tokenizer(separator, add_special_tokens=False)["input_ids"])
+    report = {"text": "", "used": [], "duplicates": [], "over_budget": [], "truncated": None, "tokens": 0}
+    chosen, signatures = [], []
+
+    for i, (chunk, length) in enumerate(zip(chunks, lengths)):
+        if not chunk.strip():
+            continue
+        signature = minhash(chunk)
+        if any(similarity(signature, other) >= threshold for other in signatures):
+            report["duplicates"].append(i)
+            continue
+        cost = length + (separator_tokens if chosen else 0)
+        if report["tokens"] + cost <= budget:
+            chosen.append(chunk)
+        elif not chosen and budget > 0:
+            # The best chunk alone is too long: keep as much of it as fits
+            ids = tokenizer(chunk, add_special_tokens=False)["input_ids"][:budget]
+            chosen.append(tokenizer.decode(ids, skip_special_tokens=True))
+            report["truncated"] = i
+            cost = budget
+        else:
+            report["over_budget"].append(i)
+            continue
+        signatures.append(signature)
+        report["used"].append(i)
+        report["tokens"] += cost
+
+    report["text"] = separator.join(chosen)
+    return report
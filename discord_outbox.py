@@ -0,0 +1,202 @@
+import asyncio
+import io
+import time
+from collections import deque
+
+import discord
+
+# Discord's limits on what one message may carry
+MESSAGE_CHARS = 2000
+EMBED_CHARS = 4096          # Per embed description
+EMBEDS_PER_MESSAGE = 10
+EMBED_CHARS_PER_MESSAGE = 6000  # Across all embeds of a message
+
+BLOCK_SEPARATOR = "\n\n"
+
+
+class RateBucket:
+    """
+    Token bucket allowing `rate` sends per `per` seconds, with bursts of up to `rate`.
+    """
+    def __init__(self, rate, per):
+        self.rate = rate
+        self.per = per
+        self.tokens = float(rate)
+        self.updated = time.monotonic()
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate / self.per)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) * self.per / self.rate)
+
+
+class _Pending:
+    def __init__(self, channel, blocks, separate, future):
+        self.channel = channel
+        self.blocks = blocks
+        self.separate = separate
+        self.future = future
+
+
+def split_text(text, limit):
+    """
+    Pieces of at most `limit` characters, cut at a line break or space where possible.
+    """
+    pieces = []
+    while len(text) > limit:
+        cut = text.rfind("\n", 0, limit + 1)
+        if cut <= 0:
+            cut = text.rfind(" ", 0, limit + 1)
+        if cut <= 0:
+            cut = limit
+        pieces.append(text[:cut])
+        text = text[cut:].lstrip("\n ")
+    if text:
+        pieces.append(text)
+    return pieces
+
+
+def fill(blocks, limit):
+    """
+    Joins blocks into as few texts of at most `limit` characters as possible, keeping
+    their order; only blocks longer than `limit` are split.
+    """
+    texts, current = [], ""
+    for block in blocks:
+        for piece in split_text(block, limit):
+            if current and len(current) + len(BLOCK_SEPARATOR) + len(piece) <= limit:
+                current += BLOCK_SEPARATOR + piece
+            else:
+                if current:
+                    texts.append(current)
+                current = piece
+    if current:
+        texts.append(current)
+    return texts
+
+
+class Outbox:
+    """
+    Sends the bot's messages with as few Discord API calls as possible.
+
+    Each channel (threads included) has its own queue, drained by its own task, so
+    independent threads send concurrently while each one stays within its rate-limit
+    bucket (`rate` messages per `per` seconds) and all of them within `global_rate`
+    per second. Text queued for a channel while it waits for its bucket is packed
+    together with what is already waiting:
+
+    - up to `embed_threshold` characters, into as few plain messages as fit;
+    - up to `file_threshold`, into embeds (4096 characters each, 6000 per message);
+    - beyond that, into one .txt attachment.
+    """
+    def __init__(self, rate=5, per=5.0, global_rate=50, embed_threshold=4000, file_threshold=12000):
+        self.rate = rate
+        self.per = per
+        self.embed_threshold = embed_threshold
+        self.file_threshold = file_threshold
+        self.messages_sent = 0
+        self.blocks_sent = 0
+        self._global = RateBucket(global_rate, 1.0)
+        self._buckets = {}  # channel id -> RateBucket
+        self._queues = {}   # channel id -> deque of _Pending
+        self._workers = {}  # channel id -> task draining its queue
+
+    async def send(self, channel, *blocks, separate=False):
+        """
+        Queues text blocks (e.g. one per search match) for `channel` and returns the
+        messages they were delivered in. With separate=True the blocks get a message
+        of their own instead of being packed with others, e.g. for a message that is
+        edited afterwards.
+        """
+        blocks = [block for block in blocks if block and block.strip()]
+        if not blocks:
+            return []
+        pending = _Pending(channel, blocks, separate, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(channel.id, deque()).append(pending)
+        if channel.id not in self._workers:
+            self._workers[channel.id] = asyncio.create_task(self._drain(channel.id))
+        return await pending.future
+
+    def pack(self, blocks):
+        """
+        Keyword arguments for channel.send, one dict per message, carrying `blocks` in order.
+        """
+        total = sum(len(block) for block in blocks) + len(BLOCK_SEPARATOR) * (len(blocks) - 1)
+        if total <= self.embed_threshold:
+            return [{"content": text} for text in fill(blocks, MESSAGE_CHARS)]
+
+        if total <= self.file_threshold:
+            payloads, embeds, size = [], [], 0
+            for text in fill(blocks, EMBED_CHARS):
+                if embeds and (len(embeds) == EMBEDS_PER_MESSAGE or size + len(text) > EMBED_CHARS_PER_MESSAGE):
+                    payloads.append({"embeds": embeds})
+                    embeds, size = [], 0
+                embeds.append(discord.Embed(description=text))
+                size += len(text)
+            payloads.append({"embeds": embeds})
+            return payloads
+
+        data = BLOCK_SEPARATOR.join(blocks).encode("utf-8")
+        return [{
+            "content": f"📂 {total:,} characters, attached as a file.",
+            "file": discord.File(io.BytesIO(data), filename="message.txt"),
+        }]
+
+    def stats(self):
+        return {
+            "messages_sent": self.messages_sent,
+            "blocks_sent": self.blocks_sent,
+            "queued": sum(len(queue) for queue in self._queues.values()),
+        }
+
+    def _bucket(self, key):
+        if len(self._buckets) > 1024:
+            # A bucket idle for `per` seconds is full again, the same as a new one
+            now = time.monotonic()
+            self._buckets = {k: b for k, b in self._buckets.items() if k in self._workers or now - b.updated < b.per}
+        return self._buckets.setdefault(key, RateBucket(self.rate, self.per))
+
+    async def _drain(self, key):
+        queue = self._queues[key]
+        bucket = self._bucket(key)
+        try:
+            while queue:
+                # Wait for our turn first, so whatever is queued meanwhile goes out together
+                await bucket.acquire()
+                batch = [queue.popleft()]
+                while not batch[0].separate and queue and not queue[0].separate:
+                    batch.append(queue.popleft())
+                batch = [pending for pending in batch if not pending.future.done()]  # Callers that gave up
+                if not batch:
+                    continue
+
+                blocks = [block for pending in batch for block in pending.blocks]
+                payloads = [{"content": text} for text in fill(blocks, MESSAGE_CHARS)] if batch[0].separate else self.pack(blocks)
+                messages = []
+                try:
+                    for n, payload in enumerate(payloads):
+                        if n:
+                            await bucket.acquire()
+                        await self._global.acquire()
+                        messages.append(await batch[0].channel.send(**payload))
+                except Exception as e:
+                    print(f"Error: could not send to channel {key}: {e}")
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                    continue
+                self.messages_sent += len(messages)
+                self.blocks_sent += len(blocks)
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_result(messages)
+        finally:
+            # Nothing awaits between the last empty check and here, so no send() is lost
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
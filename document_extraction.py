@@ -0,0 +1,160 @@
+import asyncio
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# PDFs with more pages than this are split into ranges and parsed in worker processes
+PARALLEL_PDF_PAGES = 64
+PDF_RANGE_PAGES = 16
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", min(4, os.cpu_count() or 1)))
+TEXT_BLOCK_CHARS = 64 * 1024
+SHEET_BLOCK_ROWS = 200
+
+_pool = None
+
+
+def _process_pool():
+    global _pool
+    if _pool is None:
+        # forkserver doesn't fork the bot's threads or re-import the bot script in every worker
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        _pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS, mp_context=multiprocessing.get_context(method))
+    return _pool
+
+
+def iter_pages(path, file_ext):
+    """
+    Yields a document's text a piece at a time (PDF pages, notebook cells, blocks of
+    lines or spreadsheet rows), so callers never hold the whole document in memory.
+    """
+    if file_ext == "pdf":
+        yield from _pdf_pages(path)
+    elif file_ext == "ipynb":
+        yield from _notebook_cells(path)
+    elif file_ext == "xlsx":
+        yield from _xlsx_rows(path)
+    elif file_ext == "xls":
+        yield from _xls_rows(path)
+    else:
+        yield from _text_blocks(path)
+
+
+def extract_text(path, file_ext):
+    """
+    The whole document as one string, for callers that need it all at once.
+    """
+    return "\n".join(iter_pages(path, file_ext))
+
+
+async def stream_pages(path, file_ext):
+    """
+    Async version of iter_pages: parsing runs off the event loop, one piece ahead of the consumer.
+    """
+    pages = iter_pages(path, file_ext)
+    try:
+        while True:
+            page = await asyncio.to_thread(next, pages, None)
+            if page is None:
+                return
+            yield page
+    finally:
+        await asyncio.to_thread(pages.close)
+
+
+def _pdf_page_count(path):
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        return len(PyPDF2.PdfReader(f).pages)
+
+
+def _pdf_range(path, start, stop):
+    # Runs in a worker process: parses only its own pages
+    import PyPDF2
+
+    with open(path, "rb") as f:
+        reader = PyPDF2.PdfReader(f)
+        return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _pdf_pages(path):
+    count = _pdf_page_count(path)
+    if count <= PARALLEL_PDF_PAGES:
+        for start in range(0, count, PDF_RANGE_PAGES):
+            yield from _pdf_range(path, start, min(start + PDF_RANGE_PAGES, count))
+        return
+
+    # Keep a bounded number of ranges in flight and yield them in page order
+    pool = _process_pool()
+    ranges = [(start, min(start + PDF_RANGE_PAGES, count)) for start in range(0, count, PDF_RANGE_PAGES)]
+    in_flight = []
+    try:
+        for start, stop in ranges:
+            in_flight.append(pool.submit(_pdf_range, path, start, stop))
+            if len(in_flight) >= EXTRACT_WORKERS * 2:
+                yield from in_flight.pop(0).result()
+        while in_flight:
+            yield from in_flight.pop(0).result()
+    finally:
+        for future in in_flight:
+            future.cancel()
+
+
+def _notebook_cells(path):
+    with open(path, "r", encoding="utf-8") as f:
+        notebook = json.load(f)
+    for cell in notebook.get("cells", []):
+        source = cell.get("source", "")
+        text = "".join(source) if isinstance(source, list) else source
+        if text.strip():
+            yield text
+
+
+def _xlsx_rows(path):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)  # Streams rows from disk
+    try:
+        for sheet in workbook.worksheets:
+            yield from _sheet_blocks(sheet.title, sheet.iter_rows(values_only=True))
+    finally:
+        workbook.close()
+
+
+def _xls_rows(path):
+    try:
+        import xlrd
+    except ImportError:
+        raise ValueError("Reading .xls files needs the xlrd package (or save the file as .xlsx)")
+
+    workbook = xlrd.open_workbook(path, on_demand=True)
+    for sheet in workbook.sheets():
+        yield from _sheet_blocks(sheet.name, (sheet.row_values(i) for i in range(sheet.nrows)))
+
+
+def _sheet_blocks(title, rows):
+    lines = []
+    for row in rows:
+        cells = ["" if value is None else str(value) for value in row]
+        if any(cells):
+            lines.append("\t".join(cells))
+        if len(lines) == SHEET_BLOCK_ROWS:
+            yield f"Sheet: {title}\n" + "\n".join(lines)
+            lines = []
+    if lines:
+        yield f"Sheet: {title}\n" + "\n".join(lines)
+
+
+def _text_blocks(path):
+    # Whole lines only, so no word is split between two blocks
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        lines, size = [], 0
+        for line in f:
+            lines.append(line)
+            size += len(line)
+            if size >= TEXT_BLOCK_CHARS:
+                yield "".join(lines)
+                lines, size = [], 0
+        if lines:
+            yield "".join(lines)
@@ -0,0 +1,157 @@
+import hashlib
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    On-disk store of embedding vectors keyed by a hash of the model name and text,
+    so an unchanged chunk is never embedded twice, across uploads and restarts.
+    """
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, vector BLOB)")
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(model_name, text):
+        return hashlib.sha256(f"{model_name}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the keys that are cached.
+        """
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):  # Stay under SQLite's bound-parameter limit
+                batch = keys[start:start + 500]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM vectors WHERE key IN ({','.join('?' * len(batch))})", batch
+                )
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype="float32")
+        return found
+
+    def put_many(self, items):
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO vectors (key, vector) VALUES (?, ?)",
+                [(key, np.asarray(vector, dtype="float32").tobytes()) for key, vector in items],
+            )
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+
+class Embedder:
+    """
+    Sentence-transformers text encoder, loaded on first use.
+
+    With a `cache_path`, vectors are cached by content hash and only unseen texts
+    are embedded. Those are sorted by length and sent to the encoder in batches of
+    at most `batch_size` texts and `max_batch_chars` characters, so short chunks
+    aren't padded out to the longest one and long chunks don't blow up memory.
+    """
+    def __init__(self, model_name="all-MiniLM-L6-v2", batch_size=64, max_batch_chars=32000, cache_path=None):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.max_batch_chars = max_batch_chars
+        self.cache = EmbeddingCache(cache_path) if cache_path else None
+        self.hits = 0
+        self.misses = 0
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            return self._model
+
+    @property
+    def dim(self):
+        return self.model.get_sentence_embedding_dimension()
+
+    @property
+    def tokenizer(self):
+        return self.model.tokenizer
+
+    @property
+    def max_tokens(self):
+        """
+        Longest text (in tokens, excluding special tokens) embedded without truncation.
+        """
+        return self.model.max_seq_length - self.tokenizer.num_special_tokens_to_add()
+
+    def encode(self, texts, cache=True):
+        """
+        Embeds a list of texts; returns a float32 array of L2-normalized rows.
+        With cache=False (one-off texts such as queries) the cache is neither read nor written.
+        """
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype="float32")
+
+        store = self.cache if cache else None
+        keys = [EmbeddingCache.make_key(self.model_name, text) for text in texts]
+        vectors = store.get_many(list(set(keys))) if store is not None else {}
+        if store is not None:
+            self.hits += sum(key in vectors for key in keys)
+
+        # Each distinct unseen text is embedded once, even if it repeats in this call
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        if store is not None:
+            self.misses += len(missing)
+        if missing:
+            fresh = self._embed(list(missing.values()))
+            new_items = list(zip(missing, fresh))
+            vectors.update(new_items)
+            if store is not None:
+                store.put_many(new_items)
+
+        return np.stack([vectors[key] for key in keys])
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "cached": len(self.cache) if self.cache is not None else 0,
+        }
+
+    def _embed(self, texts):
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = [None] * len(texts)
+        for batch in self._batches(order, texts):
+            vectors = self.model.encode(
+                [texts[i] for i in batch],
+                batch_size=len(batch),
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+            )
+            for i, vector in zip(batch, vectors):
+                out[i] = vector.astype("float32", copy=False)
+        return out
+
+    def _batches(self, order, texts):
+        batch, chars = [], 0
+        for i in order:
+            size = len(texts[i])
+            if batch and (len(batch) == self.batch_size or chars + size > self.max_batch_chars):
+                yield batch
+                batch, chars = [], 0
+            batch.append(i)
+            chars += size
+        if batch:
+            yield batch
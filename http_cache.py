@@ -0,0 +1,210 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+import aiohttp
+from multidict import CIMultiDict
+
+from http_client import HttpResponse, http
+
+# Response headers kept with a cached body
+_KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+
+
+def _cache_control(headers):
+    directives = {}
+    for part in headers.get("Cache-Control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+    return directives
+
+
+class HttpCache:
+    """
+    Persistent cache for GET requests, shared by search, scraping and GitHub trending.
+
+    How long a response stays fresh: the TTL configured for its `source` (e.g.
+    "trending lists are good for 30 minutes"), or `default_ttl` for other sources,
+    but never longer than the server's Cache-Control max-age. no-store responses
+    aren't cached, and no-cache ones are revalidated before every use. Bodies cut
+    off at `max_bytes` aren't cached either.
+
+    Stale entries are revalidated with If-None-Match / If-Modified-Since, so an
+    unchanged page costs a 304 instead of a download. Within `stale_while_revalidate`
+    seconds after expiry, the stale copy is returned immediately and refreshed in the
+    background; a stale copy is also served if revalidation fails. Neither applies
+    to no-cache responses.
+    """
+    def __init__(self, client, directory, ttls=None, default_ttl=300, stale_while_revalidate=600,
+                 max_bytes=5 * 1024 * 1024, timeout=aiohttp.ClientTimeout(total=20, connect=5)):
+        self.client = client
+        self.directory = directory
+        self.ttls = ttls or {}
+        self.default_ttl = default_ttl
+        self.stale_while_revalidate = stale_while_revalidate
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._refreshing = {}  # key -> background revalidation task
+
+    async def get(self, url, headers=None, source=None, timeout=None):
+        """
+        GETs `url` through the cache. Returns an HttpResponse whose `cache_status` is
+        HIT, STALE, REVALIDATED or MISS. Bodies are cut off at `max_bytes`.
+        """
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        entry = self._read(key)
+        now = time.time()
+
+        if entry is not None and not entry.get("no_cache"):
+            if entry["expires_at"] > now:
+                return self._response(entry, "HIT")
+            if now < entry["expires_at"] + self.stale_while_revalidate and key not in self._refreshing:
+                task = asyncio.create_task(self._refresh(key, url, headers, source, timeout, entry))
+                self._refreshing[key] = task
+                task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+                return self._response(entry, "STALE")
+            if key in self._refreshing:
+                return self._response(entry, "STALE")
+
+        try:
+            return await self._revalidate(key, url, headers, source, timeout, entry)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            if entry is None or entry.get("no_cache"):
+                raise
+            return self._response(entry, "STALE")  # Better an old page than none
+
+    async def _refresh(self, *args):
+        try:
+            await self._revalidate(*args)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            print(f"Background revalidation failed: {e}")
+
+    async def _revalidate(self, key, url, headers, source, timeout, entry):
+        request_headers = dict(headers or {})
+        if entry is not None:
+            if entry["headers"].get("ETag"):
+                request_headers["If-None-Match"] = entry["headers"]["ETag"]
+            if entry["headers"].get("Last-Modified"):
+                request_headers["If-Modified-Since"] = entry["headers"]["Last-Modified"]
+
+        response, truncated = await self._fetch(url, request_headers, timeout or self.timeout)
+        if response.status == 304 and entry is not None:
+            # A 304 may update the validators and caching headers of what we have
+            entry["headers"].update({name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers})
+            revalidated = self._response(entry, "REVALIDATED")
+            ttl = self._ttl(entry["headers"], source)
+            if ttl is None:
+                self._remove(key)
+            else:
+                entry["expires_at"] = time.time() + ttl
+                entry["no_cache"] = "no-cache" in _cache_control(entry["headers"])
+                self._write(key, entry)
+            return revalidated
+
+        ttl = self._ttl(response.headers, source)
+        if response.status == 200 and ttl is not None and not truncated:
+            entry = {
+                "url": url,
+                "headers": {name: response.headers[name] for name in _KEPT_HEADERS if name in response.headers},
+                "expires_at": time.time() + ttl,
+                "no_cache": "no-cache" in _cache_control(response.headers),
+            }
+            self._write(key, entry, response.body)
+        response.cache_status = "MISS"
+        return response
+
+    async def _fetch(self, url, headers, timeout):
+        """
+        Returns (response, truncated): the body is cut off at `max_bytes` instead of read whole.
+        """
+        async with self.client.stream("GET", url, headers=headers, timeout=timeout) as response:
+            body = bytearray()
+            truncated = False
+            async for block in response.content.iter_chunked(64 * 1024):
+                body += block
+                if len(body) > self.max_bytes:
+                    del body[self.max_bytes:]
+                    truncated = True
+                    break
+            return HttpResponse(response.status, CIMultiDict(response.headers), bytes(body)), truncated
+
+    def _ttl(self, headers, source):
+        """
+        Seconds a response with these headers stays fresh, or None if it must not be stored.
+        """
+        directives = _cache_control(headers)
+        if "no-store" in directives:
+            return None
+        if "no-cache" in directives:
+            return 0
+        ttl = self.ttls.get(source, self.default_ttl)
+        if directives.get("max-age", "").isdigit():
+            ttl = min(ttl, int(directives["max-age"]))
+        return ttl
+
+    def _response(self, entry, cache_status):
+        with open(self._path(entry["key"], "body"), "rb") as f:
+            body = f.read()
+        return HttpResponse(200, CIMultiDict(entry["headers"]), body, cache_status=cache_status)
+
+    def _path(self, key, kind):
+        return os.path.join(self.directory, f"{key}.{kind}")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key, "json"), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._path(key, "body")):
+            return None
+        entry["key"] = key
+        return entry
+
+    def _write(self, key, entry, body=None):
+        """
+        Stores an entry's metadata, and its body unless only the metadata changed.
+        """
+        entry["key"] = key
+        try:
+            os.makedirs(self.directory, exist_ok=True)  # Created on first use, not at import
+            if body is not None:
+                self._replace(self._path(key, "body"), body)
+            self._replace(self._path(key, "json"), json.dumps(entry).encode("utf-8"))
+        except OSError as e:
+            print(f"Error: could not write HTTP cache entry: {e}")
+
+    def _remove(self, key):
+        for kind in ("json", "body"):
+            try:
+                os.remove(self._path(key, kind))
+            except OSError:
+                pass
+
+    @staticmethod
+    def _replace(path, data):
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Atomic, so readers never see half a file
+
+
+def _parse_ttls(spec):
+    # "search=600,scrape=3600" -> {"search": 600, "scrape": 3600}
+    ttls = {}
+    for item in spec.split(","):
+        name, _, seconds = item.partition("=")
+        if name.strip() and seconds.strip():
+            ttls[name.strip()] = float(seconds)
+    return ttls
+
+
+# Shared by the scraper helpers and the bot; sources: search, scrape, trending
+web_cache = HttpCache(
+    http,
+    os.getenv("HTTP_CACHE_DIR", "http_cache"),
+    ttls=_parse_ttls(os.getenv("HTTP_CACHE_TTLS", "search=600,scrape=3600,trending=1800")),
+)
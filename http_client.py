@@ -0,0 +1,123 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+# Statuses worth retrying: the backend is restarting, overloaded or behind a flaky proxy
+RETRY_STATUSES = {502, 503, 504}
+
+
+class HttpError(Exception):
+    """
+    Raised by HttpResponse.raise_for_status for 4xx/5xx responses.
+    """
+    def __init__(self, status, text):
+        super().__init__(f"HTTP {status}: {text[:200]}")
+        self.status = status
+        self.text = text
+
+
+class HttpResponse:
+    """
+    A fully read response, so callers don't have to keep the connection open.
+    `cache_status` is set when it went through an HttpCache.
+    """
+    def __init__(self, status, headers, body, cache_status=None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.cache_status = cache_status
+
+    @property
+    def text(self):
+        return self.body.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            raise HttpError(self.status, self.text)
+
+
+class HttpClient:
+    """
+    One pooled aiohttp session shared by everything the bot fetches.
+
+    Connections are kept alive and capped per host, every call has a timeout, and
+    calls are retried with exponential backoff on connection errors and 502/503/504
+    (honoring Retry-After when the server sends it) unless they pass retries=0.
+    """
+    def __init__(self, limit=100, limit_per_host=10, timeout=30, connect_timeout=5, retries=2, backoff=0.5):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(total=timeout, connect=connect_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+
+    @property
+    def session(self):
+        # Created lazily so it binds to the running event loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=30,
+                ttl_dns_cache=300,
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def request(self, method, url, retries=None, **kwargs):
+        """
+        Sends a request and reads the whole body. Returns an HttpResponse.
+        Pass retries=0 for calls that must not be repeated (e.g. uploads).
+        """
+        retries = self.retries if retries is None else retries
+        attempt = 0
+        while True:
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    body = await response.read()
+                    if response.status in RETRY_STATUSES and attempt < retries:
+                        await asyncio.sleep(self._delay(attempt, response.headers.get("Retry-After")))
+                        attempt += 1
+                        continue
+                    return HttpResponse(response.status, response.headers, body)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt >= retries:
+                    raise
+                await asyncio.sleep(self._delay(attempt))
+                attempt += 1
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, **kwargs):
+        return await self.request("POST", url, **kwargs)
+
+    @asynccontextmanager
+    async def stream(self, method, url, timeout=None, **kwargs):
+        """
+        Opens a streaming response (e.g. NDJSON tokens); yields the aiohttp response.
+        Not retried, since part of the body may already have been consumed.
+        Defaults to no total timeout, only a gap limit between chunks.
+        """
+        timeout = timeout or aiohttp.ClientTimeout(total=None, connect=self.timeout.connect, sock_read=120)
+        async with self.session.request(method, url, timeout=timeout, **kwargs) as response:
+            yield response
+
+    def _delay(self, attempt, retry_after=None):
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), 30.0)
+        return self.backoff * (2 ** attempt)
+
+
+# Shared by the bot and the scraper helpers for the lifetime of the process
+http = HttpClient()
@@ -0,0 +1,97 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Kept free of torch/transformers so the API can import it without loading them.
+
+
+class QueueFullError(Exception):
+    """
+    Raised when an admission queue is at capacity.
+    `retry_after` is a hint, in whole seconds, for the Retry-After header.
+    """
+    def __init__(self, retry_after):
+        super().__init__(f"Inference queue is full, retry in {retry_after}s.")
+        self.retry_after = retry_after
+
+
+def estimate_retry_after(avg_service, depth, capacity):
+    return max(1, round(avg_service * depth / max(1, capacity)))
+
+
+class RequestDeadline:
+    """
+    When a request stops being worth computing: after `timeout` seconds, or as soon as
+    cancel() is called (e.g. the client disconnected). Thread-safe, so decode loops on
+    worker threads can poll `expired` between steps.
+    """
+    def __init__(self, timeout=None):
+        self.expires_at = time.monotonic() + timeout if timeout else None
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def expired(self):
+        return self.cancelled or (self.expires_at is not None and time.monotonic() >= self.expires_at)
+
+    @property
+    def reason(self):
+        return "cancelled" if self.cancelled else "deadline"
+
+
+class InferenceExecutor:
+    """
+    Runs blocking pipeline calls on dedicated worker threads so the event loop stays free.
+    At most `max_queue` calls may be outstanding; beyond that `run` raises QueueFullError.
+    """
+    def __init__(self, max_queue=32, workers=1):
+        self.max_queue = max_queue
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="inference")
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._avg_service = 1.0  # Moving average of seconds per call, for Retry-After
+
+    def check_capacity(self):
+        """
+        Raises QueueFullError if a call submitted now would be rejected.
+        """
+        with self._lock:
+            if self._depth >= self.max_queue:
+                raise QueueFullError(estimate_retry_after(self._avg_service, self._depth, self.workers))
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Runs fn(*args, **kwargs) on the executor.
+        Returns (result, stats) where stats holds the queue depth seen at admission and the wait time.
+        """
+        with self._lock:
+            if self._depth >= self.max_queue:
+                raise QueueFullError(estimate_retry_after(self._avg_service, self._depth, self.workers))
+            self._depth += 1
+            depth = self._depth
+
+        enqueued = time.monotonic()
+        started = []
+
+        def job():
+            started.append(time.monotonic())
+            return fn(*args, **kwargs)
+
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self._pool, job)
+        finally:
+            with self._lock:
+                self._depth -= 1
+                if started:
+                    self._avg_service = 0.8 * self._avg_service + 0.2 * (time.monotonic() - started[0])
+
+        wait = (started[0] if started else time.monotonic()) - enqueued
+        return result, {"queue_depth": depth, "queue_wait": wait}
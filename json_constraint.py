@@ -0,0 +1,76 @@
+import json
+
+import regex
+
+# Bounded so a constrained generation cannot ramble inside a value
+_STRING = r'"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]){0,200}"'
+_NUMBER = r"-?(?:0|[1-9][0-9]{0,15})(?:\.[0-9]{1,10})?"
+_INTEGER = r"-?(?:0|[1-9][0-9]{0,15})"
+_SPACE = r"[ ]?"
+
+
+def schema_to_regex(schema):
+    """
+    Converts a small JSON-schema subset to a regular expression over its JSON text.
+
+    Supported: object (properties in the listed order, all present), string, number,
+    integer, boolean, null, enum, const, anyOf/oneOf. Anything without a type
+    accepts a string or a number.
+    """
+    if "const" in schema:
+        return regex.escape(json.dumps(schema["const"]))
+    if "enum" in schema:
+        return "(?:" + "|".join(regex.escape(json.dumps(value)) for value in schema["enum"]) + ")"
+    for key in ("anyOf", "oneOf"):
+        if key in schema:
+            return "(?:" + "|".join(schema_to_regex(option) for option in schema[key]) + ")"
+
+    kind = schema.get("type")
+    if kind == "object":
+        members = [
+            regex.escape(json.dumps(name)) + _SPACE + ":" + _SPACE + schema_to_regex(value)
+            for name, value in schema.get("properties", {}).items()
+        ]
+        return r"\{" + _SPACE + ("," + _SPACE).join(members) + _SPACE + r"\}"
+    if kind == "string":
+        return _STRING
+    if kind == "number":
+        return _NUMBER
+    if kind == "integer":
+        return _INTEGER
+    if kind == "boolean":
+        return "(?:true|false)"
+    if kind == "null":
+        return "null"
+    return f"(?:{_STRING}|{_NUMBER})"
+
+
+class JsonConstraint:
+    """
+    Restricts generation to JSON text matching a schema.
+
+    `token_text` maps a token id to its decoded text. A token is allowed when the
+    text generated so far plus that token can still be extended to a match;
+    generation is complete as soon as the text is a full match.
+    """
+    def __init__(self, schema, token_text):
+        self.pattern = regex.compile(schema_to_regex(schema))
+        self.token_text = token_text
+
+    def allows(self, text, token_id):
+        piece = self.token_text(token_id)
+        if not piece or "\ufffd" in piece:
+            return False
+        return self.pattern.fullmatch(text + piece, partial=True) is not None
+
+    def is_complete(self, text):
+        return self.pattern.fullmatch(text) is not None
+
+    def pick(self, text, ranked_token_ids):
+        """
+        First token, in the given (best-first) order, that keeps the text valid.
+        """
+        for token_id in ranked_token_ids:
+            if self.allows(text, token_id):
+                return token_id
+        return None
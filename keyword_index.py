@@ -0,0 +1,129 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+_WORD = re.compile(r"\w+")
+_PART = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def tokenize(text):
+    """
+    Lowercased search terms for BM25. Identifiers are kept whole and also split into
+    their parts, so "load_model" and "ValueError" match both exactly and by word.
+    """
+    terms = []
+    for word in _WORD.findall(text):
+        terms.append(word.lower())
+        parts = [part.lower() for part in _PART.findall(word)]
+        if len(parts) > 1:
+            terms.extend(parts)
+    return terms
+
+
+class BM25Index:
+    """
+    Incremental BM25 inverted index over documents identified by int ids.
+
+    Each term keeps a postings list of (row, term frequency). Scoring is vectorized:
+    all postings of the query terms are weighted at once with numpy and summed per
+    document with bincount. Removed documents are masked out and compacted away once
+    a fifth of the rows are dead. Not thread-safe; VectorStore calls it under its lock.
+    """
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings = {}   # term -> ([rows], [term frequencies])
+        self._arrays = {}     # term -> (rows, tfs) as numpy arrays, rebuilt after the term changes
+        self._rows = {}       # document id -> row
+        self._ids = np.empty(0, dtype="int64")
+        self._lengths = np.empty(0, dtype="float32")
+        self._alive = np.empty(0, dtype=bool)
+        self._total_length = 0.0
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, ids, texts):
+        start = len(self._ids)
+        rows = np.arange(start, start + len(ids))
+        self._ids = np.concatenate([self._ids, np.asarray(ids, dtype="int64")])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        lengths = np.zeros(len(ids), dtype="float32")
+        for i, (row, doc_id, text) in enumerate(zip(rows.tolist(), ids, texts)):
+            self._rows[doc_id] = row
+            counts = Counter(tokenize(text))
+            lengths[i] = sum(counts.values())
+            for term, tf in counts.items():
+                postings = self._postings.setdefault(term, ([], []))
+                postings[0].append(row)
+                postings[1].append(tf)
+                self._arrays.pop(term, None)
+        self._lengths = np.concatenate([self._lengths, lengths])
+        self._total_length += float(lengths.sum())
+
+    def remove(self, ids):
+        for doc_id in ids:
+            row = self._rows.pop(doc_id, None)
+            if row is not None:
+                self._alive[row] = False
+                self._total_length -= float(self._lengths[row])
+        if len(self._ids) - len(self._rows) > len(self._ids) // 5:
+            self._compact()
+
+    def search(self, query, k=5):
+        """
+        Up to k (id, score) pairs, best first. Documents sharing no term with the query are left out.
+        """
+        live = len(self._rows)
+        terms = [term for term in set(tokenize(query)) if term in self._postings]
+        if not live or not terms:
+            return []
+
+        rows, weights = [], []
+        avg_length = self._total_length / live
+        for term in terms:
+            term_rows, tfs = self._term_arrays(term)
+            alive = self._alive[term_rows]
+            df = int(alive.sum())
+            if not df:
+                continue
+            idf = np.log1p((live - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self._lengths[term_rows] / avg_length)
+            rows.append(term_rows[alive])
+            weights.append((idf * tfs * (self.k1 + 1) / (tfs + norm))[alive])
+        if not rows:
+            return []
+
+        scores = np.bincount(np.concatenate(rows), weights=np.concatenate(weights), minlength=len(self._ids))
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+        matched = matched[np.argsort(-scores[matched], kind="stable")]
+        return list(zip(self._ids[matched].tolist(), scores[matched].tolist()))
+
+    def _term_arrays(self, term):
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            rows, tfs = self._postings[term]
+            arrays = (np.array(rows, dtype="int64"), np.array(tfs, dtype="float32"))
+            self._arrays[term] = arrays
+        return arrays
+
+    def _compact(self):
+        # Drops dead rows and renumbers the live ones in place
+        new_row = np.cumsum(self._alive) - 1
+        for term in list(self._postings):
+            rows, tfs = self._term_arrays(term)
+            keep = self._alive[rows]
+            if not keep.any():
+                del self._postings[term]
+                self._arrays.pop(term, None)
+                continue
+            rows, tfs = new_row[rows[keep]], tfs[keep]
+            self._postings[term] = (rows.tolist(), tfs.tolist())
+            self._arrays[term] = (rows, tfs)
+        self._ids = self._ids[self._alive]
+        self._lengths = self._lengths[self._alive]
+        self._alive = np.ones(len(self._ids), dtype=bool)
+        self._rows = {doc_id: row for row, doc_id in enumerate(self._ids.tolist())}
@@ -1,29 +1,190 @@
 import discord
 import os
-import requests  # To send POST requests to FastAPI
+import asyncio
+import aiohttp
 from bs4 import BeautifulSoup
 from dotenv import load_dotenv
 from discord.ext import commands
 import time
 import json
+import threading
+import inspect
 import tempfile
-from sentence_transformers import SentenceTransformer
-import faiss
-import PyPDF2
-import tempfile
-from scraper_methods import save_markdown_to_file, scrape_webpage, search_duckduckgo_async
+from typing import Literal, get_args, get_origin
+# Heavy libraries (PyPDF2, and sentence_transformers/faiss for embeddings) are imported
+# inside the helpers that use them, so the bot connects without paying for them up front
+from document_extraction import iter_pages, stream_pages
+from scraper_methods import save_markdown_to_file, scrape_webpage, search_duckduckgo_async, scrape_search_results
+from http_client import http, HttpError
+from http_cache import web_cache
+from replica_pool import ReplicaBusyError, ReplicaPool
+from vector_store import VectorStore
+from embeddings import Embedder
+from rag_engine import RagEngine
+from reranker import Reranker
+from chunker import Chunker
+from summarizer import MapReduceSummarizer
+from response_cache import ResponseCache
+from discord_outbox import Outbox
+from metrics import Trace, current_trace, stage
+import metrics
+
+# MicroRag inference replicas, comma separated (e.g. "http://gpu1:8001,http://gpu2:8001")
+inference_pool = ReplicaPool(os.getenv("MICRORAG_URLS", "http://localhost:8001").split(","), http)
+
+# Optional port for a Prometheus /metrics endpoint with per-command stage timings
+BOT_METRICS_PORT = os.getenv("BOT_METRICS_PORT")
+
+class KittyBot(commands.Bot):
+    async def setup_hook(self):
+        # Keep replica health up to date in the background
+        self.health_task = asyncio.create_task(inference_pool.run_health_checks())
+        self.metrics_runner = await start_metrics_server(int(BOT_METRICS_PORT)) if BOT_METRICS_PORT else None
+
+    async def close(self):
+        # Release pooled backend connections along with the Discord connection
+        # setup_hook may not have run (e.g. login failed)
+        health_task = getattr(self, "health_task", None)
+        if health_task is not None:
+            health_task.cancel()
+        if getattr(self, "metrics_runner", None):
+            await self.metrics_runner.cleanup()
+        await http.close()
+        await super().close()
+
+async def start_metrics_server(port):
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(text=metrics.render(), content_type="text/plain")
+
+    server = web.Application()
+    server.router.add_get("/metrics", handle)
+    runner = web.AppRunner(server)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    return runner
 
 # Intents and Bot Setup
 intents = discord.Intents.default()
 intents.message_content = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+bot = KittyBot(command_prefix="!", intents=intents)
+
+@bot.before_invoke
+async def start_trace(ctx):
+    # Every command gets a request id and per-stage timers (download, extraction,
+    # retrieval, generation, discord_send); the id is sent to the API as X-Request-ID
+    current_trace.set(Trace(ctx.command.qualified_name))
+
+@bot.after_invoke
+async def finish_trace(ctx):
+    trace = current_trace.get()
+    if trace is not None:
+        trace.finish("error" if ctx.command_failed else "ok")
+
+def trace_headers():
+    trace = current_trace.get()
+    return {"X-Request-ID": trace.request_id} if trace else {}
+
+def timing_summary(elapsed):
+    trace = current_trace.get()
+    breakdown = f" ({trace.summary()})" if trace and trace.stages else ""
+    return f"API Request took {elapsed:.2f} seconds.{breakdown}"
+
+# In-process retrieval (LOCAL_RAG=1) instead of the document service on port 8003.
+# The engine (index directory, embedding cache) is only built when a document is first
+# indexed or queried, and the embedding model and FAISS only loaded then.
+LOCAL_RAG = os.getenv("LOCAL_RAG", "0") == "1"
+RAG_INDEX_DIR = os.getenv("RAG_INDEX_DIR", "rag_index")
+# Optional cross-encoder that re-scores the retrieved chunks before the best ones are used
+RERANK_MODEL = os.getenv("RERANK_MODEL")
+_rag_engine = None
+_rag_engine_lock = threading.Lock()
+
+def rag_engine():
+    global _rag_engine
+    with _rag_engine_lock:  # Also called from worker threads
+        if _rag_engine is None:
+            _rag_engine = RagEngine(
+                VectorStore(RAG_INDEX_DIR, index_type=os.getenv("RAG_INDEX_TYPE", "hnsw")),
+                # Chunk vectors are cached by content, so re-uploading a revised file only embeds what changed
+                Embedder(os.getenv("EMBEDDING_MODEL", "all-MiniLM-L6-v2"), cache_path=os.path.join(RAG_INDEX_DIR, "embeddings.sqlite3")),
+                # BM25 catches pasted identifiers and error strings that embeddings blur together
+                mode=os.getenv("RAG_RETRIEVAL", "hybrid"),
+                reranker=Reranker(RERANK_MODEL, budget_ms=float(os.getenv("RERANK_BUDGET_MS", 300))) if RERANK_MODEL else None,
+                rerank_candidates=int(os.getenv("RERANK_CANDIDATES", 20)),
+            )
+        return _rag_engine
+
+# Chunk size in embedding-model tokens, and tokens shared between neighbouring chunks
+CHUNK_TOKENS = int(os.getenv("CHUNK_TOKENS", 256))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 32))
 
-# Load SentenceTransformer Model and Initialize FAISS Index
-# embedding_model = SentenceTransformer("all-MiniLM-L6-v2")  # Lightweight embedding model
-# embedding_dim = embedding_model.get_sentence_embedding_dimension()
-# index = faiss.IndexFlatL2(embedding_dim)  # FAISS index for embeddings
-# user_contexts = {}  # Store user-specific chunks
+def document_chunker():
+    # Never larger than the embedding model's window, so no chunk is silently truncated
+    embedder = rag_engine().embedder
+    return Chunker(embedder.tokenizer, max_tokens=min(CHUNK_TOKENS, embedder.max_tokens), overlap=CHUNK_OVERLAP)
 
+def rag_namespace(ctx):
+    """
+    Documents are shared within a server; in DMs each user has their own.
+    """
+    return f"guild-{ctx.guild.id}" if ctx.guild else f"user-{ctx.author.id}"
+
+async def retrieve(ctx, user_query, limit=5):
+    """
+    Top matching document chunks as [{"text", "metadata", "score"}], or None if retrieval failed.
+    """
+    with stage("retrieval"):
+        if LOCAL_RAG:
+            return await asyncio.to_thread(rag_engine().query, rag_namespace(ctx), user_query, limit)
+
+        formatted_query = user_query.replace(" ", "_")
+        url = f"http://127.0.0.1:8003/query?query={formatted_query}&limit={limit}"
+        try:
+            response = await http.get(url, headers=trace_headers())
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            return None
+    if response.status != 200:
+        return None
+    return response.json()
+
+# Chunks embedded and indexed together while an upload is still being parsed
+INDEX_BATCH_CHUNKS = 32
+
+async def index_upload(namespace, filename, path, file_ext):
+    """
+    Parses, chunks and indexes an upload as one stream: only a few pages are in memory
+    at a time, and the first chunks are searchable before the last page is parsed.
+    """
+    # Parsing and chunking count as extraction; embedding and saving as indexing
+    with stage("extraction"):
+        await asyncio.to_thread(rag_engine().start_document, namespace, filename)
+        count = 0
+        pending = []
+        async for chunk in stream_chunks(stream_pages(path, file_ext)):
+            pending.append(chunk)
+            if len(pending) == INDEX_BATCH_CHUNKS:
+                with stage("indexing"):
+                    count += await asyncio.to_thread(rag_engine().add_chunks, namespace, filename, pending, count)
+                pending = []
+        with stage("indexing"):
+            if pending:
+                count += await asyncio.to_thread(rag_engine().add_chunks, namespace, filename, pending, count)
+            await asyncio.to_thread(rag_engine().store.save, namespace)
+    return count
+
+async def stream_chunks(pages):
+    """
+    Token-sized, overlapping chunks of a stream of pages, produced as the pages arrive.
+    """
+    chunker = await asyncio.to_thread(document_chunker)  # Loads the embedding model's tokenizer
+    stream = chunker.stream()
+    async for page in pages:
+        for chunk in await asyncio.to_thread(stream.feed, page):
+            yield chunk
+    for chunk in stream.close():
+        yield chunk
 
 
 
@@ -31,25 +192,157 @@ bot = commands.Bot(command_prefix="!", intents=intents)
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
+    await register_prompt_prefixes()
+
+async def register_prompt_prefixes():
+    """
+    Tells the FastAPI server which prompt beginnings we reuse, so it can cache their prefill.
+    Best effort: the bot works the same (only slower) if this fails.
+    """
+    for replica in inference_pool.replicas:
+        url = f"{replica.url}/register_prefix"
+        try:
+            # Everything up to the user's query is identical across !function calls
+            response = await http.post(url, json={"query_prefix": f"{FUNCTION_PROMPT_PREFIX}    Query:"})
+            response.raise_for_status()
+            print(f"Registered !function prompt prefix on {replica.url} ({response.json()['tokens']} tokens)")
+        except (aiohttp.ClientError, asyncio.TimeoutError, HttpError) as e:
+            print(f"Could not register prompt prefixes on {replica.url}: {e}")
+
+# Seconds between in-place edits of a streaming reply (Discord rate-limits message edits)
+STREAM_EDIT_INTERVAL = 1.0
+# Seconds the API may spend on one answer before replying with what it has so far
+GENERATION_TIMEOUT = float(os.getenv("GENERATION_TIMEOUT", "120"))
+# Where the model starts making up the next question; the answer ends there
+ANSWER_STOP_SEQUENCES = ["\nQuery:", "### Query:"]
 
 # Async helper to send requests to FastAPI
-async def generate_with_api(query, context=None, max_length=200):
+async def generate_with_api(query, context=None, max_length=200, on_update=None, json_schema=None, contexts=None, on_context=None):
     """
-    Sends a POST request to the FastAPI server for inference.
+    Streams a generation from the FastAPI server and returns the full answer.
+    If `on_update` is given, it is awaited with the text generated so far as tokens arrive.
+    If `json_schema` is given, the server only generates JSON matching it.
+    `contexts` are retrieved chunks, best first; the server keeps the ones that fit its
+    token budget, dropping near-duplicates, and `on_context` is called with the indices it used.
     """
+    payload = {
+        "query": query,
+        "context": context,
+        "contexts": contexts,
+        "max_length": max_length,
+        "json_schema": json_schema,
+        "timeout": GENERATION_TIMEOUT,
+        "stop": ANSWER_STOP_SEQUENCES,
+    }
+    text = ""
+    tried = []
     try:
-        url = "http://localhost:8001/generate"
-        payload = {
-            "query": query,
-            "context": context,
-            "max_length": max_length,
-        }
-        response = requests.post(url, json=payload)
-        response.raise_for_status()  # Raise error for bad status codes
-        return response.json()["response"]
-    except requests.RequestException as e:
+        # Least-loaded replica first; fail over to another one if it can't be reached or is full
+        while True:
+            last_try = len(tried) + 1 >= inference_pool.size
+            try:
+                async with inference_pool.acquire(exclude=tried) as replica:
+                    tried.append(replica)
+                    # http.stream never retries, so failing over is left to this loop
+                    async with http.stream("POST", f"{replica.url}/generate_stream", json=payload, headers=trace_headers()) as response:
+                        if response.status == 503 and not last_try:
+                            raise ReplicaBusyError(replica.url)  # Queue full; try another replica
+                        response.raise_for_status()  # Raise error for bad status codes
+                        async for line in response.content:
+                            if not line.strip():
+                                continue
+                            event = json.loads(line)
+                            if "error" in event:
+                                return f"Error: {event['error']}"
+                            if event.get("done"):
+                                text = event["response"]
+                                if on_context and "context" in event:
+                                    on_context(event["context"]["used"])
+                                break
+                            text += event["token"]
+                            if on_update:
+                                await on_update(text)
+                    return text.strip()
+            except ReplicaBusyError:
+                continue
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                # Only retry before anything was shown to the user
+                if text or last_try:
+                    raise
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         return f"Error: Unable to reach FastAPI server. Details: {e}"
 
+async def batch_generate_with_api(prompts, max_new_tokens=200):
+    """
+    Generates answers for several prompts in one /batch_generate call and returns them in order.
+    Fails over to another replica if one can't be reached or is full.
+    """
+    payload = {"prompts": prompts, "max_new_tokens": max_new_tokens}
+    tried = []
+    while True:
+        last_try = len(tried) + 1 >= inference_pool.size
+        try:
+            async with inference_pool.acquire(exclude=tried) as replica:
+                tried.append(replica)
+                # A batch takes much longer than a single answer. Not retried on the same
+                # replica (that could repeat up to 10 minutes of GPU work); this loop fails over.
+                response = await http.post(
+                    f"{replica.url}/batch_generate",
+                    json=payload,
+                    headers=trace_headers(),
+                    timeout=aiohttp.ClientTimeout(total=600),
+                    retries=0,
+                )
+                if response.status == 503 and not last_try:
+                    raise ReplicaBusyError(replica.url)
+                response.raise_for_status()
+                return response.json()["responses"]
+        except ReplicaBusyError:
+            continue
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+            if last_try:
+                raise
+
+# !summarize: map-reduce over the whole document. Partial summaries are kept on disk,
+# so retrying a failed or interrupted summary only generates what is missing.
+summarizer = MapReduceSummarizer(
+    batch_generate_with_api,
+    cache=ResponseCache(max_entries=4096, ttl=7 * 24 * 3600, disk_dir=os.getenv("SUMMARY_CACHE_DIR", "summary_cache")),
+)
+
+# Everything the bot posts in bulk goes through here: packed into few messages, within Discord's rate limits
+outbox = Outbox()
+
+class LiveMessage:
+    """
+    A Discord message that is edited in place while a streamed answer grows.
+    Edits are throttled to one per `interval` seconds; the final update always goes out.
+    """
+    def __init__(self, channel, prefix, interval=STREAM_EDIT_INTERVAL):
+        self.channel = channel
+        self.prefix = prefix
+        self.interval = interval
+        self.message = None
+        self.last_edit = 0.0
+
+    async def update(self, text, final=False):
+        now = time.monotonic()
+        if not final and self.message and now - self.last_edit < self.interval:
+            return
+        self.last_edit = now
+
+        parts = [text[i:i + 1900] for i in range(0, len(text), 1900)] or ["⏳"]
+        head = f"{self.prefix}{parts[0]}" + ("…" if len(parts) > 1 and not final else "")
+        with stage("discord_send"):
+            if self.message is None:
+                self.message = (await outbox.send(self.channel, head, separate=True))[0]
+            elif self.message.content != head:
+                self.message = await self.message.edit(content=head)
+
+            if final and len(parts) > 1:
+                # Anything past the first message goes out packed (as embeds or a file when long)
+                await outbox.send(self.channel, text[len(parts[0]):])
+
 # Command: !prompt
 @bot.command()
 async def prompt(ctx, *, prompt_text: str):
@@ -68,20 +361,21 @@ async def prompt(ctx, *, prompt_text: str):
     # Measure API request time
     start_time = time.time()
     try:
-        async with ctx.typing():
-            # Send query to the API
-            generated_text = await generate_with_api(query, context=context, max_length=300)
-            
-            # Extract and send the response
-            response = extract_answer(generated_text)
-            await ctx.send(f"**Response:** {response}")
+        # Stream the answer into one message as it is generated
+        live = LiveMessage(ctx.channel, "**Response:** ")
+        with stage("generation"):
+            generated_text = await generate_with_api(query, context=context, max_length=300, on_update=live.update)
+
+        # Extract and send the final response
+        response = extract_answer(generated_text) if "Answer:" in generated_text else generated_text
+        await live.update(response, final=True)
 
     except Exception as e:
         # Handle errors and inform the user
         await ctx.send(f"Error: {e}")
 
     end_time = time.time()
-    await ctx.send(f"API Request took {end_time - start_time:.2f} seconds.")
+    await outbox.send(ctx.channel, timing_summary(end_time - start_time))
 
 @bot.command()
 async def rag(ctx):
@@ -101,20 +395,34 @@ async def rag(ctx):
         return
 
     # Save the file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
+    with stage("download"), tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
         await attachment.save(temp_file.name)
 
-    # Prepare the request payload
-    files = {"file": open(temp_file.name, "rb")}
+    if LOCAL_RAG:
+        try:
+            async with ctx.typing():
+                count = await index_upload(rag_namespace(ctx), attachment.filename, temp_file.name, file_ext)
+            await ctx.send(f"✅ **Indexed {attachment.filename}!**\n📄 **Processed Chunks:** {count}")
+        except Exception as e:
+            await ctx.send(f"⚠️ Error: {e}")
+        finally:
+            os.remove(temp_file.name)
+        return
+
     url = "http://localhost:8000/api/upload-document/"  # Django backend upload endpoint
 
     # Send the file to Django
     try:
         async with ctx.typing():
-            response = requests.post(url, files=files)
+            with open(temp_file.name, "rb") as f:
+                # Prepare the request payload
+                form = aiohttp.FormData()
+                form.add_field("file", f, filename=os.path.basename(temp_file.name))
+                # Uploads are not retried: the backend may already be indexing the first attempt
+                response = await http.post(url, data=form, retries=0)
             os.remove(temp_file.name)  # Cleanup temp file
 
-            if response.status_code == 200:
+            if response.status == 200:
                 result = response.json()
                 print(f"✅ **Upload Successful!**\n📄 **Processed Chunks:** {result.get('chunks', 'Unknown')}\n🔄 Your document is now being indexed for retrieval.")
                 await ctx.send(f"✅ **Upload Successful!**\n📄 **Processed Chunks:** {len(result.get('chunks', 'Unknown'))}\n🔄 Your document is now being indexed for retrieval.")
@@ -127,83 +435,63 @@ async def rag(ctx):
 @bot.command()
 async def rag_query(ctx, *, user_query: str):
     """
-    Queries the stored documents in Qdrant and returns relevant text chunks in a dedicated thread.
-    If a chunk exceeds 1900 characters, it is split into multiple messages labeled as Part 1, Part 2, etc.
+    Queries the stored documents and returns relevant text chunks in a dedicated thread,
+    packed into as few messages as Discord allows (embeds or a file when they are long).
     """
-    formatted_query = user_query.replace(" ", "_")
-    url = f"http://127.0.0.1:8003/query?query={formatted_query}&limit=5"
-
-    response = requests.get(url)
-
-    if response.status_code != 200:
+    results = await retrieve(ctx, user_query)
+    if results is None:
         await ctx.send("❌ Error querying the document database.")
         return
 
-    results = response.json()
-
     if not results:
         await ctx.send("❌ No relevant documents found.")
         return
 
-    # Create a thread to display the query results
-    thread = await ctx.channel.create_thread(
-        name=f"📖 RAG Query: {user_query[:50]}",
-        message=ctx.message,
-        auto_archive_duration=60
-    )
-
-    # Send each retrieved chunk in the thread
-    for i, result in enumerate(results):
-        chunk_text = result['text']
-        metadata = result['metadata']['filename']
-        score = result['score']
-
-        if len(chunk_text) <= 1900:
-            # If the chunk is short enough, send it as a single message
-            formatted_result = (
-                f"**📌 Match {i+1}:**\n"
-                f"🔹 *{chunk_text}*\n"
-                f"📝 **Source:** {metadata} (Score: {score:.4f})"
-            )
-            await thread.send(formatted_result)
-        else:
-            # If the chunk is too long, split it into multiple messages
-            parts = [chunk_text[i:i+1900] for i in range(0, len(chunk_text), 1900)]
-            for part_num, part in enumerate(parts, start=1):
-                part_label = f"**📌 Match {i+1}, Part {part_num}:**" if len(parts) > 1 else f"**📌 Match {i+1}:**"
-                formatted_result = (
-                    f"{part_label}\n"
-                    f"🔹 *{part}*"
-                )
-                await thread.send(formatted_result)
-
-            # After the last part, attach metadata information
-            await thread.send(f"📝 **Source:** {metadata} (Score: {score:.4f})")
+    # Posting to Discord is often the slowest part of a !rag_query
+    with stage("discord_send"):
+        # Create a thread to display the query results
+        thread = await ctx.channel.create_thread(
+            name=f"📖 RAG Query: {user_query[:50]}",
+            message=ctx.message,
+            auto_archive_duration=60
+        )
+
+        # One block per match; the outbox packs them into as few messages as fit
+        blocks = [
+            f"**📌 Match {i+1}:**\n"
+            f"🔹 *{result['text'].strip()}*\n"
+            f"📝 **Source:** {result['metadata']['filename']} (Score: {result['score']:.4f})"
+            for i, result in enumerate(results)
+        ]
+        await outbox.send(thread, *blocks, "✅ **All relevant document chunks have been posted.**")
 
-    await thread.send("✅ **All relevant document chunks have been posted.**")
+@bot.command()
+async def rag_forget(ctx, *, filename: str):
+    """
+    Removes a previously uploaded document from the local index (LOCAL_RAG only).
+    """
+    if not LOCAL_RAG:
+        await ctx.send("❌ Documents can only be removed from the local index (LOCAL_RAG=1).")
+        return
+    removed = await asyncio.to_thread(rag_engine().delete_document, rag_namespace(ctx), filename)
+    if removed:
+        await ctx.send(f"🗑️ Removed {removed} chunks of {filename}.")
+    else:
+        await ctx.send(f"❌ No indexed document named {filename}.")
 
 @bot.command()
 async def query(ctx, *, user_query: str):
     """
-    Requests /query_llm for just the response without document retrieval.
-    The bot will indicate that it's typing while waiting for a response.
+    Retrieves matching document chunks and streams the LLM's answer, using them as context.
+    The answer is edited into a message in a dedicated thread as tokens arrive.
     """
-    formatted_query = user_query.replace(" ", "_")
-    url = f"http://127.0.0.1:8003/query_llm?query={formatted_query}"
-
-    async with ctx.typing():  # Show "Kitty is typing..." while processing
-        response = requests.get(url)
-
-        if response.status_code != 200:
+    async with ctx.typing():  # Show "Kitty is typing..." while retrieving
+        results = await retrieve(ctx, user_query)
+        if results is None:
             await ctx.send("❌ Error querying the database.")
             return
 
-        data = response.json()
-        if "error" in data:
-            await ctx.send(f"❌ {data['error']}")
-            return
-
-        llm_response = data.get("llm_response", "No response found.")
+        contexts = [result["text"] for result in results] if results else None
 
     # Create a thread for clean organization
     thread = await ctx.channel.create_thread(
@@ -212,21 +500,13 @@ async def query(ctx, *, user_query: str):
         auto_archive_duration=60
     )
 
-    # Send response in thread
-    if len(llm_response) > 2000:
-        chunks = [llm_response[i:i+2000] for i in range(0, len(llm_response), 2000)]
-        for chunk in chunks:
-            await thread.send(chunk)
-    else:
-        await thread.send(f"**Response:**\n{llm_response}")
-
-    if len(llm_response) > 6000:
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".txt") as temp_file:
-            temp_file.write(llm_response.encode("utf-8"))
-            temp_file_path = temp_file.name
-
-        await thread.send("📂 The response is too long. Here's a file instead:", file=discord.File(temp_file_path))
-
+    # Stream the response into the thread
+    live = LiveMessage(thread, "**Response:**\n")
+    with stage("generation"):
+        llm_response = await generate_with_api(user_query, contexts=contexts, max_length=300, on_update=live.update)
+    if not llm_response:
+        llm_response = "No response found."
+    await live.update(llm_response, final=True)  # Long answers continue as embeds or a file
 
 
 @bot.command()
@@ -248,33 +528,39 @@ async def summarize(ctx):
         return
 
     # Save the uploaded file temporarily
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
+    with stage("download"), tempfile.NamedTemporaryFile(delete=False, suffix=f".{file_ext}") as temp_file:
         await attachment.save(temp_file.name)
 
-        # Extract text based on file type
-        if file_ext == "pdf":
-            text = extract_text_from_pdf(temp_file.name)
-        elif file_ext == "txt":
-            with open(temp_file.name, "r", encoding="utf-8") as f:
-                text = f.read()
+    progress = LiveMessage(ctx.channel, "📚 ")
+
+    async def on_progress(done, total, level):
+        phase = "Summarizing sections" if level == 1 else f"Combining summaries (pass {level - 1})"
+        await progress.update(f"{phase}: {done}/{total}", final=done == total)
 
-    # Send the extracted text to FastAPI for summarization
-    prompt = f"Summarize the following text:\n{text[:2000]}"  # Limit input size for safety
     start_time = time.time()
-    async with ctx.typing():
-        generated_summary = await generate_with_api(prompt, max_length=300)
-        end_time = time.time()
+    try:
+        async with ctx.typing():
+            # The whole document is summarized, chunk by chunk, then the summaries are merged
+            with stage("extraction"):
+                chunks = await asyncio.to_thread(summarizer.chunk, iter_pages(temp_file.name, file_ext))
+            with stage("generation"):
+                summary = await summarizer.summarize(chunks, on_progress=on_progress)
+    except Exception as e:
+        await ctx.send(f"Error: {e}. Run the command again to resume where it stopped.")
+        return
+    finally:
+        os.remove(temp_file.name)
+    end_time = time.time()
 
-        # Send the summary to the user
-        await ctx.send(f"**Summary:**\n{extract_answer(generated_summary)}")
-        await ctx.send(f"API Request took {end_time - start_time:.2f} seconds.")
+    # Send the summary to the user
+    await LiveMessage(ctx.channel, "**Summary:**\n").update(summary or "No text found in the file.", final=True)
+    await outbox.send(ctx.channel, timing_summary(end_time - start_time))
 
 @bot.command()
 async def scrape(ctx, *, user_query: str):
     if user_query.startswith("http"):  # Detects a URL
         async with ctx.typing():
-            markdown_result, preview = scrape_webpage(user_query)
-            print(markdown_result, preview)
+            markdown_result, preview = await scrape_webpage(user_query)
             if not preview:
                 await ctx.send("Error scraping the webpage.")
                 return
@@ -295,35 +581,62 @@ async def search(ctx, *, query: str):
     """Performs a web search using DuckDuckGo."""
     async with ctx.typing():
         results = await search_duckduckgo_async(query)
-        await ctx.send(f"**🔍 Search Results for:** `{query}`\n\n{results}")
+        await outbox.send(ctx.channel, f"**🔍 Search Results for:** `{query}`\n\n{results}")
+
+# Characters of each scraped page passed to the LLM by !web
+WEB_CONTEXT_CHARS = 1500
 
 @bot.command()
-async def function(ctx, *, user_query: str):
-    prompt = f"""
+async def web(ctx, *, query: str):
+    """
+    Answers from the web: scrapes the top DuckDuckGo results in parallel and uses them as context.
+    """
+    async with ctx.typing():
+        with stage("retrieval"):
+            pages = await scrape_search_results(query)
+    if not pages:
+        await ctx.send("❌ Could not fetch any search results.")
+        return
+
+    contexts = [f"{page['title']}\n{page['content'][:WEB_CONTEXT_CHARS]}" for page in pages]
+    used = []  # Pages the server fit into the prompt; mirrors and duplicates are left out
+    live = LiveMessage(ctx.channel, "**Response:** ")
+    with stage("generation"):
+        answer = await generate_with_api(query, contexts=contexts, max_length=300, on_update=live.update, on_context=used.extend)
+    await live.update(answer or "No response found.", final=True)
+    sources = "\n".join(f"🔗 <{pages[i]['url']}>" for i in (used or range(len(pages))))
+    await outbox.send(ctx.channel, f"📝 **Sources:**\n{sources}")
+
+# Few-shot instruction block that starts every !function prompt.
+# It never changes, so the server caches its prefill (see register_prompt_prefixes).
+FUNCTION_PROMPT_PREFIX = """
     Respond ONLY in JSON. Do not add notes, explanations, or any other text. Output strictly the JSON format. 
     Respond with ONLY ONE function argument pair. Provide the function argument pair only ONCE.
     For example:
     User: Calculate the sum of 5 and 7.
-    Assistant: {{"function": "calculate_sum", "arguments": {{"a": 5, "b": 7}}}}
+    Assistant: {"function": "calculate_sum", "arguments": {"a": 5, "b": 7}}
     User: What are the top trending Github repos?
-    Assistant: {{"function": "scrape_github_trending", "arguments": {{"since": "daily"}}}}
+    Assistant: {"function": "scrape_github_trending", "arguments": {"since": "daily"}}
     User: This week's trending top github repos?
-    Assistant: {{"function": "scrape_github_trending", "arguments": {{"since": "weekly"}}}}
+    Assistant: {"function": "scrape_github_trending", "arguments": {"since": "weekly"}}
     User: What are the trending top Github repos for the month?
-    Assistant: {{"function": "scrape_github_trending", "arguments": {{"since": "monthly"}}}}
-    Query: {user_query}
+    Assistant: {"function": "scrape_github_trending", "arguments": {"since": "monthly"}}
+"""
 
-    """
+@bot.command()
+async def function(ctx, *, user_query: str):
+    prompt = f"{FUNCTION_PROMPT_PREFIX}    Query: {user_query}\n\n    "
     async with ctx.typing():
-        response_text = await generate_with_api(prompt)
+        # Constrained to one valid function call, so generation stops as soon as the JSON closes
+        response_text = await generate_with_api(prompt, json_schema=function_call_schema())
 
         # Parse and execute the function
-        parsed_response = extract_json(response_text)
+        parsed_response = parse_function_call(response_text)
         print("parsed responseo", parsed_response)
         
         if "error" not in parsed_response:
-            result = execute_function(parsed_response)
-            await ctx.send(result)
+            result = await execute_function(parsed_response)
+            await outbox.send(ctx.channel, str(result))
         else:
             await ctx.send(parsed_response["error"])
 
@@ -335,7 +648,44 @@ function_map = {
     # Add more functions as needed
 }
 
-def execute_function(parsed_response):
+def function_call_schema():
+    """
+    JSON schema accepting exactly one {"function": ..., "arguments": {...}} call for any
+    function in function_map, with argument types taken from the real function signatures.
+    """
+    options = []
+    for name in function_map:
+        arguments = {}
+        for param in inspect.signature(function_signatures[name]).parameters.values():
+            arguments[param.name] = annotation_schema(param.annotation)
+        options.append({
+            "type": "object",
+            "properties": {
+                "function": {"const": name},
+                "arguments": {"type": "object", "properties": arguments},
+            },
+        })
+    return {"anyOf": options}
+
+def annotation_schema(annotation):
+    if get_origin(annotation) is Literal:
+        return {"enum": list(get_args(annotation))}
+    types = {int: "integer", float: "number", str: "string", bool: "boolean"}
+    if annotation in types:
+        return {"type": types[annotation]}
+    return {}  # Unannotated: a string or a number
+
+def parse_function_call(response_text):
+    """
+    Parses the model's function call. Constrained output is plain JSON; anything else
+    goes through the older "Answer:" extraction.
+    """
+    try:
+        return json.loads(response_text)
+    except json.JSONDecodeError:
+        return extract_json(response_text)
+
+async def execute_function(parsed_response):
     try:
         # If parsed_response is a list, grab the first function call
         if isinstance(parsed_response, list) and len(parsed_response) > 0:
@@ -346,6 +696,8 @@ def execute_function(parsed_response):
         
         if function_name in function_map:
             result = function_map[function_name](**arguments) if arguments else function_map[function_name]()
+            if inspect.isawaitable(result):
+                result = await result  # Functions that do I/O are coroutines
             
             if function_name == "scrape_github_trending":
                 if not result:
@@ -389,17 +741,6 @@ def extract_json(response_text):
     except json.JSONDecodeError:
         return {"error": "Invalid JSON format."}
 
-# Helper: Extract text from PDFs
-def extract_text_from_pdf(pdf_path):
-    with open(pdf_path, "rb") as f:
-        reader = PyPDF2.PdfReader(f)
-        return " ".join(page.extract_text() for page in reader.pages)
-
-# Helper: Split text into chunks
-def split_into_chunks(text, chunk_size=500):
-    words = text.split()
-    return [" ".join(words[i:i + chunk_size]) for i in range(0, len(words), chunk_size)]
-
 
 # Helper: Extract answer after "Answer:" keyword
 def extract_answer(response_text):
@@ -412,11 +753,12 @@ def extract_answer(response_text):
     except Exception as e:
         return f"Error: {e}"
 # Scraping function that supports daily, weekly, or monthly trends
-def scrape_github_trending(since="daily"):
+async def scrape_github_trending(since: Literal["daily", "weekly", "monthly"] = "daily"):
     url = f"https://github.com/trending?since={since}"
     headers = {"User-Agent": "Mozilla/5.0"}
     try:
-        response = requests.get(url, headers=headers)
+        # Cached per `since` value; a stale list is shown at once and refreshed in the background
+        response = await web_cache.get(url, headers=headers, source="trending")
         response.raise_for_status()
         soup = BeautifulSoup(response.text, "html.parser")
 
@@ -453,9 +795,16 @@ def scrape_github_trending(since="daily"):
     except Exception as e:
         return f"Error occurred: {str(e)}"
 
-def calculate_sum(a, b):
+def calculate_sum(a: float, b: float):
     return a + b
 
+# Real signatures behind function_map, used to build the !function JSON schema
+function_signatures = {
+    "calculate_sum": calculate_sum,
+    "scrape_github_trending": scrape_github_trending,
+}
+
 # Load environment variables and run the bot
-load_dotenv()
-bot.run(os.getenv("BOT_TOKEN"))
+if __name__ == "__main__":
+    load_dotenv()
+    bot.run(os.getenv("BOT_TOKEN"))
@@ -0,0 +1,211 @@
+import contextvars
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# Kept free of third-party imports: the API, the scheduler and the bot all record into it.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self._values = {}  # sorted (label, value) pairs -> value
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def render(self):
+        with self._lock:
+            if not self._values:
+                return []  # Never recorded in this process (e.g. API metrics in the bot)
+            lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+            for labels, value in sorted(self._values.items()):
+                lines.extend(self._samples(labels, value))
+        return lines
+
+    def _samples(self, labels, value):
+        return [f"{self.name}{_format_labels(labels)} {value}"]
+
+
+class Counter(_Metric):
+    """
+    Monotonic count, e.g. REQUESTS.inc(endpoint="/generate", status=200).
+    """
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down; the last set() wins.
+    """
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative `buckets`, plus their sum and count.
+    """
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[0][i] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    def _samples(self, labels, value):
+        buckets, total, count = value
+        lines = [
+            f"{self.name}_bucket{_format_labels(labels + (('le', bound),))} {n}"
+            for bound, n in zip(self.buckets, buckets)
+        ]
+        lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {count}")
+        return lines
+
+
+def render():
+    """
+    Every metric in the Prometheus text exposition format.
+    """
+    return "\n".join(line for metric in _registry for line in metric.render()) + "\n"
+
+
+# ---- MicroRag API (app.py, scheduler.py) ----
+
+REQUESTS = Counter("microrag_requests_total", "HTTP requests by endpoint and status code.")
+REQUEST_SECONDS = Histogram("microrag_request_seconds", "Time until the response (or the start of a stream) was ready.")
+ERRORS = Counter("microrag_errors_total", "Failed requests by endpoint and reason.")
+QUEUE_WAIT = Histogram("microrag_queue_wait_seconds", "Time admitted requests waited before the model started on them.")
+PREFILL_SECONDS = Histogram("microrag_prefill_seconds", "Duration of each prompt-encoding (prefill) pass.")
+DECODE_SECONDS = Histogram("microrag_decode_step_seconds", "Duration of each batched decode step.")
+TIME_TO_FIRST_TOKEN = Histogram("microrag_time_to_first_token_seconds", "From admission to the first generated token.")
+BATCH_SIZE = Histogram("microrag_batch_size", "Sequences per prefill, decode step or micro-batch.", buckets=SIZE_BUCKETS)
+GENERATED_TOKENS = Counter("microrag_generated_tokens_total", "Tokens generated by /generate decoding.")
+TOKENS_PER_SECOND = Gauge("microrag_decode_tokens_per_second", "Tokens per second of the latest decode step, across its batch.")
+MICRO_BATCH_SECONDS = Histogram("microrag_micro_batch_seconds", "Duration of each /batch_generate micro-batch.")
+CONTEXT_TOKENS = Histogram(
+    "microrag_context_tokens", "Tokens of retrieved context packed into each prompt.", buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192)
+)
+CONTEXT_CHUNKS = Counter("microrag_context_chunks_total", "Context chunks offered for packing, by outcome (used, duplicates, over_budget).")
+
+# ---- Agent Kitty ----
+
+COMMANDS = Counter("kitty_commands_total", "Bot commands by name and outcome.")
+COMMAND_SECONDS = Histogram("kitty_command_seconds", "Total time per bot command.")
+STAGE_SECONDS = Histogram("kitty_stage_seconds", "Time per command spent in each stage (download, extraction, retrieval, generation, discord_send, ...).")
+
+# ---- request ids and per-stage timing ----
+
+# Id of the request being handled, sent between the bot and the API as X-Request-ID
+request_id = contextvars.ContextVar("request_id", default="-")
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:12]
+
+
+class Trace:
+    """
+    Wall-clock time one bot command spends in each named stage, keyed by a request id
+    that is also sent to the API.
+
+    Stages may nest; time is charged to the innermost one, so the stages of a trace
+    add up to (at most) its total. Use through the module-level `stage()`.
+    """
+    def __init__(self, name, rid=None):
+        self.name = name
+        self.request_id = rid or new_request_id()
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._stack = []  # [stage name, time its current stretch started]
+
+    @contextmanager
+    def stage(self, name):
+        now = time.perf_counter()
+        if self._stack:
+            self._charge(self._stack[-1], now)
+        entry = [name, now]
+        self._stack.append(entry)
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            self._charge(entry, now)
+            self._stack.remove(entry)
+            if self._stack:
+                self._stack[-1][1] = now  # The enclosing stage resumes
+
+    def _charge(self, entry, now):
+        self.stages[entry[0]] = self.stages.get(entry[0], 0.0) + now - entry[1]
+        entry[1] = now
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self):
+        return " · ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages.items())
+
+    def finish(self, status="ok"):
+        """
+        Records the command's total and per-stage times, and logs them on one line.
+        """
+        elapsed = self.elapsed
+        COMMANDS.inc(command=self.name, status=status)
+        COMMAND_SECONDS.observe(elapsed, command=self.name)
+        for name, seconds in self.stages.items():
+            STAGE_SECONDS.observe(seconds, command=self.name, stage=name)
+        print(f"[{self.request_id}] !{self.name} {status} in {elapsed:.2f}s ({self.summary() or 'no stages'})")
+
+
+@contextmanager
+def stage(name):
+    """
+    Times a block as `name` in the current trace, if there is one.
+    """
+    trace = current_trace.get()
+    if trace is None:
+        yield
+        return
+    with trace.stage(name):
+        yield
@@ -0,0 +1,70 @@
+def plan_micro_batches(lengths, new_tokens, token_budget, max_batch_size=32):
+    """
+    Groups prompt indices into micro-batches of similar length.
+
+    Prompts are sorted by token length and packed in order; a batch is padded to its
+    longest prompt plus its longest generation, so it costs len(batch) * that width
+    in tokens, which must stay within `token_budget` (a prompt over budget on its own
+    still gets a batch of one).
+    """
+    order = sorted(range(len(lengths)), key=lambda i: lengths[i])
+    batches, current, width = [], [], 0
+    for i in order:
+        needed = max(width, lengths[i] + new_tokens[i])
+        if current and (len(current) == max_batch_size or (len(current) + 1) * needed > token_budget):
+            batches.append(current)
+            current, needed = [], lengths[i] + new_tokens[i]
+        current.append(i)
+        width = needed
+    if current:
+        batches.append(current)
+    return batches
+
+
+def stop_on_deadline(deadline):
+    """
+    Stopping criterion that ends model.generate at the next step once `deadline`
+    (an inference_queue.RequestDeadline) expires or is cancelled.
+    """
+    import torch
+    from transformers import StoppingCriteria, StoppingCriteriaList
+
+    class _DeadlineCriteria(StoppingCriteria):
+        def __call__(self, input_ids, scores, **kwargs):
+            return torch.full((input_ids.shape[0],), deadline.expired, dtype=torch.bool, device=input_ids.device)
+
+    return StoppingCriteriaList([_DeadlineCriteria()])
+
+
+def generate_micro_batch(model, tokenizer, prompt_ids, new_tokens, deadline=None):
+    """
+    Generates for already-tokenized prompts in one left-padded batch.
+    Returns (texts, finish_reason): the decoded continuation of each prompt, cut to its
+    own `new_tokens`, and None, or the deadline's reason if it expired during generation
+    (the texts then hold what was generated in time). Returns None if `deadline` had
+    already expired, without generating anything.
+    """
+    import torch
+
+    if deadline is not None and deadline.expired:
+        return None  # Nobody is waiting for these any more
+
+    width = max(len(ids) for ids in prompt_ids)
+    pad = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+    input_ids = torch.tensor([[pad] * (width - len(ids)) + ids for ids in prompt_ids], device=model.device)
+    attention_mask = torch.tensor(
+        [[0] * (width - len(ids)) + [1] * len(ids) for ids in prompt_ids], device=model.device
+    )
+    with torch.no_grad():
+        output = model.generate(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            max_new_tokens=max(new_tokens),
+            pad_token_id=pad,
+            stopping_criteria=stop_on_deadline(deadline) if deadline is not None else None,
+        )
+    texts = [
+        tokenizer.decode(row[width:width + count], skip_special_tokens=True)
+        for row, count in zip(output.tolist(), new_tokens)
+    ]
+    return texts, deadline.reason if deadline is not None and deadline.expired else None
@@ -0,0 +1,167 @@
+import asyncio
+import gc
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+
+class UnknownModelError(KeyError):
+    """
+    Raised when a request names a model that isn't in the registry's available list.
+    """
+
+
+class ModelEntry:
+    """
+    A loaded model with everything built around it (tokenizer, pipeline, scheduler).
+    """
+    def __init__(self, name, model, tokenizer, generator, scheduler):
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.generator = generator
+        self.scheduler = scheduler
+        self.memory_bytes = model.get_memory_footprint()
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.load_seconds = 0.0
+        self.in_use = 0  # Requests currently holding this model; it is never evicted while > 0
+
+    def close(self):
+        self.scheduler.close()
+
+    def describe(self):
+        return {
+            "name": self.name,
+            "memory_bytes": self.memory_bytes,
+            "memory_gb": round(self.memory_bytes / 1024 ** 3, 2),
+            "load_seconds": round(self.load_seconds, 2),
+            "loaded_at": self.loaded_at,
+            "last_used": self.last_used,
+            "in_use": self.in_use,
+        }
+
+
+class ModelRegistry:
+    """
+    Loads models on first use and keeps them until memory runs short.
+
+    `loader(name)` builds a ModelEntry (blocking; run on a worker thread). Only names
+    in `available` can be loaded, and concurrent requests for a model that is still
+    loading wait for the same load. When `memory_budget` (bytes) would be exceeded,
+    idle models are evicted least-recently-used first, before the new model loads:
+    `estimator(name)` (blocking, optional) predicts the footprint of a model that
+    hasn't been loaded yet. Warmup hooks run on every freshly loaded entry before it
+    serves traffic.
+    """
+    def __init__(self, loader, available, default, memory_budget=None, estimator=None):
+        self.loader = loader
+        self.estimator = estimator
+        self.available = list(available)
+        self.default = default
+        self.memory_budget = memory_budget
+        self._entries = OrderedDict()  # name -> ModelEntry, least recently used first
+        self._locks = {}
+        self._sizes = {}  # name -> last measured (or estimated) footprint, to make room before a load
+        self._warmup_hooks = []
+
+    def add_warmup_hook(self, hook):
+        """
+        Registers hook(entry), called on the loading thread after each model load.
+        """
+        self._warmup_hooks.append(hook)
+
+    def loaded(self):
+        return list(self._entries.values())
+
+    def is_loaded(self, name=None):
+        return (name or self.default) in self._entries
+
+    def total_bytes(self):
+        return sum(entry.memory_bytes for entry in self._entries.values())
+
+    async def acquire(self, name=None):
+        """
+        Returns the entry for `name` (default model if None), loading it if needed,
+        and marks it in use. Pair with release().
+        """
+        name = name or self.default
+        if name not in self.available:
+            raise UnknownModelError(name)
+
+        entry = self._entries.get(name)
+        if entry is None:
+            async with self._locks.setdefault(name, asyncio.Lock()):
+                entry = self._entries.get(name)
+                if entry is None:
+                    if name not in self._sizes:
+                        self._sizes[name] = await self._estimate(name)
+                    self._make_room(self._sizes[name], keep=name)
+                    entry = await asyncio.to_thread(self._load, name)
+                    self._entries[name] = entry
+                    self._sizes[name] = entry.memory_bytes
+                    self._make_room(0, keep=name)
+
+        self._entries.move_to_end(name)
+        entry.in_use += 1
+        return entry
+
+    def release(self, entry):
+        entry.in_use -= 1
+        entry.last_used = time.time()
+
+    @asynccontextmanager
+    async def use(self, name=None):
+        entry = await self.acquire(name)
+        try:
+            yield entry
+        finally:
+            self.release(entry)
+
+    def evict(self, name):
+        entry = self._entries.pop(name)
+        entry.close()
+        print(f"Evicted model {name} ({entry.memory_bytes / 1024 ** 3:.2f} GB)")
+        del entry
+        gc.collect()
+        import torch  # Only needed once something is loaded, so not at import time
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def describe(self):
+        return {
+            "default": self.default,
+            "available": self.available,
+            "memory_budget_bytes": self.memory_budget,
+            "loaded_bytes": self.total_bytes(),
+            "loaded": [entry.describe() for entry in self._entries.values()],
+        }
+
+    def _load(self, name):
+        start = time.monotonic()
+        print(f"Loading model {name}...")
+        entry = self.loader(name)
+        for hook in self._warmup_hooks:
+            hook(entry)
+        entry.load_seconds = time.monotonic() - start
+        print(f"Loaded model {name} in {entry.load_seconds:.1f}s ({entry.memory_bytes / 1024 ** 3:.2f} GB)")
+        return entry
+
+    async def _estimate(self, name):
+        if not self.memory_budget or self.estimator is None:
+            return 0
+        try:
+            return await asyncio.to_thread(self.estimator, name)
+        except Exception as e:
+            print(f"Error: could not estimate the size of {name}: {e}")
+            return 0
+
+    def _make_room(self, needed, keep):
+        if not self.memory_budget:
+            return
+        for name in list(self._entries):
+            if self.total_bytes() + needed <= self.memory_budget:
+                break
+            if name == keep or self._entries[name].in_use:
+                continue
+            self.evict(name)
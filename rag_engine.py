@@ -0,0 +1,102 @@
+def reciprocal_rank_fusion(rankings, limit, k=60):
+    """
+    Merges ranked hit lists into one: each hit scores sum(1 / (k + rank)) over the
+    lists it appears in, so agreement between rankers matters more than raw scores,
+    which aren't comparable between cosine similarity and BM25.
+    """
+    fused = {}
+    for hits in rankings:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], dict(hit, score=0.0))
+            entry["score"] += 1.0 / (k + rank)
+    return sorted(fused.values(), key=lambda hit: hit["score"], reverse=True)[:limit]
+
+
+class RagEngine:
+    """
+    Document retrieval that runs inside the bot process.
+
+    Chunks are embedded with `embedder` and kept in `store` (a VectorStore), one
+    namespace per guild or user. Re-indexing a filename replaces its old chunks.
+
+    Queries are answered by `mode`: "vector" (embedding similarity), "keyword" (BM25,
+    good at exact identifiers and error strings) or "hybrid", which fuses the top
+    `candidates` of both with reciprocal rank fusion.
+
+    With a `reranker`, the top `rerank_candidates` are retrieved and a cross-encoder
+    picks the final hits among them.
+    Blocking; call through asyncio.to_thread.
+    """
+    def __init__(self, store, embedder, mode="hybrid", candidates=50, reranker=None, rerank_candidates=20):
+        self.store = store
+        self.embedder = embedder
+        self.mode = mode
+        self.candidates = candidates
+        self.reranker = reranker
+        self.rerank_candidates = rerank_candidates
+
+    def index_document(self, namespace, filename, chunks):
+        """
+        Embeds and stores a document's chunks. Returns how many were stored.
+        """
+        self.start_document(namespace, filename)
+        count = self.add_chunks(namespace, filename, chunks)
+        self.store.save(namespace)
+        return count
+
+    def start_document(self, namespace, filename):
+        """
+        Drops any earlier version of a document before its chunks are added again.
+        """
+        self.store.delete_where(namespace, filename=filename)
+
+    def add_chunks(self, namespace, filename, chunks, first_chunk=0):
+        """
+        Embeds and stores the next chunks of a document being indexed as a stream;
+        they are searchable right away. Call save() on the store once it is done.
+        """
+        chunks = [chunk for chunk in chunks if chunk.strip()]
+        if chunks:
+            vectors = self.embedder.encode(chunks)
+            metadatas = [{"filename": filename, "chunk": first_chunk + i} for i in range(len(chunks))]
+            self.store.add(namespace, vectors, chunks, metadatas)
+        return len(chunks)
+
+    def delete_document(self, namespace, filename):
+        """
+        Forgets every chunk of a document. Returns how many were removed.
+        """
+        removed = self.store.delete_where(namespace, filename=filename)
+        if removed:
+            self.store.save(namespace)
+        return removed
+
+    def query(self, namespace, query, limit=5, mode=None, rerank=True):
+        """
+        Best matching chunks for a query, as {"text", "metadata", "score"} dicts.
+        Scores are cosine similarity, BM25 or fused, depending on `mode` (default self.mode),
+        or the cross-encoder's when reranked.
+        """
+        if self.reranker is None or not rerank:
+            return self._retrieve(namespace, query, limit, mode)
+        hits = self._retrieve(namespace, query, max(limit, self.rerank_candidates), mode)
+        return self.reranker.rerank(query, hits, limit)
+
+    def _retrieve(self, namespace, query, limit, mode):
+        mode = mode or self.mode
+        if mode not in ("hybrid", "vector", "keyword"):
+            raise ValueError(f"Unknown retrieval mode: {mode}")
+        if not self.store.count(namespace):
+            return []
+        if mode == "keyword":
+            return self.store.keyword_search(namespace, [query], k=limit)[0]
+        vector = self.embedder.encode([query], cache=False)  # Only chunk vectors are worth keeping
+        if mode == "vector":
+            return self.store.search(namespace, vector, k=limit)[0]
+
+        fetch = max(limit, self.candidates)
+        rankings = [
+            self.store.search(namespace, vector, k=fetch)[0],
+            self.store.keyword_search(namespace, [query], k=fetch)[0],
+        ]
+        return reciprocal_rank_fusion(rankings, limit)
@@ -0,0 +1,124 @@
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+
+class ReplicaBusyError(Exception):
+    """
+    Raised inside ReplicaPool.acquire() when the replica turned the request away (e.g. a
+    503 because its queue is full), so it counts as a failure and the caller can try another.
+    """
+
+
+class Replica:
+    """
+    One MicroRag inference server as seen by the bot.
+    """
+    def __init__(self, url):
+        self.url = url.rstrip("/")
+        self.outstanding = 0     # Requests currently in flight to this replica
+        self.failures = 0        # Consecutive failed requests or health checks
+        self.ejected_until = 0.0
+
+    def available(self, now):
+        return self.ejected_until <= now
+
+    def __repr__(self):
+        return f"Replica({self.url}, outstanding={self.outstanding}, failures={self.failures})"
+
+
+class ReplicaPool:
+    """
+    Routes inference requests across replicas by least outstanding requests.
+
+    A replica is ejected for `cooldown` seconds after `max_failures` consecutive
+    failures (connection errors, timeouts, ReplicaBusyError or failed health checks). Once the
+    cooldown has passed it is eligible again and is probed by the health loop;
+    the first success clears its failure count.
+    """
+    def __init__(self, urls, client, health_path="/ready", health_interval=5.0, max_failures=3, cooldown=30.0):
+        self.replicas = [Replica(url) for url in urls]
+        self.client = client
+        self.health_path = health_path
+        self.health_interval = health_interval
+        self.max_failures = max_failures
+        self.cooldown = cooldown
+
+    @property
+    def size(self):
+        return len(self.replicas)
+
+    def pick(self, exclude=()):
+        """
+        Least-loaded available replica, ties broken at random.
+        If every replica is ejected, falls back to the one whose cooldown ends first.
+        """
+        now = time.monotonic()
+        candidates = [r for r in self.replicas if r.available(now) and r not in exclude]
+        if not candidates:
+            candidates = [r for r in self.replicas if r not in exclude] or self.replicas
+            return min(candidates, key=lambda r: r.ejected_until)
+        fewest = min(r.outstanding for r in candidates)
+        return random.choice([r for r in candidates if r.outstanding == fewest])
+
+    @asynccontextmanager
+    async def acquire(self, exclude=()):
+        """
+        Yields a replica for one request and tracks its load and health.
+        Connection errors, timeouts and ReplicaBusyError raised inside the block count as failures.
+        """
+        replica = self.pick(exclude)
+        replica.outstanding += 1
+        try:
+            yield replica
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError, ReplicaBusyError):
+            self.record_failure(replica)
+            raise
+        else:
+            self.record_success(replica)
+        finally:
+            replica.outstanding -= 1
+
+    def record_success(self, replica):
+        replica.failures = 0
+        replica.ejected_until = 0.0
+
+    def record_failure(self, replica):
+        replica.failures += 1
+        if replica.failures >= self.max_failures:
+            replica.ejected_until = time.monotonic() + self.cooldown
+            print(f"Ejected {replica.url} for {self.cooldown:.0f}s after {replica.failures} failures")
+
+    async def check(self, replica):
+        """
+        One active health check against the replica's readiness endpoint.
+        """
+        try:
+            response = await self.client.get(
+                f"{replica.url}{self.health_path}",
+                retries=0,
+                timeout=aiohttp.ClientTimeout(total=2),
+            )
+            healthy = response.status == 200
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            healthy = False
+
+        if healthy:
+            if replica.failures:
+                print(f"{replica.url} is healthy again")
+            self.record_success(replica)
+        else:
+            self.record_failure(replica)
+        return healthy
+
+    async def run_health_checks(self):
+        """
+        Probes every replica that isn't cooling down, forever. Run as a background task.
+        """
+        while True:
+            now = time.monotonic()
+            await asyncio.gather(*(self.check(r) for r in self.replicas if r.available(now)))
+            await asyncio.sleep(self.health_interval)
@@ -0,0 +1,84 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+
+class Reranker:
+    """
+    Cross-encoder that re-scores retrieved chunks against the query, loaded on first use.
+
+    All (query, chunk) pairs of a call are scored in one batched pass on the CPU.
+    Scores are cached (LRU, `cache_size` entries) by model, query and a hash of the
+    chunk, so asking the same question again costs nothing.
+
+    When scoring the uncached pairs is expected to take longer than `budget_ms`
+    (judged from a moving average of recent seconds per pair), reranking is skipped
+    and the hits keep their retrieval order. Blocking; call through asyncio.to_thread.
+    """
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", budget_ms=300, cache_size=4096):
+        self.model_name = model_name
+        self.budget_ms = budget_ms
+        self.cache_size = cache_size
+        self.reranked = 0
+        self.skipped = 0
+        self._scores = OrderedDict()  # key -> score
+        self._pair_seconds = 0.005    # Moving average; starts at a typical small model on CPU
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        with self._lock:
+            if self._model is None:
+                from sentence_transformers import CrossEncoder
+                self._model = CrossEncoder(self.model_name, device="cpu")
+            return self._model
+
+    def make_key(self, query, text):
+        chunk_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return hashlib.sha256(f"{self.model_name}\0{query}\0{chunk_hash}".encode("utf-8")).hexdigest()
+
+    def rerank(self, query, hits, k):
+        """
+        The best k of `hits` (dicts with "text") by cross-encoder score. Reranked hits get
+        that as "score" and keep their retrieval score as "retrieval_score".
+        """
+        if len(hits) <= 1:
+            return hits[:k]
+
+        keys = [self.make_key(query, hit["text"]) for hit in hits]
+        with self._lock:
+            scores = {key: self._scores[key] for key in keys if key in self._scores}
+        missing = {key: hit["text"] for key, hit in zip(keys, hits) if key not in scores}
+
+        if missing and len(missing) * self._pair_seconds * 1000 > self.budget_ms:
+            self.skipped += 1
+            self._pair_seconds *= 0.9  # Let the estimate recover from a slow outlier, so reranking resumes
+            return hits[:k]
+
+        if missing:
+            model = self.model  # Loaded outside the timing below
+            started = time.perf_counter()
+            fresh = model.predict([(query, text) for text in missing.values()], batch_size=len(missing))
+            elapsed = time.perf_counter() - started
+            scores.update(zip(missing, (float(score) for score in fresh)))
+            with self._lock:
+                self._pair_seconds = 0.8 * self._pair_seconds + 0.2 * elapsed / len(missing)
+                for key in missing:
+                    self._scores[key] = scores[key]
+                    self._scores.move_to_end(key)
+                while len(self._scores) > self.cache_size:
+                    self._scores.popitem(last=False)
+
+        self.reranked += 1
+        ranked = sorted(zip(keys, hits), key=lambda item: scores[item[0]], reverse=True)[:k]
+        return [dict(hit, score=scores[key], retrieval_score=hit["score"]) for key, hit in ranked]
+
+    def stats(self):
+        return {
+            "reranked": self.reranked,
+            "skipped": self.skipped,
+            "cached_scores": len(self._scores),
+            "ms_per_pair": self._pair_seconds * 1000,
+        }
@@ -0,0 +1,212 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    In-process cache of generated responses.
+
+    Entries are keyed on the final prompt plus the generation parameters, evicted
+    least-recently-used past `max_entries`, and expire after `ttl` seconds. When
+    `disk_dir` is set, entries are also written there as JSON files so they
+    survive restarts and LRU eviction. Files are swept on the first write and
+    whenever they number more than `max_disk_entries`: expired ones go, then the
+    oldest, down to 90% of the limit so the next sweep is a while away.
+
+    `get_or_compute` is single-flight: concurrent callers with the same key share
+    one computation instead of each running the model, and it is cancelled once
+    none of them is waiting any more.
+    """
+    def __init__(self, max_entries=256, ttl=3600, disk_dir=None, max_disk_entries=10000):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir  # Created on the first write
+        self.max_disk_entries = max_disk_entries
+        self._disk_entries = None  # Files in disk_dir, counted by the first sweep
+
+        self._entries = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight = {}           # key -> [compute task shared by concurrent callers, number of callers]
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def make_key(prompt, **params):
+        """
+        Stable key for a prompt and its generation parameters.
+        """
+        raw = json.dumps({"prompt": prompt, "params": params}, sort_keys=True)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        Returns the cached value, or None if it is missing or expired.
+        """
+        entry = self._entries.get(key)
+        now = time.time()
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._entries[key]
+
+        value = self._read_disk(key, now)
+        if value is not None:
+            self.hits += 1
+            self.disk_hits += 1
+            self._remember(key, value)
+            return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        self._remember(key, value)
+        self._write_disk(key, value)
+
+    async def get_or_compute(self, key, compute, cacheable=lambda value: True, coalesce=True):
+        """
+        Returns (value, hit). On a miss, awaits `compute()` once per key even if
+        several callers ask at the same time, and caches its result unless
+        `cacheable(result)` says otherwise (e.g. an answer cut short).
+
+        The computation runs as its own task and is cancelled once every caller
+        waiting for it has been cancelled, so nobody pays for an unwanted answer.
+        With coalesce=False the caller computes on its own, neither joining nor
+        starting a shared computation (e.g. when its result depends on its deadline).
+        """
+        value = self.get(key)
+        if value is not None:
+            return value, True
+
+        if not coalesce:
+            value = await compute()
+            if cacheable(value):
+                self.put(key, value)
+            return value, False
+
+        flight = self._in_flight.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(self._compute(key, compute, cacheable))
+            flight = self._in_flight[key] = [task, 0]
+        else:
+            self.coalesced += 1
+        flight[1] += 1
+        try:
+            return await asyncio.shield(flight[0]), False
+        finally:
+            flight[1] -= 1
+            if flight[1] == 0 and not flight[0].done():
+                flight[0].cancel()  # The last caller gave up
+                if self._in_flight.get(key) is flight:
+                    del self._in_flight[key]  # Later callers start afresh rather than join a cancelled task
+
+    async def _compute(self, key, compute, cacheable):
+        try:
+            value = await compute()
+            if cacheable(value):
+                self.put(key, value)
+            return value
+        finally:
+            flight = self._in_flight.get(key)
+            if flight is not None and flight[0] is asyncio.current_task():
+                del self._in_flight[key]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "disk_entries": self._disk_entries,
+            "disk_evictions": self.disk_evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _remember(self, key, value):
+        self._entries[key] = (time.time() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entry["expires_at"] <= now:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        return entry["value"]
+
+    def _write_disk(self, key, value):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"expires_at": time.time() + self.ttl, "value": value}, f)
+            existed = os.path.exists(path)
+            os.replace(tmp_path, path)  # Atomic, so readers never see half a file
+        except OSError as e:
+            print(f"Error: could not write response cache entry: {e}")
+            return
+        if self._disk_entries is None:
+            self._sweep_disk()
+        elif not existed:
+            self._disk_entries += 1
+            if self._disk_entries > self.max_disk_entries:
+                self._sweep_disk()
+
+    def _sweep_disk(self):
+        """
+        Deletes expired entry files, then the oldest ones until at most 90% of
+        `max_disk_entries` are left. Entries expire `ttl` seconds after they were written.
+        """
+        try:
+            with os.scandir(self.disk_dir) as it:
+                files = [(entry.stat().st_mtime, entry.path) for entry in it if entry.name.endswith(".json")]
+        except OSError as e:
+            print(f"Error: could not sweep response cache directory: {e}")
+            return
+        files.sort()
+        expired_before = time.time() - self.ttl
+        keep = int(self.max_disk_entries * 0.9)
+        removed = 0
+        for n, (mtime, path) in enumerate(files):
+            if mtime > expired_before and len(files) - n <= keep:
+                break
+            try:
+                os.remove(path)
+                removed += 1
+            except OSError:
+                pass
+        self.disk_evictions += removed
+        self._disk_entries = len(files) - removed
@@ -0,0 +1,622 @@
+import asyncio
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+
+import torch
+from transformers import DynamicCache
+
+from inference_queue import QueueFullError, estimate_retry_after
+from json_constraint import JsonConstraint
+from metrics import BATCH_SIZE, DECODE_SECONDS, GENERATED_TOKENS, PREFILL_SECONDS, QUEUE_WAIT, TIME_TO_FIRST_TOKEN, TOKENS_PER_SECOND
+
+
+class _Sequence:
+    """
+    A single /generate request tracked by the scheduler while it decodes.
+    """
+    def __init__(self, prompt, max_new_tokens, future, loop, stream=None, constraint=None, stop=None, deadline=None):
+        self.prompt = prompt
+        self.max_new_tokens = max_new_tokens
+        self.stop = stop or []  # Strings that end the answer; they are not part of it
+        self.stop_hold = max((len(s) for s in self.stop), default=0)  # Characters a stop string spans
+        self.deadline = deadline  # RequestDeadline; decoding stops once it expires
+        self.finish_reason = None
+        self.constraint = constraint  # JsonConstraint limiting which tokens may be picked
+        self.constraint_text = ""     # Text generated so far, as seen by the constraint
+        self.future = future
+        self.loop = loop
+        self.stream = stream    # asyncio.Queue of decoded text pieces, for streaming callers
+        self.emitted = 0        # Characters of decoded text already pushed to the stream
+        self.cache = None       # Per-layer (key, value) tensors from prefill, until the sequence joins the decode batch
+        self.length = 0         # Number of positions held in the cache
+        self.next_token = None  # Token to feed on the next decode step
+        self.generated = []     # Generated token ids (excluding the prompt)
+        self.done = False
+        self.resolved = False
+        self.enqueued_at = time.monotonic()
+        self.started_at = None
+        self.depth = 0
+
+
+class _PieceStream:
+    """
+    Async iterator over the text pieces of a streamed sequence. aclose() frees its slot,
+    even when iteration never started (a generator's finally would not run then).
+    """
+    def __init__(self, scheduler, seq, stats):
+        self.scheduler = scheduler
+        self.seq = seq
+        self.stats = stats
+        self.closed = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        piece = await self.seq.stream.get()
+        if piece is not None:
+            return piece
+        try:
+            await self.seq.future  # Re-raises a decode error, if there was one
+            self.stats.update(self.scheduler.stats(self.seq))
+        finally:
+            await self.aclose()
+        raise StopAsyncIteration
+
+    async def aclose(self):
+        if self.closed:
+            return
+        self.closed = True
+        if not self.seq.future.done():
+            # Consumer stopped early; the worker drops the sequence on its next step
+            self.seq.future.cancel()
+        self.scheduler._release(self.seq)
+
+
+class ContinuousBatchScheduler:
+    """
+    Collects concurrent generation requests and decodes them together.
+
+    Requests arriving within `batch_window` seconds (up to `max_batch_size`)
+    are prefilled as one batch. After that, new requests join the running
+    batch between decode steps, and finished ones leave it, so the model
+    always works on as many sequences as are waiting.
+
+    At most `max_queue` requests may be waiting or decoding at once;
+    `submit` raises QueueFullError beyond that.
+
+    Prompts that start with a prefix passed to `register_prefix` skip
+    re-encoding it and resume from its cached keys/values.
+
+    Requests with a `json_schema` only decode tokens that keep the output valid
+    JSON for that schema, and stop as soon as the JSON value is complete.
+
+    Sequences also end on one of their `stop` strings, and are dropped before the next
+    prefill or decode step once their `deadline` expires or their caller goes away,
+    so no compute goes to answers nobody is waiting for.
+
+    Queue wait, prefill and decode timings, time to first token, batch sizes and
+    token counts are recorded in `metrics`, labelled with `name`.
+    """
+    def __init__(self, model, tokenizer, max_batch_size=8, batch_window=0.01, max_queue=32, max_prefixes=8, name="model"):
+        self.name = name
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self.max_queue = max_queue
+        self.max_prefixes = max_prefixes
+
+        eos = model.generation_config.eos_token_id
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        self.pad_token_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else next(iter(self.eos_token_ids))
+
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._avg_service = 1.0  # Moving average of seconds per request, for Retry-After
+
+        self._constraints = {}   # schema JSON -> compiled JsonConstraint
+        self._token_texts = {}   # token id -> decoded text, shared by all constraints
+
+        self._prefixes = OrderedDict()  # prefix token ids -> per-layer (key, value), None until first use
+        self.prefix_hits = 0
+        self.prefix_tokens_saved = 0
+
+        # Worker thread only: the sequences decoding together, by row, and their batched
+        # per-layer (key, value), left-padded to a common width and kept across decode steps
+        self._batch = []
+        self._batch_cache = None
+
+        self._closed = False
+        self._pending = queue.Queue()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+        self._worker.start()
+
+    def close(self):
+        """
+        Stops the worker thread once in-flight sequences finish, e.g. before unloading the model.
+        """
+        self._closed = True
+        self._pending.put(None)  # Wakes an idle worker
+
+    async def submit(self, prompt, max_new_tokens=300, json_schema=None, stop=None, deadline=None):
+        """
+        Queues a prompt and waits for its completion.
+        Returns (text, stats): the prompt followed by the generated text, like the
+        text-generation pipeline, and the queue depth/wait and finish reason of this
+        request ("eos", "length", "stop", or "deadline" with whatever was generated in time).
+        Cancelling the awaiting task frees the sequence's slot at the next step.
+        """
+        seq = self._enqueue(prompt, max_new_tokens, json_schema=json_schema, stop=stop, deadline=deadline)
+        try:
+            text = await seq.future
+        finally:
+            self._release(seq)
+        return text, self.stats(seq)
+
+    def stream(self, prompt, max_new_tokens=300, json_schema=None, stop=None, deadline=None):
+        """
+        Queues a prompt for streaming. Admission happens immediately (so QueueFullError
+        is raised here); returns (pieces, stats) where `pieces` is an async iterator
+        of generated text fragments in decode order. Closing it (aclose) early frees the slot.
+        `stats` gets the final queue wait and finish reason once the pieces run out.
+        """
+        seq = self._enqueue(prompt, max_new_tokens, stream=True, json_schema=json_schema, stop=stop, deadline=deadline)
+        stats = {"queue_depth": seq.depth, "queue_wait": 0.0, "finish_reason": None}
+        return _PieceStream(self, seq, stats), stats
+
+    def stats(self, seq):
+        wait = (seq.started_at or time.monotonic()) - seq.enqueued_at
+        return {"queue_depth": seq.depth, "queue_wait": wait, "finish_reason": seq.finish_reason}
+
+
+    def _enqueue(self, prompt, max_new_tokens, stream=False, json_schema=None, stop=None, deadline=None):
+        if self._closed:
+            raise RuntimeError("This model has been unloaded.")
+        constraint = self._constraint_for(json_schema) if json_schema else None
+        with self._lock:
+            if self._outstanding >= self.max_queue:
+                raise QueueFullError(estimate_retry_after(self._avg_service, self._outstanding, self.max_batch_size))
+            self._outstanding += 1
+            depth = self._outstanding
+
+        loop = asyncio.get_running_loop()
+        seq = _Sequence(
+            prompt,
+            max_new_tokens,
+            loop.create_future(),
+            loop,
+            stream=asyncio.Queue() if stream else None,
+            constraint=constraint,
+            stop=stop,
+            deadline=deadline,
+        )
+        seq.depth = depth
+        self._pending.put(seq)
+        return seq
+
+    def _constraint_for(self, json_schema):
+        key = json.dumps(json_schema, sort_keys=True)
+        constraint = self._constraints.get(key)
+        if constraint is None:
+            constraint = JsonConstraint(json_schema, self._token_text)
+            self._constraints[key] = constraint
+        return constraint
+
+    def _token_text(self, token_id):
+        text = self._token_texts.get(token_id)
+        if text is None:
+            text = self.tokenizer.decode([token_id])
+            self._token_texts[token_id] = text
+        return text
+
+    def _release(self, seq):
+        with self._lock:
+            self._outstanding -= 1
+            if seq.started_at is not None:
+                self._avg_service = 0.8 * self._avg_service + 0.2 * (time.monotonic() - seq.started_at)
+
+    # ---- worker thread ----
+
+    def _run(self):
+        active = []
+        while True:
+            if self._closed and not active:
+                # Anything still queued will never run
+                for seq in self._take_pending(self.max_queue, block=False):
+                    self._resolve(seq, error=RuntimeError("This model has been unloaded."))
+                return
+
+            if active:
+                # Top up the running batch without waiting
+                admitted = self._take_pending(self.max_batch_size - len(active), block=False)
+            else:
+                # Idle: wait for the first request, then hold the window open for more
+                admitted = self._take_pending(self.max_batch_size, block=True)
+
+            try:
+                if admitted:
+                    with torch.no_grad():
+                        self._prefill(admitted)
+                    active.extend(admitted)
+                active = self._retire(active)
+                if active:
+                    with torch.no_grad():
+                        self._decode_step(active)
+                    active = self._retire(active)
+            except Exception as e:
+                print(f"Error: {e}")
+                for seq in active + admitted:
+                    if not seq.resolved:
+                        self._resolve(seq, error=e)
+                active = []
+            if not active:
+                self._batch, self._batch_cache = [], None  # Frees the keys/values while idle
+
+    def _take_pending(self, limit, block):
+        taken = []
+        if limit <= 0:
+            return taken
+        if block:
+            taken.append(self._pending.get())
+            deadline = time.monotonic() + self.batch_window
+            while len(taken) < limit and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    taken.append(self._pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+        else:
+            while len(taken) < limit:
+                try:
+                    taken.append(self._pending.get_nowait())
+                except queue.Empty:
+                    break
+        return [seq for seq in taken if seq is not None]  # None is the close() wake-up
+
+    def _prefill(self, seqs):
+        """
+        Encodes the prompts of newly admitted sequences.
+        Sequences starting with the same registered prefix are prefilled together
+        on top of that prefix's cached keys/values, so only their suffixes are encoded.
+        """
+        started = time.monotonic()
+        groups = {}
+        seqs = [seq for seq in seqs if not self._abandoned(seq)]  # _retire resolves the rest
+        for seq in seqs:
+            seq.started_at = started
+            QUEUE_WAIT.observe(started - seq.enqueued_at, model=self.name, endpoint="/generate")
+            ids = self.tokenizer(seq.prompt)["input_ids"]
+            groups.setdefault(self._match_prefix(ids), []).append((seq, ids))
+
+        if not seqs:
+            return
+        for match, members in groups.items():
+            self._prefill_group(match, members)
+
+        # Prefill picks each sequence's first token
+        finished = time.monotonic()
+        PREFILL_SECONDS.observe(finished - started, model=self.name)
+        BATCH_SIZE.observe(len(seqs), model=self.name, stage="prefill")
+        GENERATED_TOKENS.inc(len(seqs), model=self.name)
+        for seq in seqs:
+            TIME_TO_FIRST_TOKEN.observe(finished - seq.enqueued_at, model=self.name)
+
+    def _prefill_group(self, match, members):
+        """
+        One left-padded forward pass over the prompt suffixes that follow the prefix
+        `match` from _match_prefix (None for no prefix): its first tokens, whose cached
+        keys/values are reused. Padding sits between the prefix and each suffix and is masked out.
+        """
+        prefix_ids, plen = match if match else (None, 0)
+        suffixes = [ids[plen:] for _, ids in members]
+        width = max(len(ids) for ids in suffixes)
+        input_ids = torch.tensor([[self.pad_token_id] * (width - len(ids)) + ids for ids in suffixes])
+        attention_mask = torch.tensor([[1] * plen + [0] * (width - len(ids)) + [1] * len(ids) for ids in suffixes])
+        position_ids = torch.tensor([[0] * (width - len(ids)) + list(range(plen, plen + len(ids))) for ids in suffixes])
+
+        cache = DynamicCache()
+        if plen:
+            batch = len(members)
+            prefix_cache = self._prefix_cache(prefix_ids)
+            cache = DynamicCache.from_legacy_cache(tuple(
+                (k[:, :, :plen].expand(batch, -1, -1, -1), v[:, :, :plen].expand(batch, -1, -1, -1)) for k, v in prefix_cache
+            ))
+
+        out = self.model(
+            input_ids=input_ids.to(self.model.device),
+            attention_mask=attention_mask.to(self.model.device),
+            position_ids=position_ids.to(self.model.device),
+            past_key_values=cache,
+            use_cache=True,
+        )
+        layers = out.past_key_values.to_legacy_cache()
+        next_tokens = self._select_tokens([seq for seq, _ in members], out.logits[:, -1, :])
+
+        for row, ((seq, ids), suffix) in enumerate(zip(members, suffixes)):
+            # Drop the padding so each sequence owns an exact-length cache
+            n = len(suffix)
+            if plen:
+                seq.cache = [
+                    (torch.cat([k[row:row + 1, :, :plen], k[row:row + 1, :, -n:]], dim=2),
+                     torch.cat([v[row:row + 1, :, :plen], v[row:row + 1, :, -n:]], dim=2))
+                    for k, v in layers
+                ]
+            else:
+                seq.cache = [(k[row:row + 1, :, -n:], v[row:row + 1, :, -n:]) for k, v in layers]
+            seq.length = len(ids)
+            self._append(seq, next_tokens[row])
+
+    # ---- prefix cache ----
+
+    def register_prefix(self, prefix):
+        """
+        Registers a static prompt prefix. Its keys/values are computed once, on the
+        worker thread the first time a prompt uses it, and reused by every later prompt
+        whose tokens start with (most of) the same ids. The oldest prefix is dropped past `max_prefixes`.
+        """
+        ids = tuple(self.tokenizer(prefix)["input_ids"])
+        with self._lock:
+            if ids in self._prefixes:
+                self._prefixes.move_to_end(ids)
+                return len(ids)
+            self._prefixes[ids] = None
+            while len(self._prefixes) > self.max_prefixes:
+                self._prefixes.popitem(last=False)
+        return len(ids)
+
+    def prefix_stats(self):
+        with self._lock:
+            return {
+                "prefixes": len(self._prefixes),
+                "max_prefixes": self.max_prefixes,
+                "prefix_hits": self.prefix_hits,
+                "prefix_tokens_saved": self.prefix_tokens_saved,
+            }
+
+    def _match_prefix(self, ids):
+        """
+        The registered prefix sharing the longest run of leading tokens with `ids`, as
+        (prefix ids, shared length), or None. A prompt need not contain the whole prefix
+        token for token: where the prefix's last characters merge with the text after them
+        into other tokens (e.g. Llama-3 encodes ":\n" as one token), the shared part is
+        still reused, as long as it covers at least half the prefix. At least one prompt
+        token is always left to encode.
+        """
+        best, best_len = None, 0
+        with self._lock:
+            for prefix_ids in self._prefixes:
+                n = 0
+                limit = min(len(prefix_ids), len(ids) - 1)
+                while n < limit and ids[n] == prefix_ids[n]:
+                    n += 1
+                if n > best_len and 2 * n >= len(prefix_ids):
+                    best, best_len = prefix_ids, n
+            if best is None:
+                return None
+            self._prefixes.move_to_end(best)
+            self.prefix_hits += 1
+            self.prefix_tokens_saved += best_len
+        return best, best_len
+
+    def _prefix_cache(self, prefix_ids):
+        with self._lock:
+            cache = self._prefixes.get(prefix_ids)
+        if cache is None:
+            out = self.model(
+                input_ids=torch.tensor([list(prefix_ids)]).to(self.model.device),
+                past_key_values=DynamicCache(),
+                use_cache=True,
+            )
+            cache = out.past_key_values.to_legacy_cache()
+            with self._lock:
+                if prefix_ids in self._prefixes:  # Not evicted while we were encoding it
+                    self._prefixes[prefix_ids] = cache
+        return cache
+
+    def _decode_step(self, seqs):
+        """
+        Runs one decode step for every active sequence on the batched cache, which the
+        model extends by one position per row. The cache is only rebuilt when sequences
+        join or leave the batch (see _rebuild_batch), not copied per sequence every step.
+        """
+        started = time.monotonic()
+        if seqs != self._batch:
+            self._rebuild_batch(seqs)
+        width = self._batch_cache[0][0].shape[2]
+
+        attention_mask = torch.tensor([[0] * (width - seq.length) + [1] * (seq.length + 1) for seq in seqs])
+        position_ids = torch.tensor([[seq.length] for seq in seqs])
+        input_ids = torch.tensor([[seq.next_token] for seq in seqs])
+
+        out = self.model(
+            input_ids=input_ids.to(self.model.device),
+            attention_mask=attention_mask.to(self.model.device),
+            position_ids=position_ids.to(self.model.device),
+            past_key_values=DynamicCache.from_legacy_cache(self._batch_cache),
+            use_cache=True,
+        )
+        self._batch_cache = out.past_key_values.to_legacy_cache()
+        next_tokens = self._select_tokens(seqs, out.logits[:, -1, :])
+
+        for row, seq in enumerate(seqs):
+            seq.length += 1
+            self._append(seq, next_tokens[row])
+
+        elapsed = time.monotonic() - started
+        DECODE_SECONDS.observe(elapsed, model=self.name)
+        BATCH_SIZE.observe(len(seqs), model=self.name, stage="decode")
+        GENERATED_TOKENS.inc(len(seqs), model=self.name)
+        if elapsed > 0:
+            TOKENS_PER_SECOND.set(len(seqs) / elapsed, model=self.name)
+
+    def _rebuild_batch(self, seqs):
+        """
+        Makes the batched cache hold exactly `seqs`, in order. When sequences only left,
+        their rows are dropped, along with the columns that were padding for every row
+        that remains. When new ones joined, each row is cut to its own length, left-padded
+        to the longest and concatenated once; the joiners' prefill caches are then released.
+        """
+        rows = {seq: row for row, seq in enumerate(self._batch)}
+        width = max(seq.length for seq in seqs)
+        if all(seq in rows for seq in seqs):
+            index = torch.tensor([rows[seq] for seq in seqs], device=self._batch_cache[0][0].device)
+            self._batch_cache = tuple(
+                (k.index_select(0, index)[:, :, -width:], v.index_select(0, index)[:, :, -width:]) for k, v in self._batch_cache
+            )
+        else:
+            num_layers = len(next(seq.cache for seq in seqs if seq not in rows))
+            legacy = []
+            for layer in range(num_layers):
+                keys, values = [], []
+                for seq in seqs:
+                    if seq in rows:
+                        k, v = self._batch_cache[layer]
+                        row = rows[seq]
+                        k, v = k[row:row + 1, :, -seq.length:], v[row:row + 1, :, -seq.length:]
+                    else:
+                        k, v = seq.cache[layer]
+                    pad = width - seq.length
+                    if pad:
+                        k = torch.nn.functional.pad(k, (0, 0, pad, 0))
+                        v = torch.nn.functional.pad(v, (0, 0, pad, 0))
+                    keys.append(k)
+                    values.append(v)
+                legacy.append((torch.cat(keys), torch.cat(values)))
+            self._batch_cache = tuple(legacy)
+            for seq in seqs:
+                seq.cache = None
+        self._batch = list(seqs)
+
+    def _select_tokens(self, seqs, logits):
+        """
+        Next token id per sequence. Constrained sequences keep the sampled token when it is
+        valid, otherwise take the highest-scoring token that is.
+        """
+        tokens = self._next_tokens(logits).tolist()
+        for row, seq in enumerate(seqs):
+            if seq.constraint is None or seq.constraint.allows(seq.constraint_text, tokens[row]):
+                continue
+            ranked = logits[row].argsort(descending=True).tolist()
+            choice = seq.constraint.pick(seq.constraint_text, ranked)
+            # Nothing fits (should not happen for a satisfiable schema): end the sequence
+            tokens[row] = choice if choice is not None else next(iter(self.eos_token_ids))
+        return tokens
+
+    def _next_tokens(self, logits):
+        """
+        Picks the next token per row, following the model's generation config (sampling or greedy).
+        """
+        config = self.model.generation_config
+        if not getattr(config, "do_sample", False):
+            return logits.argmax(dim=-1)
+
+        logits = logits.float() / (config.temperature or 1.0)
+        probs = torch.softmax(logits, dim=-1)
+        top_p = config.top_p if config.top_p is not None else 1.0
+        if top_p < 1.0:
+            sorted_probs, sorted_idx = probs.sort(dim=-1, descending=True)
+            drop = sorted_probs.cumsum(dim=-1) - sorted_probs > top_p
+            sorted_probs = sorted_probs.masked_fill(drop, 0.0)
+            probs = torch.zeros_like(probs).scatter(-1, sorted_idx, sorted_probs)
+        return torch.multinomial(probs, num_samples=1).squeeze(-1)
+
+    def _append(self, seq, token):
+        if token in self.eos_token_ids:
+            seq.done = True
+            seq.finish_reason = "eos"
+            return
+        seq.generated.append(token)
+        seq.next_token = token
+        if len(seq.generated) >= seq.max_new_tokens:
+            seq.done = True
+            seq.finish_reason = "length"
+        if seq.constraint is not None:
+            seq.constraint_text += self._token_text(token)
+            if seq.constraint.is_complete(seq.constraint_text):
+                seq.done = True  # The JSON value just closed
+                seq.finish_reason = "stop"
+        if seq.stop:
+            # Each token adds at least one character, so a stop string lies within this tail
+            tail = self.tokenizer.decode(seq.generated[-(seq.stop_hold + 1):], skip_special_tokens=True)
+            if any(stop in tail for stop in seq.stop):
+                seq.done = True
+                seq.finish_reason = "stop"
+        if seq.stream is not None:
+            self._push_text(seq)
+
+    def _abandoned(self, seq):
+        """
+        Marks a sequence done if its caller went away or its deadline passed.
+        """
+        if seq.future.cancelled():
+            seq.done = True
+            seq.finish_reason = "cancelled"
+        elif seq.deadline is not None and seq.deadline.expired:
+            seq.done = True
+            seq.finish_reason = seq.deadline.reason
+        return seq.done
+
+    def _text(self, seq, final=False):
+        """
+        Decoded answer so far, cut before any stop string. While decoding continues,
+        text that may be the start of a stop string is held back.
+        """
+        text = self.tokenizer.decode(seq.generated, skip_special_tokens=True)
+        if seq.stop:
+            found = [i for i in (text.find(stop) for stop in seq.stop) if i >= 0]
+            if found:
+                return text[:min(found)]
+            if not final:
+                return text[:max(seq.emitted, len(text) - seq.stop_hold + 1)]
+        return text
+
+    def _push_text(self, seq, final=False):
+        """
+        Sends any newly decoded text to a streaming caller.
+        """
+        text = self._text(seq, final)
+        if text.endswith("\ufffd") and not final:
+            # Partial multi-byte character; wait for the next token to complete it
+            return
+        piece = text[seq.emitted:]
+        if piece:
+            seq.emitted = len(text)
+            seq.loop.call_soon_threadsafe(seq.stream.put_nowait, piece)
+
+    def _retire(self, seqs):
+        still_running = []
+        for seq in seqs:
+            if seq.done or self._abandoned(seq):
+                # Finished, past its deadline (answered with what it has) or abandoned by its caller
+                if seq.stream is not None:
+                    self._push_text(seq, final=True)  # Flush anything held back mid-character
+                self._resolve(seq, result=seq.prompt + self._text(seq, final=True))
+            else:
+                still_running.append(seq)
+        return still_running
+
+    def _resolve(self, seq, result=None, error=None):
+        seq.done = True
+        seq.resolved = True
+
+        def _set():
+            if seq.future.done():
+                return
+            if error is not None:
+                seq.future.set_exception(error)
+            else:
+                seq.future.set_result(result)
+            if seq.stream is not None:
+                seq.stream.put_nowait(None)  # End of stream
+
+        seq.loop.call_soon_threadsafe(_set)
@@ -1,50 +1,138 @@
-import requests
-from bs4 import BeautifulSoup
-from markdownify import markdownify
+import asyncio
+import codecs
 import tempfile
+import urllib.parse
+from collections import defaultdict
 
-def scrape_webpage(url):
-    headers = {"User-Agent": "Mozilla/5.0"}
-    
-    try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        
-        soup = BeautifulSoup(response.text, "html.parser")
-        
-        # Extract title
-        title = soup.title.string.strip() if soup.title else "No title"
-        
-        # Extract metadata description
-        meta_desc = soup.find("meta", attrs={"name": "description"})
-        description = meta_desc["content"].strip() if meta_desc else "No description"
-
-        # Extract main text content
-        paragraphs = soup.find_all("p")
-        content = "\n".join([p.get_text().strip() for p in paragraphs if p.get_text().strip()])
-
-        # Extract headings (h1, h2, h3, etc.)
-        headings = "\n".join([h.get_text().strip() for h in soup.find_all(["h1", "h2", "h3"]) if h.get_text().strip()])
-
-        # Extract tables
-        table_text = extract_tables(soup)
-
-        # Convert HTML structure into Markdown
-        markdown_content = markdownify(response.text, heading_style="ATX")
-
-        # Format the Markdown
-        markdown_result = f"# {title}\n\n"
-        markdown_result += f"## Description\n{description}\n\n"
-        # markdown_result += f"## Headings\n{headings}\n\n"
-        markdown_result += f"## Content\n{content[:200]}...\n\n"  # Limit content size
-        # markdown_result += f"## Tables\n{table_text}\n\n"
-        markdown_result += f"---\n\n## Full Page Markdown\n\n{markdown_content}"  # Append full conversion
+import aiohttp
+from bs4 import BeautifulSoup
+from markdownify import MarkdownConverter
+
+from http_cache import web_cache
+
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = "lxml"  # Several times faster than the pure-Python parser
+except ImportError:
+    HTML_PARSER = "html.parser"
 
+HEADERS = {"User-Agent": "Mozilla/5.0"}
+PAGE_TIMEOUT = aiohttp.ClientTimeout(total=20, connect=5)
+# Pages fetched at once by scrape_many, and at most this many from the same host
+SCRAPE_CONCURRENCY = 8
+SCRAPE_PER_HOST = 2
+
+
+class ScrapeError(Exception):
+    """
+    Raised when a page can't be fetched or isn't HTML/text.
+    """
+
+
+async def fetch_html(url, timeout=PAGE_TIMEOUT):
+    """
+    Fetches a page through the shared HTTP cache, which cuts off oversized bodies.
+    Returns the decoded text.
+    """
+    try:
+        response = await web_cache.get(url, headers=HEADERS, source="scrape", timeout=timeout)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise ScrapeError(f"Could not fetch {url}: {e}") from e
+    if response.status >= 400:
+        raise ScrapeError(f"HTTP {response.status} for {url}")
+    content_type = response.headers.get("Content-Type", "text/html")
+    if "html" not in content_type and not content_type.startswith("text/"):
+        raise ScrapeError(f"Not a web page ({content_type}): {url}")
+    return response.body.decode(_charset(content_type), errors="replace")
+
+
+def _charset(content_type):
+    for param in content_type.split(";")[1:]:
+        name, _, value = param.strip().partition("=")
+        if name.lower() == "charset":
+            try:
+                return codecs.lookup(value.strip('"')).name
+            except LookupError:
+                break
+    return "utf-8"
+
+
+def parse_page(html):
+    """
+    Parses a page once and pulls everything out of that one tree:
+    title, description, paragraphs, headings, tables and a full Markdown conversion.
+    """
+    soup = BeautifulSoup(html, HTML_PARSER)
+
+    # Extract title
+    title = soup.title.string.strip() if soup.title and soup.title.string else "No title"
+
+    # Extract metadata description
+    meta_desc = soup.find("meta", attrs={"name": "description"})
+    description = meta_desc.get("content", "").strip() if meta_desc else ""
+
+    # Extract main text content
+    paragraphs = [text for text in (p.get_text().strip() for p in soup.find_all("p")) if text]
+
+    # Extract headings (h1, h2, h3, etc.)
+    headings = [text for text in (h.get_text().strip() for h in soup.find_all(["h1", "h2", "h3"])) if text]
+
+    return {
+        "title": title,
+        "description": description or "No description",
+        "content": "\n".join(paragraphs),
+        "headings": "\n".join(headings),
+        "tables": extract_tables(soup),
+        # Convert HTML structure into Markdown, from the same tree
+        "markdown": MarkdownConverter(heading_style="ATX").convert_soup(soup),
+    }
+
+
+def format_markdown(page):
+    markdown_result = f"# {page['title']}\n\n"
+    markdown_result += f"## Description\n{page['description']}\n\n"
+    markdown_result += f"## Content\n{page['content'][:200]}...\n\n"  # Limit content size
+    markdown_result += f"---\n\n## Full Page Markdown\n\n{page['markdown']}"  # Append full conversion
+    return markdown_result
+
+
+async def scrape_page(url):
+    """
+    Fetches and parses one page. Returns parse_page's fields plus "url".
+    """
+    html = await fetch_html(url)
+    page = await asyncio.to_thread(parse_page, html)  # Parsing a big page would stall the bot
+    page["url"] = url
+    return page
+
+
+async def scrape_webpage(url):
+    try:
+        page = await scrape_page(url)
+        markdown_result = format_markdown(page)
         return markdown_result, markdown_result[:200]  # Return full content + preview
-    
     except Exception as e:
         return f"Error: {e}", None
-    
+
+
+async def scrape_many(urls, concurrency=SCRAPE_CONCURRENCY, per_host=SCRAPE_PER_HOST):
+    """
+    Scrapes many pages concurrently, politely per host. Returns results in the order
+    of `urls`: a page dict, or {"url", "error"} for pages that failed.
+    """
+    overall = asyncio.Semaphore(concurrency)
+    hosts = defaultdict(lambda: asyncio.Semaphore(per_host))
+
+    async def one(url):
+        async with overall, hosts[urllib.parse.urlparse(url).netloc]:
+            try:
+                return await scrape_page(url)
+            except ScrapeError as e:
+                return {"url": url, "error": str(e)}
+
+    return await asyncio.gather(*(one(url) for url in urls))
+
+
 def save_markdown_to_file(content):
     with tempfile.NamedTemporaryFile(delete=False, suffix=".md") as temp_file:
         temp_file.write(content.encode("utf-8"))
@@ -72,31 +160,42 @@ def extract_tables(soup):
 
     return "\n\n".join(markdown_tables) if markdown_tables else "No tables found."
 
-import aiohttp
-from bs4 import BeautifulSoup
-import urllib.parse
-
-async def search_duckduckgo_async(query):
-    url = f"https://html.duckduckgo.com/html/?q={query}"
-    headers = {"User-Agent": "Mozilla/5.0"}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url, headers=headers) as response:
-            html = await response.text()
+async def search_duckduckgo_links(query, limit=5):
+    """
+    Top DuckDuckGo results as [(title, url)].
+    """
+    url = f"https://html.duckduckgo.com/html/?q={urllib.parse.quote_plus(query)}"
 
-    soup = BeautifulSoup(html, "html.parser")
-    results = []
+    # Repeated searches within HTTP_CACHE_TTLS' "search" window don't hit DuckDuckGo again
+    response = await web_cache.get(url, headers=HEADERS, source="search")
+    soup = BeautifulSoup(response.text, HTML_PARSER)
+    links = []
 
-    for result in soup.find_all("a", class_="result__a", limit=5):  # Top 5 results
+    for result in soup.find_all("a", class_="result__a", limit=limit):
         title = result.get_text().strip()
         redirect_url = result["href"]
-        
+
         # Extract the real URL
         parsed_url = urllib.parse.parse_qs(urllib.parse.urlparse(redirect_url).query).get("uddg", [""])[0]
+        if parsed_url:
+            links.append((title, parsed_url))
+
+    return links
 
-        # Format results
-        results.append(f"**[{title}]({parsed_url})**")
 
+async def search_duckduckgo_async(query):
+    links = await search_duckduckgo_links(query)
+    # Format results
+    results = [f"**[{title}]({url})**" for title, url in links]
     return "\n".join(results) if results else "No results found."
 
 
+async def scrape_search_results(query, limit=5):
+    """
+    Searches DuckDuckGo and scrapes the top results in parallel, e.g. as RAG context.
+    Returns only the pages that could be scraped, in search-rank order.
+    """
+    links = await search_duckduckgo_links(query, limit=limit)
+    pages = await scrape_many([url for _, url in links])
+    return [page for page in pages if "error" not in page]
@@ -0,0 +1,104 @@
+import asyncio
+
+from chunker import Chunker
+
+MAP_PROMPT = "Summarize the following part of a document in a few sentences:\n\n{text}\n\nSummary:"
+REDUCE_PROMPT = "Combine these partial summaries of one document into a single concise summary:\n\n{text}\n\nSummary:"
+
+
+class IncompleteSummaryError(RuntimeError):
+    """
+    Raised when some prompts got no answer (e.g. the server's timeout ran out first).
+    Everything that was answered is cached, so summarizing again resumes from there.
+    """
+
+
+class MapReduceSummarizer:
+    """
+    Summarizes documents of any length.
+
+    The document is cut into chunks of about `max_words` words, each chunk is
+    summarized (in batches of `batch_size` prompts, `concurrency` batches at a time,
+    through `generate_batch(prompts, max_new_tokens)`), and the partial summaries are
+    grouped and summarized again until one summary is left.
+
+    Every partial summary is stored in `cache` (a ResponseCache) under its prompt,
+    so a retry after a failure only generates what is still missing.
+    """
+    def __init__(self, generate_batch, cache=None, max_words=700, batch_size=8, concurrency=2, max_new_tokens=200):
+        self.generate_batch = generate_batch
+        self.cache = cache
+        self.max_words = max_words
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_new_tokens = max_new_tokens
+
+    def chunk(self, pages):
+        """
+        Splits an iterable of pages into map-stage chunks (blocking; run in a thread).
+        """
+        return list(Chunker(max_tokens=self.max_words, overlap=0).iter_chunks(pages))
+
+    async def summarize(self, chunks, on_progress=None):
+        """
+        Returns one summary of all chunks. `on_progress(done, total, level)` is awaited
+        as summaries complete; level 1 is the chunk summaries, higher levels the merges.
+        Raises IncompleteSummaryError if `generate_batch` left some prompts unanswered (None).
+        """
+        if not chunks:
+            return ""
+        texts, template, level = chunks, MAP_PROMPT, 1
+        while True:
+            summaries = await self._summarize_all([template.format(text=text) for text in texts], level, on_progress)
+            if len(summaries) == 1:
+                return summaries[0]
+            texts, template, level = self._group(summaries), REDUCE_PROMPT, level + 1
+
+    def _group(self, summaries):
+        """
+        Packs consecutive summaries into groups of at most max_words words (at least two per group).
+        """
+        groups, current, words = [], [], 0
+        for summary in summaries:
+            size = len(summary.split())
+            if len(current) >= 2 and words + size > self.max_words:
+                groups.append("\n\n".join(current))
+                current, words = [], 0
+            current.append(summary)
+            words += size
+        groups.append("\n\n".join(current))
+        return groups
+
+    async def _summarize_all(self, prompts, level, on_progress):
+        keys = [self._key(prompt) for prompt in prompts]
+        results = [self.cache.get(key) if self.cache is not None else None for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        done = len(prompts) - len(missing)
+        if on_progress:
+            await on_progress(done, len(prompts), level)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(batch):
+            nonlocal done
+            async with semaphore:
+                outputs = await self.generate_batch([prompts[i] for i in batch], self.max_new_tokens)
+            for i, output in zip(batch, outputs):
+                if output is None:
+                    continue  # Not generated in time; stays missing
+                results[i] = output.strip()
+                done += 1
+                if self.cache is not None:
+                    self.cache.put(keys[i], results[i])
+            if on_progress:
+                await on_progress(done, len(prompts), level)
+
+        batches = [missing[i:i + self.batch_size] for i in range(0, len(missing), self.batch_size)]
+        await asyncio.gather(*(run(batch) for batch in batches))
+        unanswered = sum(result is None for result in results)
+        if unanswered:
+            raise IncompleteSummaryError(f"{unanswered} of {len(prompts)} summaries were not generated in time")
+        return results
+
+    def _key(self, prompt):
+        return self.cache.make_key(prompt, max_new_tokens=self.max_new_tokens) if self.cache is not None else None
@@ -0,0 +1,16 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="session")
+def tiny_model():
+    """
+    The stub server's model and tokenizer: a tiny random Llama that runs on a CPU.
+    """
+    from benchmarks.stub_model import build_stub_model
+
+    return build_stub_model()
@@ -0,0 +1,23 @@
+from chunker import Chunker
+
+TEXT = (
+    "# Retrieval\n"
+    "Chunks are embedded once. Queries are embedded per request. Both are vectors.\n\n"
+    "A second paragraph follows.\n\n"
+    "```\nline one\nline two\n```\n"
+)
+
+
+def test_chunks_keep_the_original_separators():
+    assert Chunker(max_tokens=200).split(TEXT) == [
+        "# Retrieval\n\n"
+        "Chunks are embedded once. Queries are embedded per request. Both are vectors.\n\n"
+        "A second paragraph follows.\n\n"
+        "```\nline one\nline two\n```"
+    ]
+
+
+def test_sentences_of_a_split_paragraph_stay_space_separated():
+    chunks = Chunker(max_tokens=12, overlap=0).split(TEXT)
+    assert chunks[0] == "# Retrieval\n\nChunks are embedded once."
+    assert "Queries are embedded per request. Both are vectors." in chunks
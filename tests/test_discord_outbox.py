@@ -0,0 +1,74 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("discord")
+
+from discord_outbox import Outbox  # noqa: E402
+
+
+class Channel:
+    """
+    Stands in for a discord.Thread: records what each send() carried, and when.
+    """
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.sent = []  # (monotonic time, kwargs) per call
+
+    async def send(self, **kwargs):
+        self.sent.append((time.monotonic(), kwargs))
+        return len(self.sent)
+
+    @property
+    def contents(self):
+        return [kwargs.get("content") for _, kwargs in self.sent]
+
+
+def test_small_messages_are_packed_in_order():
+    async def main():
+        outbox = Outbox()
+        channel = Channel(1)
+        results = await asyncio.gather(*(outbox.send(channel, f"match {i}") for i in range(3)), outbox.send(channel, "done"))
+        return channel, results
+
+    channel, results = asyncio.run(main())
+    assert channel.contents == ["match 0\n\nmatch 1\n\nmatch 2\n\ndone"]
+    assert results == [[1]] * 4  # Every caller gets the message its text went out in
+
+
+def test_separate_messages_are_not_packed():
+    async def main():
+        outbox = Outbox()
+        channel = Channel(1)
+        await asyncio.gather(
+            outbox.send(channel, "first"),
+            outbox.send(channel, "⏳ Thinking...", separate=True),
+            outbox.send(channel, "second"),
+            outbox.send(channel, "third"),
+        )
+        return channel
+
+    assert asyncio.run(main()).contents == ["first", "⏳ Thinking...", "second\n\nthird"]
+
+
+def test_sends_stay_within_each_channels_bucket():
+    rate, per = 2, 0.4
+
+    async def main():
+        outbox = Outbox(rate=rate, per=per)
+        busy, other = Channel(1), Channel(2)
+        started = time.monotonic()
+        await asyncio.gather(
+            *(outbox.send(busy, f"part {i}", separate=True) for i in range(6)),
+            outbox.send(other, "elsewhere"),
+        )
+        return started, busy, other
+
+    started, busy, other = asyncio.run(main())
+    assert busy.contents == [f"part {i}" for i in range(6)]
+    times = [at - started for at, _ in busy.sent]
+    for i, at in enumerate(times):
+        # A burst of `rate`, then one send per per/rate seconds
+        assert at >= max(0, i - rate + 1) * per / rate - 0.02
+    assert other.sent[0][0] - started < per / rate  # Not held up by the busy thread
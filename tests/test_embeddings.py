@@ -0,0 +1,39 @@
+import numpy as np
+
+from embeddings import Embedder
+
+
+class FakeModel:
+    def __init__(self):
+        self.encoded = []
+
+    def get_sentence_embedding_dimension(self):
+        return 2
+
+    def encode(self, texts, **kwargs):
+        self.encoded.extend(texts)
+        return np.array([[len(text), 1.0] for text in texts], dtype="float32")
+
+
+def embedder(tmp_path):
+    embedder = Embedder(cache_path=str(tmp_path / "embeddings.sqlite3"))
+    embedder._model = FakeModel()
+    return embedder
+
+
+def test_chunks_are_embedded_once(tmp_path):
+    e = embedder(tmp_path)
+    e.encode(["a chunk", "another chunk"])
+    e.encode(["a chunk"])
+    assert e._model.encoded == ["a chunk", "another chunk"]
+    assert len(e.cache) == 2
+
+
+def test_queries_are_not_cached(tmp_path):
+    e = embedder(tmp_path)
+    e.encode(["a chunk"])
+    vectors = e.encode(["what is a chunk?", "a chunk"], cache=False)
+    assert vectors.shape == (2, 2)
+    assert sorted(e._model.encoded) == ["a chunk", "a chunk", "what is a chunk?"]
+    assert len(e.cache) == 1
+    assert e.stats()["hits"] == 0
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+
+def test_generate_holds_the_model_once_for_the_whole_request():
+    from benchmarks.stub_server import app, microrag
+
+    acquired = []
+    acquire = microrag.registry.acquire
+
+    async def counting_acquire(name=None):
+        entry = await acquire(name)
+        acquired.append(entry)
+        return entry
+
+    async def main():
+        body = json.dumps({"query": "what is a vector?", "max_length": 4}).encode()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        sent = []
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            await asyncio.Event().wait()  # The client stays connected
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/generate", "raw_path": b"/generate",
+            "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+        }
+        microrag.registry.acquire = counting_acquire
+        try:
+            await app(scope, receive, send)
+        finally:
+            microrag.registry.acquire = acquire
+        return sent
+
+    sent = asyncio.run(main())
+    assert sent[0]["status"] == 200
+    assert "response" in json.loads(sent[1]["body"])
+    assert len(acquired) == 1
+    assert acquired[0].in_use == 0
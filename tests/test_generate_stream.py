@@ -0,0 +1,39 @@
+import asyncio
+import json
+
+
+def test_stream_is_released_when_the_client_leaves_before_the_body():
+    from benchmarks.stub_server import app, microrag
+
+    async def main():
+        body = json.dumps({"query": "what is a chunk?", "max_length": 500}).encode()
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+
+        async def receive():
+            if messages:
+                return messages.pop(0)
+            return {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                raise OSError("client went away")  # Before a single body chunk is sent
+
+        scope = {
+            "type": "http", "asgi": {"version": "3.0", "spec_version": "2.3"}, "http_version": "1.1",
+            "method": "POST", "scheme": "http", "path": "/generate_stream", "raw_path": b"/generate_stream",
+            "query_string": b"", "root_path": "", "headers": [(b"content-type", b"application/json")],
+            "client": ("127.0.0.1", 1), "server": ("127.0.0.1", 80),
+        }
+        try:
+            await app(scope, receive, send)
+        except Exception:
+            pass  # The send error, possibly wrapped in an ExceptionGroup
+        entry = microrag.registry.loaded()[0]
+        assert entry.in_use == 0
+        for _ in range(100):  # The worker drops the cancelled sequence at its next step
+            if entry.scheduler._outstanding == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert entry.scheduler._outstanding == 0
+
+    asyncio.run(main())
@@ -0,0 +1,108 @@
+import asyncio
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_cache import HttpCache
+from http_client import HttpClient
+
+BODY = b"<html>the model reads the context first</html>"
+
+
+class Site:
+    """
+    An aiohttp server for one page, answering conditional requests with 304s.
+    """
+    def __init__(self, headers, body=BODY):
+        self.headers = headers
+        self.body = body
+        self.requests = []  # Headers of each request received
+
+    async def page(self, request):
+        self.requests.append(dict(request.headers))
+        etag = self.headers.get("ETag")
+        last_modified = self.headers.get("Last-Modified")
+        if (etag and request.headers.get("If-None-Match") == etag) or (
+            last_modified and request.headers.get("If-Modified-Since") == last_modified
+        ):
+            return web.Response(status=304, headers=self.headers)
+        return web.Response(body=self.body, headers=self.headers, content_type="text/html")
+
+
+async def fetch_twice(tmp_path, site, source=None, **options):
+    """
+    GETs the site's page twice through a fresh cache; returns both responses.
+    """
+    app = web.Application()
+    app.router.add_get("/page", site.page)
+    client = HttpClient(retries=0)
+    async with TestServer(app) as server:
+        cache = HttpCache(client, str(tmp_path / "http_cache"), **options)
+        url = str(server.make_url("/page"))
+        try:
+            first = await cache.get(url, source=source)
+            second = await cache.get(url, source=source)
+            await asyncio.gather(*cache._refreshing.values())  # Let a background revalidation finish
+        finally:
+            await client.close()
+    return first, second
+
+
+def test_etag_revalidation_costs_a_304(tmp_path):
+    site = Site({"ETag": '"v1"', "Cache-Control": "max-age=0"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, stale_while_revalidate=0))
+    assert (first.cache_status, second.cache_status) == ("MISS", "REVALIDATED")
+    assert second.status == 200 and second.body == BODY
+    assert site.requests[1]["If-None-Match"] == '"v1"'
+
+
+def test_last_modified_revalidation_costs_a_304(tmp_path):
+    site = Site({"Last-Modified": "Wed, 21 Oct 2015 07:28:00 GMT", "Cache-Control": "max-age=0"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, stale_while_revalidate=0))
+    assert second.cache_status == "REVALIDATED" and second.body == BODY
+    assert site.requests[1]["If-Modified-Since"] == "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+def test_fresh_entry_is_a_hit(tmp_path):
+    site = Site({"ETag": '"v1"'})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, source="scrape", ttls={"scrape": 60}))
+    assert second.cache_status == "HIT" and second.body == BODY
+    assert len(site.requests) == 1
+
+
+def test_stale_entry_is_served_while_it_revalidates(tmp_path):
+    site = Site({"ETag": '"v1"', "Cache-Control": "max-age=0"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, stale_while_revalidate=60))
+    assert second.cache_status == "STALE" and second.body == BODY
+    assert len(site.requests) == 2 and site.requests[1]["If-None-Match"] == '"v1"'  # Revalidated in the background
+
+
+def test_max_age_caps_the_source_ttl(tmp_path):
+    site = Site({"ETag": '"v1"', "Cache-Control": "max-age=0"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, source="scrape", ttls={"scrape": 3600}, stale_while_revalidate=0))
+    assert second.cache_status == "REVALIDATED"
+
+
+def test_no_store_is_never_stored(tmp_path):
+    site = Site({"ETag": '"v1"', "Cache-Control": "no-store"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, source="scrape", ttls={"scrape": 3600}))
+    assert (first.cache_status, second.cache_status) == ("MISS", "MISS")
+    assert "If-None-Match" not in site.requests[1]
+
+
+def test_no_cache_is_revalidated_before_use(tmp_path):
+    site = Site({"ETag": '"v1"', "Cache-Control": "no-cache"})
+    first, second = asyncio.run(fetch_twice(tmp_path, site, source="scrape", ttls={"scrape": 3600}, stale_while_revalidate=600))
+    assert second.cache_status == "REVALIDATED" and second.body == BODY
+
+
+def test_truncated_body_is_not_stored(tmp_path):
+    site = Site({"ETag": '"v1"'}, body=b"x" * 100)
+    first, second = asyncio.run(fetch_twice(tmp_path, site, max_bytes=10))
+    assert (first.cache_status, second.cache_status) == ("MISS", "MISS")
+    assert first.body == b"x" * 10
+
+
+def test_directory_is_created_on_first_write(tmp_path):
+    HttpCache(HttpClient(), str(tmp_path / "http_cache"))
+    assert not (tmp_path / "http_cache").exists()
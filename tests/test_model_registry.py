@@ -0,0 +1,50 @@
+import asyncio
+
+from model_registry import ModelRegistry
+
+GB = 1024 ** 3
+
+
+class FakeEntry:
+    def __init__(self, name, memory_bytes):
+        self.name = name
+        self.memory_bytes = memory_bytes
+        self.in_use = 0
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_room_is_made_before_a_new_model_loads():
+    sizes = {"small": 2 * GB, "large": 3 * GB}
+    loaded_while = {}  # name -> models resident when its load started
+    registry = None
+
+    def loader(name):
+        loaded_while[name] = [entry.name for entry in registry.loaded()]
+        return FakeEntry(name, sizes[name])
+
+    registry = ModelRegistry(loader, ["small", "large"], "small", memory_budget=4 * GB, estimator=sizes.get)
+
+    async def main():
+        registry.release(await registry.acquire("small"))
+        registry.release(await registry.acquire("large"))
+
+    asyncio.run(main())
+    assert loaded_while["large"] == []  # "small" was evicted first, so memory never held both
+    assert [entry.name for entry in registry.loaded()] == ["large"]
+
+
+def test_a_failing_estimate_falls_back_to_evicting_after_the_load():
+    def estimator(name):
+        raise OSError("offline")
+
+    registry = ModelRegistry(lambda name: FakeEntry(name, 3 * GB), ["a", "b"], "a", memory_budget=4 * GB, estimator=estimator)
+
+    async def main():
+        registry.release(await registry.acquire("a"))
+        registry.release(await registry.acquire("b"))
+
+    asyncio.run(main())
+    assert [entry.name for entry in registry.loaded()] == ["b"]
@@ -0,0 +1,140 @@
+import asyncio
+import time
+
+import aiohttp
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from http_client import HttpClient
+from replica_pool import ReplicaBusyError, ReplicaPool
+
+
+class Replica:
+    """
+    A stub inference server: /generate waits for `release` and answers `status`,
+    /ready answers 200 while `healthy`.
+    """
+    def __init__(self, port=None):
+        self.status = 200
+        self.healthy = True
+        self.release = asyncio.Event()
+        self.release.set()
+        self.requests = 0
+        app = web.Application()
+        app.router.add_post("/generate", self.generate)
+        app.router.add_get("/ready", self.ready)
+        self.server = TestServer(app, port=port)
+
+    async def generate(self, request):
+        self.requests += 1
+        await self.release.wait()
+        return web.json_response({"response": "ok"}, status=self.status)
+
+    async def ready(self, request):
+        return web.json_response({}, status=200 if self.healthy else 503)
+
+    @property
+    def url(self):
+        return str(self.server.make_url(""))
+
+
+async def generate(pool, client):
+    """
+    One request through the pool, the way the bot sends them.
+    """
+    async with pool.acquire() as replica:
+        response = await client.post(f"{replica.url}/generate", json={"query": "hi"}, retries=0)
+        if response.status == 503:
+            raise ReplicaBusyError(replica.url)
+        return replica
+
+
+def run_with_replicas(count, test, **options):
+    async def main():
+        replicas = [Replica() for _ in range(count)]
+        client = HttpClient(retries=0)
+        for replica in replicas:
+            await replica.server.start_server()
+        try:
+            pool = ReplicaPool([replica.url for replica in replicas], client, **options)
+            await test(pool, client, replicas)
+        finally:
+            await client.close()
+            for replica in replicas:
+                await replica.server.close()
+
+    asyncio.run(main())
+
+
+def test_requests_go_to_the_least_loaded_replica():
+    async def test(pool, client, replicas):
+        replicas[0].release.clear()
+        replicas[1].release.clear()
+        first = asyncio.create_task(generate(pool, client))
+        while sum(r.requests for r in replicas) < 1:
+            await asyncio.sleep(0.01)
+        second = asyncio.create_task(generate(pool, client))
+        while sum(r.requests for r in replicas) < 2:
+            await asyncio.sleep(0.01)
+        assert [r.requests for r in replicas] == [1, 1]  # The busy replica was skipped
+        assert sorted(r.outstanding for r in pool.replicas) == [1, 1]
+        for replica in replicas:
+            replica.release.set()
+        assert {(await first).url, (await second).url} == {r.url for r in pool.replicas}
+        assert [r.outstanding for r in pool.replicas] == [0, 0]
+
+    run_with_replicas(2, test)
+
+
+def test_unreachable_replica_is_ejected_and_recovers():
+    async def test(pool, client, replicas):
+        down, up = pool.replicas
+        await replicas[0].server.close()
+        for _ in range(2):
+            with pytest.raises(aiohttp.ClientConnectionError):
+                async with pool.acquire(exclude=[up]) as replica:
+                    await client.post(f"{replica.url}/generate", retries=0)
+        assert not down.available(time.monotonic())
+        for _ in range(4):
+            assert await generate(pool, client) is up
+
+        # Back up: after the cooldown the health loop probes it and it takes traffic again
+        replicas[0] = Replica(port=int(down.url.rsplit(":", 1)[1]))
+        await replicas[0].server.start_server()
+        await asyncio.sleep(0.5)
+        assert down.available(time.monotonic())
+        assert await pool.check(down)
+        assert down.failures == 0 and down.ejected_until == 0.0
+        up.outstanding += 1  # Busy, so the recovered replica is the least loaded
+        assert pool.pick() is down
+        up.outstanding -= 1
+
+    run_with_replicas(2, test, max_failures=2, cooldown=0.5)
+
+
+def test_failed_health_checks_eject_a_replica():
+    async def test(pool, client, replicas):
+        replica = pool.replicas[0]
+        replicas[0].healthy = False
+        for _ in range(2):
+            assert not await pool.check(replica)
+        assert replica.ejected_until > 0
+        replicas[0].healthy = True
+        assert await pool.check(replica)
+        assert replica.failures == 0
+
+    run_with_replicas(1, test, max_failures=2, cooldown=30)
+
+
+def test_a_full_queue_counts_as_a_failure():
+    async def test(pool, client, replicas):
+        replicas[0].status = 503
+        replica = pool.replicas[0]
+        replica.failures = 1
+        with pytest.raises(ReplicaBusyError):
+            await generate(pool, client)
+        assert replica.failures == 2  # Not reset as a success would
+        assert replica.outstanding == 0
+
+    run_with_replicas(1, test, max_failures=3)
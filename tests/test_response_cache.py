@@ -0,0 +1,62 @@
+import asyncio
+import json
+import os
+import time
+
+from response_cache import ResponseCache
+
+
+def counting_compute(calls):
+    async def compute():
+        calls.append(None)
+        n = len(calls)
+        await asyncio.sleep(0.05)
+        return f"answer {n}"
+    return compute
+
+
+def test_concurrent_misses_share_one_computation():
+    cache, calls = ResponseCache(), []
+
+    async def main():
+        compute = counting_compute(calls)
+        return await asyncio.gather(*(cache.get_or_compute("key", compute) for _ in range(3)))
+
+    assert asyncio.run(main()) == [("answer 1", False)] * 3
+    assert len(calls) == 1 and cache.coalesced == 2
+
+
+def test_uncoalesced_callers_compute_on_their_own():
+    cache, calls = ResponseCache(), []
+
+    async def main():
+        compute = counting_compute(calls)
+        return await asyncio.gather(
+            cache.get_or_compute("key", compute, coalesce=False),
+            cache.get_or_compute("key", compute),  # Does not join the call above
+        )
+
+    assert asyncio.run(main()) == [("answer 1", False), ("answer 2", False)]
+    assert len(calls) == 2 and cache.coalesced == 0
+
+
+def test_disk_tier_keeps_the_newest_files_under_its_limit(tmp_path):
+    cache = ResponseCache(disk_dir=str(tmp_path), max_disk_entries=10)
+    written = time.time() - 100
+    for i in range(25):
+        cache.put(f"key{i}", f"answer {i}")
+        os.utime(tmp_path / f"key{i}.json", (written + i, written + i))  # One second apart
+    files = sorted(os.listdir(tmp_path))
+    assert 9 <= len(files) <= 10
+    assert "key24.json" in files and "key0.json" not in files
+    assert cache.stats()["disk_entries"] == len(files)
+
+
+def test_expired_files_are_swept_on_the_first_write(tmp_path):
+    stale = tmp_path / "stale.json"
+    stale.write_text(json.dumps({"expires_at": 0, "value": "old"}))
+    os.utime(stale, (0, 0))
+    cache = ResponseCache(disk_dir=str(tmp_path), ttl=60)
+    cache.put("key", "answer")
+    assert os.listdir(tmp_path) == ["key.json"]
+    assert ResponseCache(disk_dir=str(tmp_path)).get("key") == "answer"
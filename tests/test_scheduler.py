@@ -0,0 +1,140 @@
+import asyncio
+import os
+
+import pytest
+import torch
+
+from benchmarks.stub_model import CORPUS, build_stub_model
+from scheduler import ContinuousBatchScheduler
+
+PROMPTS = [
+    "Query: what is retrieval augmented generation?\nAnswer:",
+    "def calculate_sum(a, b):",
+    "### Context: documents, chunks and vectors.\nQuery: daily",
+    "tokens",
+]
+
+
+def greedy(model, tokenizer, prompt, max_new_tokens):
+    """
+    What model.generate answers on its own: the prompt followed by the greedy continuation.
+    """
+    ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+    with torch.no_grad():
+        out = model.generate(ids, max_new_tokens=max_new_tokens, do_sample=False)
+    return prompt + tokenizer.decode(out[0, ids.shape[1]:], skip_special_tokens=True)
+
+
+@pytest.fixture
+def scheduler(tiny_model):
+    model, tokenizer = tiny_model
+    scheduler = ContinuousBatchScheduler(model, tokenizer, max_batch_size=4, batch_window=0.05)
+    yield scheduler
+    scheduler.close()
+
+
+def test_concurrent_requests_match_greedy(tiny_model, scheduler):
+    model, tokenizer = tiny_model
+    lengths = [12, 5, 20, 1]
+
+    async def main():
+        return await asyncio.gather(*(
+            scheduler.submit(prompt, max_new_tokens=n) for prompt, n in zip(PROMPTS, lengths)
+        ))
+
+    results = asyncio.run(main())
+    for prompt, n, (text, stats) in zip(PROMPTS, lengths, results):
+        assert text == greedy(model, tokenizer, prompt, n)
+        assert stats["finish_reason"] == "length"
+
+
+def test_requests_joining_mid_decode_match_greedy(tiny_model, scheduler):
+    model, tokenizer = tiny_model
+
+    async def main():
+        pieces, _ = scheduler.stream(PROMPTS[0], max_new_tokens=60)
+        first = [await pieces.__anext__() for _ in range(3)]  # The first request is decoding
+        late = asyncio.gather(
+            scheduler.submit(PROMPTS[1], max_new_tokens=8),
+            scheduler.submit(PROMPTS[2], max_new_tokens=15),
+        )
+        rest = [piece async for piece in pieces]
+        return PROMPTS[0] + "".join(first + rest), await late
+
+    streamed, late = asyncio.run(main())
+    assert streamed == greedy(model, tokenizer, PROMPTS[0], 60)
+    assert late[0][0] == greedy(model, tokenizer, PROMPTS[1], 8)
+    assert late[1][0] == greedy(model, tokenizer, PROMPTS[2], 15)
+
+
+def test_registered_prefix_matches_greedy(tiny_model, scheduler):
+    model, tokenizer = tiny_model
+    prefix = "### Context: documents, chunks, vectors, tokens, batches and queues.\n"
+    prompts = [prefix + "Query: what is a chunk?\nAnswer:", prefix + "def"]
+    assert scheduler.register_prefix(prefix) > 0
+
+    async def main():
+        return await asyncio.gather(*(scheduler.submit(prompt, max_new_tokens=10) for prompt in prompts))
+
+    results = asyncio.run(main())
+    for prompt, (text, _) in zip(prompts, results):
+        assert text == greedy(model, tokenizer, prompt, 10)
+    assert scheduler.prefix_stats()["prefix_hits"] == len(prompts)
+
+
+def test_stop_sequence_cuts_the_answer(tiny_model, scheduler):
+    model, tokenizer = tiny_model
+    prompt = PROMPTS[0]
+    answer = greedy(model, tokenizer, prompt, 20)[len(prompt):]
+    stop = answer[6:9]
+    assert stop
+
+    text, stats = asyncio.run(scheduler.submit(prompt, max_new_tokens=20, stop=[stop]))
+    assert text == prompt + answer[:answer.index(stop)]
+    assert stats["finish_reason"] == "stop"
+
+
+def context_prompt(context, query):
+    from app import InferenceRequest, build_prompt
+
+    return build_prompt(InferenceRequest(query=query), context=context)
+
+
+def test_context_header_prefix_hits_with_llama3_pretokenizer():
+    from app import CONTEXT_PROMPT_HEADER
+
+    prompts = [
+        context_prompt("Chunks are stored as vectors.", "what is a chunk?"),
+        context_prompt("- daily\n- weekly", "how often?"),  # Context starting with punctuation
+        context_prompt("\nQueues hold requests.", "what is a queue?"),  # ... or a blank line
+    ]
+    model, tokenizer = build_stub_model(corpus=CORPUS + " " + " ".join(prompts), llama3_pretokenizer=True, bos=True)
+    scheduler = ContinuousBatchScheduler(model, tokenizer, max_batch_size=4, batch_window=0.05)
+    try:
+        scheduler.register_prefix(CONTEXT_PROMPT_HEADER)
+
+        async def main():
+            return await asyncio.gather(*(scheduler.submit(prompt, max_new_tokens=8) for prompt in prompts))
+
+        results = asyncio.run(main())
+    finally:
+        scheduler.close()
+    for prompt, (text, _) in zip(prompts, results):
+        assert text == greedy(model, tokenizer, prompt, 8)
+    assert scheduler.prefix_stats()["prefix_hits"] == len(prompts)
+
+
+def test_context_header_is_a_token_prefix_with_the_real_tokenizer():
+    from transformers import AutoTokenizer
+
+    from app import CONTEXT_PROMPT_HEADER
+
+    name = "meta-llama/Llama-3.2-3B-Instruct"
+    token = os.getenv("hgf_access_token")  # The gated repo needs it unless the tokenizer is cached
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(name, token=token, local_files_only=not token)
+    except OSError:
+        pytest.skip(f"{name} tokenizer is not available")
+    header = tokenizer(CONTEXT_PROMPT_HEADER)["input_ids"]
+    ids = tokenizer(context_prompt("Chunks are stored as vectors.", "what is a chunk?"))["input_ids"]
+    assert ids[:len(header)] == header
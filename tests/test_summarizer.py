@@ -0,0 +1,24 @@
+import asyncio
+
+import pytest
+
+from response_cache import ResponseCache
+from summarizer import IncompleteSummaryError, MapReduceSummarizer
+
+
+def test_unanswered_prompts_are_resumed():
+    calls = []
+
+    async def generate_batch(prompts, max_new_tokens):
+        calls.append(len(prompts))
+        # The first call runs out of time after two answers, like /batch_generate past its deadline
+        if len(calls) == 1:
+            return ["summary one", "summary two"] + [None] * (len(prompts) - 2)
+        return ["summary"] * len(prompts)
+
+    summarizer = MapReduceSummarizer(generate_batch, cache=ResponseCache(), batch_size=8)
+    chunks = [f"part {i}" for i in range(4)]
+    with pytest.raises(IncompleteSummaryError):
+        asyncio.run(summarizer.summarize(chunks))
+    assert asyncio.run(summarizer.summarize(chunks)) == "summary"
+    assert calls[:2] == [4, 2]  # The retry only generates the two missing summaries
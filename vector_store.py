@@ -0,0 +1,299 @@
+import json
+import os
+import re
+import threading
+
+import numpy as np
+
+from keyword_index import BM25Index
+
+# faiss is imported on first use so importing this module stays cheap (see app/bot cold start)
+_faiss = None
+
+
+def _lib():
+    global _faiss
+    if _faiss is None:
+        import faiss
+        _faiss = faiss
+    return _faiss
+
+
+def build_index(kind, vectors, ids, nlist=None, hnsw_m=32):
+    """
+    Builds a cosine-similarity index of the given kind ("flat", "ivf" or "hnsw") over
+    L2-normalized float32 `vectors` with int64 `ids`.
+    """
+    faiss = _lib()
+    dim = vectors.shape[1]
+    if kind == "flat":
+        index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+    elif kind == "hnsw":
+        graph = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        graph.hnsw.efConstruction = 80
+        index = faiss.IndexIDMap2(graph)
+    elif kind == "ivf":
+        # ~4*sqrt(n) lists, with enough training points per list for k-means
+        nlist = nlist or max(1, min(int(4 * len(vectors) ** 0.5), len(vectors) // 39))
+        index = faiss.IndexIVFFlat(faiss.IndexFlatIP(dim), dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        index.train(vectors)
+        index.set_direct_map_type(faiss.DirectMap.Hashtable)  # Lets us reconstruct by id when rebuilding
+    else:
+        raise ValueError(f"Unknown index type: {kind}")
+    if len(vectors):
+        index.add_with_ids(vectors, ids)
+    return index
+
+
+class _Namespace:
+    def __init__(self, kind, index, docs, next_id, mapped=False):
+        self.kind = kind
+        self.index = index
+        self.docs = docs          # id -> {"text": ..., "metadata": {...}}; only live documents
+        self.next_id = next_id
+        self.mapped = mapped      # Index is memory-mapped from disk and must be copied before writes
+        self.keywords = None      # BM25Index over docs, built on the first keyword search
+
+    @property
+    def dead(self):
+        # Deleted vectors still in the index (HNSW can't remove; they are filtered at search time)
+        return self.index.ntotal - len(self.docs)
+
+
+class VectorStore:
+    """
+    Local FAISS vector index, split into namespaces (e.g. one per guild or user).
+
+    Vectors are compared by cosine similarity. A namespace starts as an exact flat
+    index and is rebuilt as `index_type` ("ivf" or "hnsw") once it holds
+    `ann_threshold` vectors; pass "flat" to always search exactly.
+
+    With a `directory`, each namespace is saved there by save() and memory-mapped
+    when it is first used after a restart, so nothing has to be re-embedded.
+    keyword_search() ranks the same documents by BM25 instead of by vector.
+    All methods are blocking and thread-safe; call them through asyncio.to_thread.
+    """
+    def __init__(self, directory=None, index_type="hnsw", ann_threshold=20000, nprobe=16, ef_search=128, hnsw_m=32):
+        self.directory = directory
+        self.index_type = index_type
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self._namespaces = {}
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def namespaces(self):
+        with self._lock:
+            names = set(self._namespaces)
+            if self.directory:
+                for name in os.listdir(self.directory):
+                    if os.path.exists(os.path.join(self.directory, name, "docs.json")):
+                        names.add(name)
+            return sorted(names)
+
+    def count(self, namespace):
+        with self._lock:
+            ns = self._get(namespace)
+            return len(ns.docs) if ns else 0
+
+    def add(self, namespace, vectors, texts, metadatas=None):
+        """
+        Adds one vector per text. Returns the ids assigned to them.
+        """
+        vectors = self._normalized(vectors)
+        metadatas = metadatas or [{} for _ in texts]
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None:
+                ns = _Namespace("flat", build_index("flat", vectors[:0], np.empty(0, dtype="int64")), {}, 0)
+                self._namespaces[namespace] = ns
+            self._writable(namespace, ns)
+
+            ids = np.arange(ns.next_id, ns.next_id + len(texts), dtype="int64")
+            ns.index.add_with_ids(vectors, ids)
+            ns.next_id += len(texts)
+            for doc_id, text, metadata in zip(ids.tolist(), texts, metadatas):
+                ns.docs[doc_id] = {"text": text, "metadata": metadata}
+            if ns.keywords is not None:
+                ns.keywords.add(ids.tolist(), texts)
+
+            if ns.kind == "flat" and self.index_type != "flat" and len(ns.docs) >= self.ann_threshold:
+                self.rebuild(namespace, self.index_type)
+            return ids.tolist()
+
+    def delete(self, namespace, ids):
+        """
+        Removes documents by id. Returns how many were removed.
+        """
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None:
+                return 0
+            ids = [doc_id for doc_id in ids if doc_id in ns.docs]
+            if not ids:
+                return 0
+            self._writable(namespace, ns)
+            for doc_id in ids:
+                del ns.docs[doc_id]
+            if ns.keywords is not None:
+                ns.keywords.remove(ids)
+            if ns.kind == "hnsw":
+                if ns.dead > ns.index.ntotal // 5:
+                    self.rebuild(namespace)  # Compact once a fifth of the graph is dead
+            else:
+                ns.index.remove_ids(np.array(ids, dtype="int64"))
+            return len(ids)
+
+    def delete_where(self, namespace, **metadata):
+        """
+        Removes every document whose metadata contains all the given key/values.
+        """
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None:
+                return 0
+            ids = [
+                doc_id for doc_id, doc in ns.docs.items()
+                if all(doc["metadata"].get(key) == value for key, value in metadata.items())
+            ]
+            return self.delete(namespace, ids)
+
+    def search(self, namespace, vectors, k=5):
+        """
+        Returns, for each query vector, up to k hits best first:
+        {"id", "text", "metadata", "score"} with score the cosine similarity.
+        """
+        vectors = self._normalized(vectors)
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None or not ns.docs:
+                return [[] for _ in range(len(vectors))]
+            fetch = min(k + ns.dead, ns.index.ntotal)
+            scores, ids = ns.index.search(vectors, fetch)
+
+            results = []
+            for row_scores, row_ids in zip(scores, ids):
+                hits = []
+                for score, doc_id in zip(row_scores.tolist(), row_ids.tolist()):
+                    doc = ns.docs.get(doc_id)
+                    if doc is None:
+                        continue  # Padding (-1) or a deleted HNSW entry
+                    hits.append({"id": doc_id, "text": doc["text"], "metadata": doc["metadata"], "score": score})
+                    if len(hits) == k:
+                        break
+                results.append(hits)
+            return results
+
+    def keyword_search(self, namespace, queries, k=5):
+        """
+        Returns, for each query string, up to k BM25 hits best first, shaped like search()'s
+        with score the BM25 score. The keyword index is built from the stored texts
+        the first time a namespace is searched this way and kept up to date after that.
+        """
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None or not ns.docs:
+                return [[] for _ in queries]
+            if ns.keywords is None:
+                ns.keywords = BM25Index()
+                ns.keywords.add(list(ns.docs), [doc["text"] for doc in ns.docs.values()])
+            return [
+                [
+                    {"id": doc_id, "text": ns.docs[doc_id]["text"], "metadata": ns.docs[doc_id]["metadata"], "score": score}
+                    for doc_id, score in ns.keywords.search(query, k)
+                ]
+                for query in queries
+            ]
+
+    def rebuild(self, namespace, kind=None):
+        """
+        Rebuilds a namespace's index from its live vectors, optionally as another kind.
+        """
+        with self._lock:
+            ns = self._get(namespace)
+            kind = kind or ns.kind
+            ids = np.array(sorted(ns.docs), dtype="int64")
+            vectors = ns.index.reconstruct_batch(ids) if len(ids) else np.empty((0, ns.index.d), dtype="float32")
+            if kind == "ivf" and len(ids) < 39:
+                kind = "flat"  # Too few points to train IVF centroids
+            ns.index = build_index(kind, vectors, ids, hnsw_m=self.hnsw_m)
+            ns.kind = kind
+            ns.mapped = False
+            self._tune(ns)
+
+    def save(self, namespace):
+        """
+        Writes a namespace to `directory` (index file plus documents), atomically.
+        """
+        if not self.directory:
+            return
+        faiss = _lib()
+        with self._lock:
+            ns = self._get(namespace)
+            if ns is None:
+                return
+            path = self._path(namespace)
+            os.makedirs(path, exist_ok=True)
+            index_path = os.path.join(path, "index.faiss")
+            docs_path = os.path.join(path, "docs.json")
+
+            if ns.mapped:
+                # A mapped index can't be written over its own file; copy it into memory first
+                self._writable(namespace, ns)
+            faiss.write_index(ns.index, f"{index_path}.tmp")
+            with open(f"{docs_path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({"kind": ns.kind, "next_id": ns.next_id, "docs": ns.docs}, f)
+            os.replace(f"{index_path}.tmp", index_path)
+            os.replace(f"{docs_path}.tmp", docs_path)
+
+    def _get(self, namespace):
+        ns = self._namespaces.get(namespace)
+        if ns is None and self.directory:
+            ns = self._load(namespace)
+            if ns is not None:
+                self._namespaces[namespace] = ns
+        return ns
+
+    def _load(self, namespace):
+        path = self._path(namespace)
+        docs_path = os.path.join(path, "docs.json")
+        if not os.path.exists(docs_path):
+            return None
+        faiss = _lib()
+        with open(docs_path, "r", encoding="utf-8") as f:
+            saved = json.load(f)
+        index = faiss.read_index(os.path.join(path, "index.faiss"), self._mmap_flag(saved["kind"]))
+        docs = {int(doc_id): doc for doc_id, doc in saved["docs"].items()}
+        ns = _Namespace(saved["kind"], index, docs, saved["next_id"], mapped=True)
+        self._tune(ns)
+        return ns
+
+    def _writable(self, namespace, ns):
+        if ns.mapped:
+            ns.index = _lib().read_index(os.path.join(self._path(namespace), "index.faiss"))
+            ns.mapped = False
+            self._tune(ns)
+
+    def _tune(self, ns):
+        faiss = _lib()
+        if ns.kind == "ivf":
+            ns.index.nprobe = self.nprobe
+        elif ns.kind == "hnsw":
+            faiss.downcast_index(ns.index.index).hnsw.efSearch = self.ef_search
+
+    def _mmap_flag(self, kind):
+        faiss = _lib()
+        # IVF maps its inverted lists; flat and HNSW map their vector storage in place
+        return faiss.IO_FLAG_MMAP if kind == "ivf" else faiss.IO_FLAG_MMAP_IFC
+
+    def _path(self, namespace):
+        return os.path.join(self.directory, re.sub(r"[^A-Za-z0-9_.-]", "_", namespace))
+
+    @staticmethod
+    def _normalized(vectors):
+        vectors = np.array(vectors, dtype="float32", ndmin=2)  # Copy, so callers' arrays are untouched
+        _lib().normalize_L2(vectors)
+        return vectors